@@ -0,0 +1,29 @@
+-- Chave da linha na origem (Chile: NUMENCRIPTADO|NUMITEM), usada no upsert e
+-- na remoção do --delta. Escrita de forma idempotente para também poder ser
+-- aplicada com `prisma db execute` em bases criadas por `prisma db push`.
+
+-- AlterTable
+ALTER TABLE "imports" ADD COLUMN IF NOT EXISTS "rowKey" VARCHAR(120);
+
+-- Backfill: linhas do Chile já gravadas recebem a mesma chave que o
+-- data-transformer calcula (NUMITEM ausente ou JSON null vira '')
+UPDATE "imports" i
+SET "rowKey" = LEFT(
+      (i."rawData"->>'NUMENCRIPTADO') || '|' || COALESCE(i."rawData"->>'NUMITEM', ''),
+      120)
+FROM "countries" c
+WHERE c."id" = i."countryId"
+  AND c."code" = 'CL'
+  AND i."rowKey" IS NULL
+  AND COALESCE(i."rawData"->>'NUMENCRIPTADO', '') <> '';
+
+-- Duplicatas da mesma linha (gravadas antes da chave): fica a mais recente
+DELETE FROM "imports" i
+USING "imports" j
+WHERE i."rowKey" IS NOT NULL
+  AND i."countryId" = j."countryId"
+  AND i."rowKey" = j."rowKey"
+  AND (i."updatedAt", i."id") < (j."updatedAt", j."id");
+
+-- CreateIndex
+CREATE UNIQUE INDEX IF NOT EXISTS "imports_countryId_rowKey_key" ON "imports"("countryId", "rowKey");
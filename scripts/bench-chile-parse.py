@@ -0,0 +1,58 @@
+"""
+Benchmark do parser do Chile (write_array_stream): mede linhas/s sobre um
+arquivo mensal. Sem argumento, gera um arquivo sintético com o layout das
+COLUMN_NAMES (separador ';', latin-1, campos com espaços e vazios).
+
+Uso:
+  python scripts/bench-chile-parse.py [arquivo.txt] [--rows 200000] [--workers N]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "bot" / "chile"))
+import robo_chile  # noqa: E402
+
+
+def gerar_sintetico(path: Path, rows: int):
+    rnd = random.Random(0)
+    n = len(robo_chile.COLUMN_NAMES)
+    with open(path, "w", encoding="latin-1", newline="\n") as f:
+        for i in range(rows):
+            vals = []
+            for j in range(n):
+                r = rnd.random()
+                if r < 0.4:
+                    vals.append("")
+                elif r < 0.7:
+                    vals.append(f" {rnd.randint(0, 99999)} ")
+                else:
+                    vals.append(f"TXT{j} ÑANDU {i % 97}")
+            f.write(";".join(vals) + "\n")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("arquivo", nargs="?")
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--workers", type=int, default=1, help="processos de parse (fatias do arquivo)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(args.arquivo) if args.arquivo else Path(td) / "mes_sintetico.txt"
+        if not args.arquivo:
+            gerar_sintetico(src, args.rows)
+        out = Path(td) / "resultados_array.json"
+        t0 = time.perf_counter()
+        with open(out, "wb") as fh:
+            total = robo_chile.write_array_stream([src], [], robo_chile.JsonArraySink(fh), 2024, 1, None, False,
+                                                   workers=args.workers)
+        dt = time.perf_counter() - t0
+        print(f"{src.name}: {total} linhas em {dt:.1f}s -> {total / dt:,.0f} linhas/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark da extração do Peru (parse_html + extrair_tabela_html): mede
+registros/s sobre páginas de resultado salvas (page_source do Aduanet).
+Sem argumento, gera páginas sintéticas com a tabela de CAMPOS (layout com
+tabelas de menu, cabeçalho em <th>, entidades, <br> e tags em linha).
+
+Com --selenium, abre cada página no Chrome headless (file://) e compara com
+a leitura antiga, uma chamada ao WebDriver por linha e por célula.
+
+Uso:
+  python scripts/bench-peru-parse.py [pagina.html ...] [--pages 20] [--rows 200] [--selenium]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src" / "bot" / "peru"))
+import robo_aduanet  # noqa: E402
+
+
+def gerar_sintetico(path: Path, rows: int, seed: int):
+    rnd = random.Random(seed)
+    n = len(robo_aduanet.CAMPOS) - 1
+    cab = "".join(f"<th>{c}</th>" for c in robo_aduanet.CAMPOS[:n])
+    linhas = []
+    for i in range(rows):
+        tds = []
+        for j in range(n):
+            r = rnd.random()
+            if r < 0.2:
+                tds.append("<td>&nbsp;</td>")
+            elif r < 0.6:
+                tds.append(f'<td align="right"> {rnd.randint(0, 999999)}.{rnd.randint(0, 99):02d} </td>')
+            elif r < 0.8:
+                tds.append(f"<td><font size=1>DESC {j} AÑO {i % 97}<br>LINHA 2</font></td>")
+            else:
+                tds.append(f"<td>118-2024-10-{rnd.randint(0, 999999):06d}</td>")
+        linhas.append("<tr>" + "\n".join(tds) + "</tr>")
+    html = (
+        "<html><head><title>Consulta</title></head><body>"
+        "<table><tr><td><a href='/menu'>Inicio</a></td><td>Menu</td></tr></table>"
+        f"<table border=1><tr>{cab}</tr>\n" + "\n".join(linhas) + "</table>"
+        "<a href='ConsImpoIAServlet?accion=pag&p=2'>Siguiente</a></body></html>"
+    )
+    path.write_text(html, encoding="latin-1")
+
+
+def ler(path: Path) -> str:
+    b = path.read_bytes()
+    try:
+        return b.decode("utf-8")
+    except UnicodeDecodeError:
+        return b.decode("latin-1")
+
+
+def extrair_por_celula(driver):
+    """Leitura antiga: .text de cada tabela, find_elements por linha e .text por célula."""
+    from selenium.webdriver.common.by import By
+    melhor, melhor_score = None, -1
+    for t in driver.find_elements(By.TAG_NAME, "table"):
+        txt = (t.text or "").lower()
+        score = sum(ch in txt for ch in ["declar", "import", "partida", "fob"]) * 10000 + len(txt)
+        if score > melhor_score:
+            melhor, melhor_score = t, score
+    registros = []
+    if melhor is None:
+        return registros
+    n = len(robo_aduanet.CAMPOS) - 1
+    for tr in melhor.find_elements(By.TAG_NAME, "tr"):
+        tds = tr.find_elements(By.TAG_NAME, "td")
+        if len(tds) >= n:
+            registros.append({robo_aduanet.CAMPOS[i]: (tds[i].text or "").strip() for i in range(n)})
+    return registros
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paginas", nargs="*")
+    ap.add_argument("--pages", type=int, default=20, help="páginas sintéticas")
+    ap.add_argument("--rows", type=int, default=200, help="registros por página sintética")
+    ap.add_argument("--selenium", action="store_true", help="compara com a leitura célula a célula no Chrome")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as td:
+        paginas = [Path(p) for p in args.paginas]
+        if not paginas:
+            for k in range(args.pages):
+                paginas.append(Path(td) / f"pagina_{k:03d}.html")
+                gerar_sintetico(paginas[-1], args.rows, k)
+        htmls = [ler(p) for p in paginas]
+        mb = sum(len(h) for h in htmls) / 1e6
+
+        t0 = time.perf_counter()
+        total = sum(len(robo_aduanet.extrair_tabela_html(robo_aduanet.parse_html(h))) for h in htmls)
+        dt = time.perf_counter() - t0
+        print(f"uma passada: {len(htmls)} páginas ({mb:.1f} MB), {total} registros em {dt:.2f}s "
+              f"-> {total / dt:,.0f} registros/s")
+
+        if args.selenium:
+            driver = robo_aduanet.criar_driver(headless=True)
+            try:
+                t_sel = t_cel = 0.0
+                total_cel = iguais = 0
+                for p in paginas:
+                    driver.get(p.resolve().as_uri())
+                    t0 = time.perf_counter()
+                    novos = robo_aduanet.extrair_tabela(driver)
+                    t_sel += time.perf_counter() - t0
+                    t0 = time.perf_counter()
+                    antigos = extrair_por_celula(driver)
+                    t_cel += time.perf_counter() - t0
+                    total_cel += len(antigos)
+                    iguais += sum(a == {k: v for k, v in b.items() if k not in ("state", "country_code")}
+                                  for a, b in zip(antigos, novos))
+                print(f"page_source + uma passada: {total / t_sel:,.0f} registros/s")
+                print(f"célula a célula (WebDriver): {total_cel / t_cel:,.0f} registros/s")
+                print(f"registros idênticos: {iguais}/{total_cel}")
+            finally:
+                driver.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,44 @@
 # robo_comex.py
-import os, sys, json, time, urllib.parse
+import os, sys, re, json, time, argparse, urllib.parse, threading, queue, sqlite3, zlib, hashlib, codecs, tempfile
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional
 import requests
 
+try:
+    import fcntl  # trava do checkpoint (POSIX)
+except ImportError:  # Windows: sem trava
+    fcntl = None
+
+# cliente HTTP compartilhado pelos robôs (src/bot/common)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+from http_client import get_client, backoff_delay  # noqa: E402
+
 COMEX_POST_URL = "https://api-comexstat.mdic.gov.br/general?language=pt"
 COMEX_LEGACY_BASE = "http://api.comexstat.mdic.gov.br/general?filter="
 
+# Fan-out: lotes de NCM x janelas de período, em paralelo sob um limite de taxa comum
+NCM_BATCH_DEFAULT = 20
+WORKERS_DEFAULT = 4
+RATE_DEFAULT = float(os.environ.get("COMEX_RATE", "2"))  # requisições/s (todas as threads)
+
+# Cache local das respostas (SQLite)
+CACHE_DIR_DEFAULT = os.environ.get("COMEX_CACHE_DIR", "./data_cache/brasil")
+CACHE_MAX_BYTES_DEFAULT = int(os.environ.get("COMEX_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+CACHE_TTL_DEFAULT = int(os.environ.get("COMEX_CACHE_TTL", "3600"))  # períodos ainda abertos
+# O MDIC publica o mês no início do seguinte e ainda o revisa: um período só
+# é tratado como fechado (resposta imutável) quando termina 2+ meses atrás.
+CLOSED_LAG_MONTHS = 2
+
+# Variantes de consulta, em ordem de prioridade (a mais precisa primeiro)
+VARIANTES = ("ncm8", "hs6", "hs4", "legado")
+# Por quanto tempo uma variante que veio vazia (quando outra respondeu) é pulada para o NCM
+NEGATIVE_TTL_DEFAULT = int(os.environ.get("COMEX_NEGATIVE_TTL", str(24 * 3600)))
+# Sem resposta da variante em curso nesse prazo (s), a próxima é disparada em paralelo
+HEDGE_DELAY_DEFAULT = float(os.environ.get("COMEX_HEDGE_DELAY", "5"))
+HEDGE_DELAY_MIN = 0.05  # --hedge-delay 0 dispara as variantes quase juntas, sem girar em falso
+
 # Garantir saída em UTF-8 mesmo no Windows/PowerShell
 try:
     if hasattr(sys.stdout, "reconfigure"):
@@ -64,6 +96,423 @@ def transformar_registro(it: Dict[str, Any]) -> Dict[str, Any]:
         "pesoNeto": to_float_or_none(it.get("metricKG")),
     }
 
+class TokenBucket:
+    """
+    Limitador de taxa compartilhado pelas threads: `rate` fichas por segundo,
+    até `burst` acumuladas. Um 429 pausa o balde inteiro (todas as threads)
+    pelo Retry-After informado pelo servidor.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = max(rate, 0.01)
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                    self.stamp = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+LIMITER = TokenBucket(RATE_DEFAULT)
+
+# -------- leitura incremental de data.list --------
+STREAM_CHUNK = 64 * 1024
+BLOCK_BYTES = 1024 * 1024  # texto JSON por bloco de itens (validado de uma vez)
+SPOOL_BATCH = 2000  # itens avulsos (add) por bloco no arquivo temporário de Linhas
+_WS = re.compile(r"[ \t\r\n]*")
+_SEP = re.compile(r"[ \t\r\n]*([,\]])")
+
+class _JsonStream:
+    """Texto JSON lido aos pedaços de um iterador de bytes (UTF-8), com cursor."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.dec = codecs.getincrementaldecoder("utf-8")()
+        self.json = json.JSONDecoder()
+        self.s = ""
+        self.i = 0
+        self.eof = False
+
+    def more(self, minimo: int = 1) -> bool:
+        """Acrescenta ao menos `minimo` caracteres (menos no fim); False se nada veio."""
+        if self.eof:
+            return False
+        partes, lidos = [], 0
+        for chunk in self.chunks:
+            if chunk:
+                partes.append(self.dec.decode(chunk))
+                lidos += len(partes[-1])
+                if lidos >= minimo:
+                    break
+        else:
+            partes.append(self.dec.decode(b"", final=True))
+            self.eof = True
+        # descarta o que já foi consumido e junta os pedaços numa cópia só
+        self.s, self.i = self.s[self.i:] + "".join(partes), 0
+        return lidos > 0
+
+    def peek(self) -> str:
+        while True:
+            self.i = _WS.match(self.s, self.i).end()
+            if self.i < len(self.s):
+                return self.s[self.i]
+            if not self.more():
+                raise ValueError("JSON truncado")
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"JSON inesperado: {self.s[self.i:self.i + 40]!r}")
+        self.i += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.json.raw_decode(self.s, self.i)
+                # um número cortado no fim do buffer ("12", "1.", "1e") continua
+                # no próximo pedaço: só vale se o que vem depois é delimitador
+                if self.eof or (end < len(self.s) and self.s[end] in " \t\r\n,]}:"):
+                    self.i = end
+                    return obj
+            except ValueError:
+                if self.eof:
+                    raise
+            self.more()
+
+def _blocos_array(js: "_JsonStream"):
+    """
+    Gera (texto, itens) de blocos de ~BLOCK_BYTES do array no cursor. O fim
+    de bloco é o último "}" seguido de "," ou "]" cujo trecho forma um array
+    JSON válido (um json.loads por bloco, em C, em vez de um decode por
+    item); sem isso (itens que não são objetos, "}" dentro de strings), cai
+    para um item por vez.
+    """
+    js.expect("[")
+    if js.peek() == "]":
+        js.i += 1
+        return
+    while True:
+        if len(js.s) - js.i < BLOCK_BYTES:
+            js.more(BLOCK_BYTES - (len(js.s) - js.i))
+        s, ini = js.s, js.i
+        k = s.rfind("}", ini)
+        for _ in range(3):
+            if k < 0:
+                break
+            m = _SEP.match(s, k + 1)
+            if m:
+                texto = s[ini:k + 1]
+                try:
+                    itens = json.loads("[" + texto + "]")
+                except ValueError:
+                    itens = None
+                if itens is not None:
+                    js.i = m.end()
+                    yield texto, itens
+                    if m.group(1) == "]":
+                        return
+                    break
+            k = s.rfind("}", ini, k)
+        else:
+            k = -1
+        if k < 0 or js.i == ini:
+            item = js.value()
+            yield json.dumps(item, ensure_ascii=False), [item]
+            if js.peek() == "]":
+                js.i += 1
+                return
+            js.expect(",")
+
+def iter_json_blocos(chunks, caminho: Tuple[str, ...] = ("data", "list")):
+    """
+    Gera, em blocos (texto, itens), o array em `caminho` (objetos aninhados
+    a partir da raiz; vazio = a raiz é o array) sem montar o corpo inteiro:
+    só o bloco corrente fica em memória. Chaves fora do caminho são
+    puladas; o que vem depois do array não chega a ser lido.
+    """
+    js = _JsonStream(chunks)
+    if not caminho:
+        yield from _blocos_array(js)
+        return
+    js.expect("{")
+    nivel = 0
+    while True:
+        if js.peek() == "}":
+            return
+        chave = js.value()
+        js.expect(":")
+        if chave == caminho[nivel] and nivel == len(caminho) - 1:
+            if js.peek() == "[":
+                yield from _blocos_array(js)
+            return
+        if chave == caminho[nivel] and js.peek() == "{":
+            js.expect("{")
+            nivel += 1
+            continue
+        js.value()
+        if js.peek() == ",":
+            js.expect(",")
+
+def iter_json_list(chunks, caminho: Tuple[str, ...] = ("data", "list")):
+    """Os itens de iter_json_blocos, um a um."""
+    for _, itens in iter_json_blocos(chunks, caminho):
+        yield from itens
+
+class Linhas:
+    """
+    Linhas de uma resposta num arquivo temporário, guardadas como o texto
+    JSON recebido (um bloco de itens por linha do arquivo): len(), bool() e
+    iteração (sequencial, não reentrante) sem manter a resposta inteira em
+    memória. É o que circula entre consulta, cache, checkpoint e saída;
+    cache e checkpoint gravam o texto direto, sem reserializar.
+    """
+
+    def __init__(self, itens=()):
+        self.fh = tempfile.TemporaryFile()
+        self.n = 0
+        self.avulsos = []
+        for it in itens:
+            self.add(it)
+
+    @classmethod
+    def do_stream(cls, chunks, caminho: Tuple[str, ...] = ("data", "list")) -> "Linhas":
+        linhas = cls()
+        for texto, itens in iter_json_blocos(chunks, caminho):
+            linhas.add_bloco(texto, len(itens))
+        return linhas
+
+    def add(self, it):
+        self.avulsos.append(it)
+        if len(self.avulsos) >= SPOOL_BATCH:
+            self._descarregar()
+
+    def add_bloco(self, texto: str, n: int):
+        self._descarregar()
+        # quebras de linha no texto JSON só podem ser espaço entre tokens
+        self.fh.write(texto.replace("\n", " ").replace("\r", " ").encode("utf-8") + b"\n")
+        self.n += n
+
+    def _descarregar(self):
+        if self.avulsos:
+            bloco, self.avulsos = self.avulsos, []
+            self.add_bloco(json.dumps(bloco, ensure_ascii=False)[1:-1], len(bloco))
+
+    def __len__(self) -> int:
+        return self.n + len(self.avulsos)
+
+    def blocos(self):
+        """Cada bloco como bytes: itens JSON separados por vírgula, sem colchetes."""
+        self._descarregar()
+        self.fh.seek(0)
+        for linha in self.fh:
+            yield linha.rstrip(b"\n")
+
+    def __iter__(self):
+        for bloco in self.blocos():
+            yield from json.loads(b"[" + bloco + b"]")
+
+    def array_json(self):
+        """O conteúdo como array JSON (UTF-8), em pedaços de um bloco cada."""
+        yield b"["
+        for i, bloco in enumerate(self.blocos()):
+            yield bloco if i == 0 else b"," + bloco
+        yield b"]"
+
+    def close(self):
+        self.fh.close()
+
+def _descomprimir(corpo: bytes):
+    d = zlib.decompressobj()
+    for i in range(0, len(corpo), STREAM_CHUNK):
+        yield d.decompress(corpo[i:i + STREAM_CHUNK])
+    yield d.flush()
+
+class ResponseCache:
+    """
+    Respostas da API (lista `data.list`, zlib) em SQLite, pela chave do
+    payload normalizado. Períodos fechados nunca expiram; períodos que
+    tocam os últimos meses, ou respostas vazias, valem por `ttl` segundos.
+    Passando de `max_bytes`, saem as entradas usadas há mais tempo.
+    Acertos/falhas ficam em `hits`/`misses` (execução) e na tabela contadores.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.max_bytes = CACHE_MAX_BYTES_DEFAULT
+        self.ttl = CACHE_TTL_DEFAULT
+
+    def configure(self, cache_dir, max_bytes: int = CACHE_MAX_BYTES_DEFAULT, ttl: int = CACHE_TTL_DEFAULT):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        if not cache_dir:
+            self.db = None
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "respostas.sqlite"), check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS respostas (
+                chave TEXT PRIMARY KEY, corpo BLOB NOT NULL, tamanho INTEGER NOT NULL,
+                expira REAL, usado_em REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS respostas_usado_em ON respostas (usado_em);
+            CREATE TABLE IF NOT EXISTS contadores (nome TEXT PRIMARY KEY, valor INTEGER NOT NULL);
+        """)
+
+    @staticmethod
+    def key(kind: str, obj) -> str:
+        return kind + " " + json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+    @staticmethod
+    def periodo_fechado(p_to: str) -> bool:
+        agora = datetime.now()
+        limite = agora.year * 12 + agora.month - 1 - CLOSED_LAG_MONTHS
+        y, m = (int(x) for x in p_to.split("-"))
+        return y * 12 + m - 1 <= limite
+
+    def _contar(self, nome: str):
+        self.db.execute("INSERT INTO contadores VALUES (?, 1) "
+                        "ON CONFLICT(nome) DO UPDATE SET valor = valor + 1", (nome,))
+
+    def get(self, chave: str):
+        if self.db is None:
+            return None
+        with self.lock, self.db:
+            row = self.db.execute("SELECT corpo, expira FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                self.hits += 1
+                self._contar("hits")
+                self.db.execute("UPDATE respostas SET usado_em = ? WHERE chave = ?", (time.time(), chave))
+                corpo = row[0]
+            else:
+                self.misses += 1
+                self._contar("misses")
+                return None
+        return Linhas.do_stream(_descomprimir(corpo), caminho=())
+
+    def put(self, chave: str, linhas: Linhas, p_to: str):
+        if self.db is None:
+            return
+        # corpo = array JSON comprimido, montado bloco a bloco
+        z = zlib.compressobj()
+        partes = [z.compress(pedaco) for pedaco in linhas.array_json()]
+        partes.append(z.flush())
+        corpo = b"".join(partes)
+        expira = None if (linhas and self.periodo_fechado(p_to)) else time.time() + self.ttl
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?)",
+                            (chave, corpo, len(corpo), expira, time.time()))
+            total = self.db.execute("SELECT COALESCE(SUM(tamanho), 0) FROM respostas").fetchone()[0]
+            if total > self.max_bytes:
+                excesso = total - self.max_bytes
+                for k, tam in self.db.execute(
+                        "SELECT chave, tamanho FROM respostas ORDER BY usado_em").fetchall():
+                    if excesso <= 0:
+                        break
+                    if k != chave:
+                        self.db.execute("DELETE FROM respostas WHERE chave = ?", (k,))
+                        excesso -= tam
+
+    def resumo(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+RESPONSE_CACHE = ResponseCache()
+
+class VariantMemory:
+    """
+    Qual variante respondeu por último para cada NCM (tabela vencedoras) e
+    quais vieram vazias enquanto outra respondia (tabela negativas, por NCM
+    e janela de período, válida por `negative_ttl` segundos): um NCM sem
+    movimento num período continua sendo consultado como NCM-8 nos demais.
+    Fica em <cache-dir>/variantes.sqlite.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.lock = threading.Lock()
+        self.negative_ttl = NEGATIVE_TTL_DEFAULT
+
+    def configure(self, cache_dir, negative_ttl: int = NEGATIVE_TTL_DEFAULT):
+        self.negative_ttl = negative_ttl
+        if not cache_dir:
+            self.db = None
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "variantes.sqlite"), check_same_thread=False)
+        colunas = {r[1] for r in self.db.execute("PRAGMA table_info(negativas)")}
+        if colunas and "janela" not in colunas:
+            # formato antigo (negativa por NCM em qualquer período): descartada
+            self.db.execute("DROP TABLE negativas")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS vencedoras (ncm TEXT PRIMARY KEY, variante TEXT NOT NULL, em REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS negativas (
+                ncm TEXT NOT NULL, janela TEXT NOT NULL, variante TEXT NOT NULL, expira REAL NOT NULL,
+                PRIMARY KEY (ncm, janela, variante));
+        """)
+
+    def preferida(self, ncms: List[str]):
+        """Variante vencedora comum a todos os NCMs do lote (None se não houver)."""
+        if self.db is None:
+            return None
+        with self.lock:
+            q = ",".join("?" * len(ncms))
+            rows = self.db.execute(f"SELECT ncm, variante FROM vencedoras WHERE ncm IN ({q})", ncms).fetchall()
+        variantes = {v for _, v in rows}
+        return variantes.pop() if len(rows) == len(set(ncms)) and len(variantes) == 1 else None
+
+    @staticmethod
+    def janela(p_from: str, p_to: str) -> str:
+        return f"{p_from}..{p_to}"
+
+    def negativas(self, ncms: List[str], p_from: str, p_to: str) -> set:
+        """Variantes ainda marcadas como vazias para todos os NCMs do lote nesta janela."""
+        if self.db is None:
+            return set()
+        with self.lock:
+            q = ",".join("?" * len(ncms))
+            rows = self.db.execute(
+                f"SELECT variante, COUNT(DISTINCT ncm) FROM negativas "
+                f"WHERE ncm IN ({q}) AND janela = ? AND expira > ? GROUP BY variante",
+                (*ncms, self.janela(p_from, p_to), time.time())).fetchall()
+        return {v for v, n in rows if n == len(set(ncms))}
+
+    def registrar(self, ncms: List[str], p_from: str, p_to: str, vencedora: str, vazias: List[str]):
+        if self.db is None:
+            return
+        agora = time.time()
+        janela = self.janela(p_from, p_to)
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO vencedoras VALUES (?, ?, ?)",
+                                [(n, vencedora, agora) for n in ncms])
+            self.db.executemany("DELETE FROM negativas WHERE ncm = ? AND janela = ? AND variante = ?",
+                                [(n, janela, vencedora) for n in ncms])
+            self.db.executemany("INSERT OR REPLACE INTO negativas VALUES (?, ?, ?, ?)",
+                                [(n, janela, v, agora + self.negative_ttl) for n in ncms for v in vazias])
+
+VARIANT_MEMORY = VariantMemory()
+HEDGE_DELAY = HEDGE_DELAY_DEFAULT
+
+def http_client():
+    return get_client(log=eprint)
+
 def tls_verify():
     insecure = os.environ.get("COMEX_INSECURE", "0") == "1"
     ca_bundle = os.environ.get("COMEX_CA_BUNDLE")
@@ -73,44 +522,54 @@ def tls_verify():
         return ca_bundle
     return True
 
-def get_session() -> requests.Session:
-    s = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(max_retries=0)
-    s.mount("https://", adapter); s.mount("http://", adapter)
-    return s
-
-def post_general(payload: Dict[str, Any]) -> Tuple[List[Dict[str,Any]], int, str]:
-    verify = tls_verify()
-    sess = get_session()
-    tries = 3
+def post_general(payload: Dict[str, Any]) -> Tuple["Linhas | list", int, str]:
+    chave = ResponseCache.key("POST", payload)
+    hit = RESPONSE_CACHE.get(chave)
+    if hit is not None:
+        eprint(f"[CACHE] POST {payload['period']['from']}..{payload['period']['to']} rows={len(hit)}")
+        return hit, 200, ""
+    cliente = http_client()
     last_status = 0
     last_text = ""
-    for i in range(tries):
+    for tentativa in range(cliente.tries):
+        no_corpo = False
         try:
-            r = sess.post(
+            # novas tentativas (429/5xx/rede, com Retry-After e backoff) ficam no cliente
+            r = cliente.post(
                 COMEX_POST_URL,
                 json=payload,
                 timeout=60,
-                verify=verify,
+                verify=tls_verify(),
                 headers={"Content-Type": "application/json"},
+                limiter=LIMITER,
+                stream=True,
             )
-            last_status = r.status_code
-            last_text = r.text[:4000]
-            if r.status_code == 429:
-                eprint(f"[POST try {i+1}/{tries}] rate limited 429; dormindo 2s")
-                time.sleep(2.0); continue
-            r.raise_for_status()
-            data = r.json()
-            lst = data.get("data", {}).get("list", [])
-            if isinstance(lst, list):
-                return lst, last_status, last_text
-            return [], last_status, last_text
+            with r:
+                last_status = r.status_code
+                if not r.ok:
+                    # só o começo do corpo, e só em erro
+                    last_text = next(r.iter_content(4000), b"").decode("utf-8", "replace")
+                r.raise_for_status()
+                # data.list lido item a item do stream (sem r.content/r.text do corpo inteiro)
+                no_corpo = True
+                pedacos = r.iter_content(STREAM_CHUNK)
+                lst = Linhas.do_stream(pedacos)
+                for _ in pedacos:
+                    pass  # resto do corpo: a conexão volta ao pool
+            RESPONSE_CACHE.put(chave, lst, payload["period"]["to"])
+            return lst, last_status, last_text
         except requests.exceptions.SSLError as e:
             eprint(f"[TLS] SSLError no POST: {e}")
-            time.sleep(1.0)
+            break
         except Exception as e:
-            eprint(f"[POST try {i+1}/{tries}] err={type(e).__name__} status={last_status}")
-            time.sleep(1.0)
+            eprint(f"[POST] err={type(e).__name__} status={last_status}")
+            if not no_corpo:
+                break
+            # corpo cortado/ilegível depois do 200: não é resposta (nem vazia);
+            # repete como falha de transporte, que o cliente não vê aqui
+            last_status = 0
+            if tentativa < cliente.tries - 1:
+                time.sleep(backoff_delay(tentativa + 1))
     return [], last_status, last_text
 
 def montar_payload_post(ncm_values, p_from, p_to, details=None, metrics=None):
@@ -147,76 +606,648 @@ def build_legacy_filter_json(ncms: List[str], y_from: str, y_to: str, m_from: st
     }
     return legacy
 
-def get_legacy(ncms_raw: List[str], p_from: str, p_to: str) -> List[Dict[str, Any]]:
+def get_legacy(ncms_raw: List[str], p_from: str, p_to: str) -> Tuple["Linhas | list", int]:
     y_from, m_from = p_from.split("-")
     y_to, m_to     = p_to.split("-")
     filt = build_legacy_filter_json(ncms_raw, y_from, y_to, m_from, m_to, True)
     filt_str = json.dumps(filt, ensure_ascii=False)
     url = COMEX_LEGACY_BASE + urllib.parse.quote(filt_str, safe="")
-    verify = tls_verify()
-    sess = get_session()
-    tries = 3
+    chave = ResponseCache.key("GET", filt)
+    hit = RESPONSE_CACHE.get(chave)
+    if hit is not None:
+        eprint(f"[CACHE] LEGACY {p_from}..{p_to} rows={len(hit)}")
+        return hit, 200
     last_status = 0
-    last_text = ""
-    for i in range(tries):
+    try:
+        r = http_client().get(url, timeout=60, verify=tls_verify(), limiter=LIMITER)
+        last_status = r.status_code
+        r.raise_for_status()
+        data = r.json()
+        lst = None
+        if isinstance(data, dict):
+            d = data.get("data")
+            if isinstance(d, list) and d and isinstance(d[0], list):
+                lst = d[0]
+        if not isinstance(lst, list):
+            lst = data.get("data", {}).get("list", [])
+        lst = Linhas(lst if isinstance(lst, list) else [])
+        RESPONSE_CACHE.put(chave, lst, p_to)
+        return lst, last_status
+    except Exception as e:
+        eprint(f"[LEGACY] err={type(e).__name__} status={last_status}")
+    return [], last_status
+
+def consultar_variante(nome: str, ncms_raw: List[str], p_from: str, p_to: str,
+                       details: List[str]) -> Tuple[List[Dict[str, Any]], bool]:
+    """Uma variante; devolve (linhas, respondeu_200)."""
+    if nome == "ncm8":
+        # NCM como string 8 dígitos
+        vals_str = [pad8(x) for x in ncms_raw]
+        lst, st, _ = post_general(montar_payload_post(vals_str, p_from, p_to, details))
+        eprint(f"[POST A] ncm=str8 -> status={st} rows={len(lst)}")
+    elif nome == "hs6":
+        hs6 = sorted({pad8(x)[:6] for x in ncms_raw})
+        lst, st, _ = post_general(montar_payload_post(hs6, p_from, p_to, details=["subHeading","ncm"]))
+        eprint(f"[POST B] subHeading -> status={st} rows={len(lst)}")
+    elif nome == "hs4":
+        hs4 = sorted({pad8(x)[:4] for x in ncms_raw})
+        lst, st, _ = post_general(montar_payload_post(hs4, p_from, p_to, details=["heading","ncm"]))
+        eprint(f"[POST C] heading -> status={st} rows={len(lst)}")
+    else:
+        eprint(f"[LEGACY] {','.join(ncms_raw)} {p_from}..{p_to}: API legada via GET ?filter=")
+        lst, st = get_legacy(ncms_raw, p_from, p_to)
+    return lst, st == 200
+
+def correr_variantes(nomes: List[str], ncms_raw: List[str], p_from: str, p_to: str, details: List[str]):
+    """
+    Corrida escalonada das variantes; devolve (vencedora, linhas, vazias).
+    Começa pela mais precisa e dispara a seguinte quando uma resposta vem
+    vazia/falha ou quando passam HEDGE_DELAY segundos sem resposta — um
+    servidor lento não soma mais 3 x 60 s de timeout por variante, e o caso
+    comum continua custando uma requisição sob o limite de taxa.
+    Vence a de maior prioridade com resposta não vazia: a resposta de uma
+    variante menos precisa só é usada quando as anteriores terminaram sem nada.
+    `vazias` são as anteriores à vencedora que responderam 200 sem linhas.
+    As threads são daemon: uma perdedora ainda em curso não segura a saída
+    do processo (se terminar, a resposta fica no cache). O spool das
+    respostas descartadas (anteriores vazias e perdedoras, inclusive as que
+    chegam depois da decisão) é fechado.
+    """
+    fila = queue.Queue()
+    trava = threading.Lock()
+    encerrada = False
+
+    def fechar(lst):
+        if isinstance(lst, Linhas):
+            lst.close()
+
+    def rodar(nome):
         try:
-            r = sess.get(url, timeout=60, verify=verify)
-            last_status = r.status_code
-            last_text = r.text[:4000]
-            if r.status_code == 429:
-                eprint(f"[LEGACY try {i+1}/{tries}] 429; dormindo 2s")
-                time.sleep(2.0); continue
-            r.raise_for_status()
-            data = r.json()
-            lst = None
-            if isinstance(data, dict):
-                d = data.get("data")
-                if isinstance(d, list) and d and isinstance(d[0], list):
-                    lst = d[0]
-            if not isinstance(lst, list):
-                lst = data.get("data", {}).get("list", [])
-            return lst if isinstance(lst, list) else []
+            item = (nome, *consultar_variante(nome, ncms_raw, p_from, p_to, details))
         except Exception as e:
-            eprint(f"[LEGACY try {i+1}/{tries}] err={type(e).__name__} status={last_status}")
-            time.sleep(1.0)
-    return []
-
-# >>>>>>> CORRIGIDO: agora recebe 'details' e desempacota 3 valores
-def tentar_variantes_post(ncms_raw: List[str], p_from: str, p_to: str, details: List[str]) -> List[Dict[str,Any]]:
-    # 1) NCM como string 8 dígitos
-    vals_str = [pad8(x) for x in ncms_raw]
-    lst, st, _ = post_general(montar_payload_post(vals_str, p_from, p_to, details))
-    eprint(f"[POST A] ncm=str8 -> status={st} rows={len(lst)}")
-    if lst: return lst
-
-    # 2) subHeading (HS6)
-    hs6 = list({pad8(x)[:6] for x in ncms_raw})
-    payload_hs6 = montar_payload_post(hs6, p_from, p_to, details=["subHeading","ncm"])
-    lst, st, _ = post_general(payload_hs6)
-    eprint(f"[POST B] subHeading -> status={st} rows={len(lst)}")
-    if lst: return lst
-
-    # 3) heading (SH4)
-    hs4 = list({pad8(x)[:4] for x in ncms_raw})
-    payload_hs4 = montar_payload_post(hs4, p_from, p_to, details=["heading","ncm"])
-    lst, st, _ = post_general(payload_hs4)
-    eprint(f"[POST C] heading -> status={st} rows={len(lst)}")
-    return lst
+            eprint(f"[VARIANTE] {nome}: {type(e).__name__}")
+            item = (nome, [], False)
+        with trava:
+            if encerrada:
+                fechar(item[1])
+            else:
+                fila.put(item)
+
+    def encerrar(vencedora):
+        nonlocal encerrada
+        with trava:
+            encerrada = True
+        for nome, (lst, _) in feitas.items():
+            if nome != vencedora:
+                fechar(lst)
+        while True:
+            try:
+                fechar(fila.get_nowait()[1])
+            except queue.Empty:
+                break
+
+    disparadas = 0
+
+    def disparar():
+        nonlocal disparadas
+        if disparadas < len(nomes):
+            threading.Thread(target=rodar, args=(nomes[disparadas],), daemon=True).start()
+            disparadas += 1
+
+    disparar()
+    feitas: Dict[str, Tuple[list, bool]] = {}
+    while True:
+        vazias = []
+        for nome in nomes:
+            if nome not in feitas:
+                break
+            lst, ok = feitas[nome]
+            if lst:
+                encerrar(nome)
+                return nome, lst, vazias
+            if ok:
+                vazias.append(nome)
+        else:
+            encerrar(None)
+            return None, [], vazias
+        try:
+            # todas já disparadas: não há o que escalonar, só esperar
+            if disparadas == len(nomes):
+                nome, lst, ok = fila.get()
+            else:
+                nome, lst, ok = fila.get(timeout=HEDGE_DELAY)
+        except queue.Empty:
+            disparar()
+            continue
+        feitas[nome] = (lst, ok)
+        if not lst:
+            disparar()
+
+def tentar_variantes(ncms_raw: List[str], p_from: str, p_to: str,
+                     details: List[str]) -> Tuple[list, bool, Optional[str], List[str]]:
+    """
+    NCM-8, subHeading (HS6), heading (HS4) e API legada, em corrida escalonada.
+    Variantes com negativa vigente para todo o lote nesta janela são puladas; se o lote
+    já tem vencedora conhecida, a primeira rodada vai só até ela e as menos
+    precisas só entram se ela vier vazia.
+    Devolve (linhas, concluída, vencedora, vazias): vazio com concluída=False
+    quer dizer que nenhuma variante respondeu (falha), não que o período não
+    tem dados.
+    """
+    negativas = VARIANT_MEMORY.negativas(ncms_raw, p_from, p_to)
+    nomes = [v for v in VARIANTES if v not in negativas] or list(VARIANTES)
+    preferida = VARIANT_MEMORY.preferida(ncms_raw)
+    corte = nomes.index(preferida) + 1 if preferida in nomes else len(nomes)
+    vencedora, lst, vazias = correr_variantes(nomes[:corte], ncms_raw, p_from, p_to, details)
+    if vencedora is None and nomes[corte:]:
+        vencedora, lst, mais = correr_variantes(nomes[corte:], ncms_raw, p_from, p_to, details)
+        vazias += mais
+    if vencedora is not None:
+        eprint(f"[VARIANTE] {','.join(ncms_raw)} {p_from}..{p_to}: {vencedora}"
+               + (f" (vazias: {','.join(vazias)})" if vazias else ""))
+        VARIANT_MEMORY.registrar(ncms_raw, p_from, p_to, vencedora, vazias)
+    return lst, vencedora is not None or bool(vazias), vencedora, vazias
 
 def ping_years():
     verify = tls_verify()
     try:
-        r = requests.get("https://api-comexstat.mdic.gov.br/general/dates/years", timeout=20, verify=verify)
+        r = http_client().get("https://api-comexstat.mdic.gov.br/general/dates/years", timeout=20, verify=verify, tries=1)
         if r.ok:
             return r.json()
     except Exception as e:
         eprint(f"[PING] falhou: {type(e).__name__}")
     return None
 
+# -------- fan-out: lotes de NCM x janelas de período --------
+def janelas_periodo(p_from: str, p_to: str, janela: str) -> List[Tuple[str, str]]:
+    """Divide [p_from, p_to] (AAAA-MM) em janelas por mês, por ano ou numa só ("total")."""
+    if janela == "total":
+        return [(p_from, p_to)]
+    y, m = (int(x) for x in p_from.split("-"))
+    y2, m2 = (int(x) for x in p_to.split("-"))
+    out = []
+    while (y, m) <= (y2, m2):
+        if janela == "mes":
+            out.append((f"{y}-{m:02d}", f"{y}-{m:02d}"))
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+        else:
+            fim = (y, 12) if y < y2 else (y2, m2)
+            out.append((f"{y}-{m:02d}", f"{fim[0]}-{fim[1]:02d}"))
+            y, m = y + 1, 1
+    return out
+
+def lotes(itens: List[str], tamanho: int) -> List[List[str]]:
+    tamanho = max(1, tamanho)
+    return [itens[i:i + tamanho] for i in range(0, len(itens), tamanho)]
+
+def consultar_unidade(ncms: List[str], p_from: str, p_to: str, details: List[str]):
+    """Um lote de NCMs numa janela: variantes POST e API legada em corrida."""
+    bruta, ok, vencedora, vazias = tentar_variantes(ncms, p_from, p_to, details)
+    return bruta or [], ok, vencedora, vazias
+
+def uniformizar_variante(ncms: List[str], janelas: List[Tuple[str, str]], resultados: list,
+                         details: List[str]) -> set:
+    """
+    Uma variante só para o lote em todas as janelas: a mais precisa que
+    trouxe linhas em alguma delas. Cada janela respondida por outra variante
+    passa a ter a resposta da escolhida — vazia, se ela já veio vazia ali,
+    ou consultada agora (em geral do cache) — para que NCMs vizinhos de
+    HS6/HS4 não se misturem às janelas com NCM-8. Se nenhuma janela trouxe
+    linhas, nada muda. `resultados` ([linhas, ok, vencedora, vazias] por
+    janela) é alterado no lugar; devolve os índices trocados.
+    """
+    com_linhas = [r[2] for r in resultados if r[2] is not None and len(r[0])]
+    if not com_linhas:
+        return set()
+    escolhida = min(com_linhas, key=VARIANTES.index)
+    trocadas = set()
+    for i, ((jf, jt), r) in enumerate(zip(janelas, resultados)):
+        if r[2] == escolhida:
+            continue
+        if isinstance(r[0], Linhas):
+            r[0].close()
+        if escolhida in r[3]:
+            lst, ok = [], True
+        else:
+            lst, ok = consultar_variante(escolhida, ncms, jf, jt, details)
+        eprint(f"[VARIANTE] {','.join(ncms)} {jf}..{jt}: {r[2]} -> {escolhida} (variante do lote)")
+        r[:] = [lst or [], ok, escolhida if ok else None, r[3]]
+        trocadas.add(i)
+    return trocadas
+
+# -------- checkpoint (extrações longas retomáveis) --------
+def checkpoint_path(cache_dir: str, ncms_raw: List[str], p_from: str, p_to: str,
+                    janela: str, tamanho_lote: int, details: List[str]) -> str:
+    """Um arquivo por extração: mesma consulta e mesmo particionamento, mesmo checkpoint."""
+    ident = json.dumps([ncms_raw, p_from, p_to, janela, tamanho_lote, details], separators=(",", ":"))
+    nome = hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "checkpoints", f"{nome}.ndjson")
+
+class _LinhasSalvas:
+    """As `n` linhas de uma unidade no checkpoint, lidas do arquivo só quando iteradas."""
+
+    def __init__(self, path: str, offset: int, n: int, variante=None, vazias=()):
+        self.path, self.offset, self.n = path, offset, n
+        self.variante, self.vazias = variante, list(vazias)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __iter__(self):
+        with open(self.path, "rb") as fh:
+            fh.seek(self.offset)
+            yield from iter_json_list(iter(lambda: fh.read(STREAM_CHUNK), b""), caminho=())
+
+class CheckpointEmUso(Exception):
+    """Outra execução está gravando o mesmo arquivo de checkpoint."""
+
+class Checkpoint:
+    """
+    Unidades (lote x janela) de uma extração, em arquivo só de acréscimo:
+    por unidade terminada, uma linha de cabeçalho {unidade, ok, n} e uma
+    linha com o array JSON das suas linhas, gravadas assim que ela termina.
+    Com `retomar`, as unidades já concluídas saem do arquivo (lidas só na
+    hora de emitir) e só as ausentes ou com falha são consultadas de novo;
+    sem, o arquivo recomeça. Uma unidade truncada (processo morto no meio
+    da escrita) é ignorada.
+    O arquivo fica travado (flock) enquanto a extração roda: uma segunda
+    execução da mesma consulta não o trunca nem intercala linhas — recebe
+    CheckpointEmUso e segue sem checkpoint. Terminada sem falhas, descartar() o apaga.
+    """
+
+    def __init__(self, path: str, retomar: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        self.concluidas: Dict[str, _LinhasSalvas] = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # "ab" não trunca: só depois de obter a trava o conteúdo é lido ou descartado
+        self.fh = open(path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.fh.close()
+                raise CheckpointEmUso(path)
+        if retomar:
+            self._carregar()
+        else:
+            self.fh.truncate(0)
+
+    def _carregar(self):
+        with open(self.path, "rb") as fh:
+            while True:
+                cab = fh.readline()
+                offset = fh.tell()
+                # a linha do array pode ser grande: pula sem guardar
+                fim = b""
+                for pedaco in iter(lambda: fh.readline(STREAM_CHUNK), b""):
+                    fim = pedaco
+                    if pedaco.endswith(b"\n"):
+                        break
+                if not (cab.endswith(b"\n") and fim.endswith(b"\n")):
+                    return
+                try:
+                    reg = json.loads(cab)
+                except ValueError:
+                    return
+                if reg.get("ok"):
+                    self.concluidas[reg["unidade"]] = _LinhasSalvas(self.path, offset, int(reg.get("n", 0)),
+                                                                    reg.get("variante"), reg.get("vazias", ()))
+                else:
+                    self.concluidas.pop(reg["unidade"], None)
+
+    @staticmethod
+    def chave(ncms: List[str], p_from: str, p_to: str) -> str:
+        return f"{p_from}..{p_to} {','.join(ncms)}"
+
+    def concluida(self, ncms: List[str], p_from: str, p_to: str):
+        return self.concluidas.get(self.chave(ncms, p_from, p_to))
+
+    def registrar(self, ncms: List[str], p_from: str, p_to: str, linhas, ok: bool,
+                  variante: str | None = None, vazias=()):
+        n = len(linhas) if ok else 0
+        cab = {"unidade": self.chave(ncms, p_from, p_to), "ok": bool(ok), "n": n,
+               "variante": variante, "vazias": list(vazias)}
+        pedacos = linhas.array_json() if (n and isinstance(linhas, Linhas)) else \
+            [json.dumps(list(linhas) if n else [], ensure_ascii=False).encode("utf-8")]
+        with self.lock:
+            self.fh.write(json.dumps(cab, ensure_ascii=False).encode("utf-8") + b"\n")
+            for pedaco in pedacos:
+                self.fh.write(pedaco)
+            self.fh.write(b"\n")
+            self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+    def descartar(self):
+        """Extração completa: o checkpoint não tem mais o que retomar."""
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.fh.close()
+
+def chave_registro(rec: Dict[str, Any]) -> tuple:
+    # variantes HS6/HS4 devolvem NCMs vizinhos: o mesmo registro pode vir de mais de um lote
+    return (rec.get("partida"), rec.get("descComer"), rec.get("fecNumeracao"), rec.get("paisOrig"), rec.get("state"))
+
+def iterar_registros(ncms_raw: List[str], p_from: str, p_to: str, details: List[str],
+                     tamanho_lote: int = NCM_BATCH_DEFAULT, janela: str = "ano",
+                     workers: int = WORKERS_DEFAULT, checkpoint: "Checkpoint | None" = None,
+                     stats: Dict[str, Any] | None = None):
+    """
+    Consulta todas as unidades (janela x lote) em paralelo, sob o LIMITER, e
+    gera os registros já transformados na ordem das unidades (janelas em
+    ordem cronológica), sem repetir registros.
+    As consultas saem lote a lote e um lote só é emitido com todas as suas
+    janelas prontas: antes, uniformizar_variante fixa uma variante para ele.
+    Com checkpoint, unidades já concluídas vêm do arquivo. Em `stats` ficam
+    `retomadas` (unidades lidas do checkpoint) e `parciais` (unidades em que
+    nenhuma variante respondeu: os dados dessa janela/lote estão faltando).
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("retomadas", 0)
+    stats.setdefault("parciais", [])
+    janelas = janelas_periodo(p_from, p_to, janela)
+    grupos = lotes(ncms_raw, tamanho_lote)
+    unidades = [(li, jf, jt) for jf, jt in janelas for li in range(len(grupos))]
+    salvas = {}
+    if checkpoint is not None:
+        for i, (li, jf, jt) in enumerate(unidades):
+            linhas = checkpoint.concluida(grupos[li], jf, jt)
+            if linhas is not None:
+                salvas[i] = linhas
+        stats["retomadas"] = len(salvas)
+    eprint(f"[FAN-OUT] {len(unidades) - len(salvas)} consultas ({len(salvas)} do checkpoint), "
+           f"{workers} em paralelo, {LIMITER.rate:g} req/s")
+    por_lote = {li: [i for i, u in enumerate(unidades) if u[0] == li] for li in range(len(grupos))}
+    prontas: Dict[int, Tuple[Any, bool]] = {}
+    vistos = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futuros = {i: ex.submit(consultar_unidade, grupos[li], unidades[i][1], unidades[i][2], details)
+                   for li in range(len(grupos)) for i in por_lote[li] if i not in salvas}
+
+        def fechar_lote(li: int):
+            idx = por_lote[li]
+            resultados = []
+            for i in idx:
+                if i in salvas:
+                    sv = salvas[i]
+                    resultados.append([sv, True, sv.variante, sv.vazias])
+                else:
+                    resultados.append(list(futuros.pop(i).result()))
+            trocadas = uniformizar_variante(grupos[li], [unidades[i][1:] for i in idx], resultados, details)
+            for k, (i, (bruta, ok, vencedora, vazias)) in enumerate(zip(idx, resultados)):
+                if checkpoint is not None and (i not in salvas or k in trocadas):
+                    checkpoint.registrar(grupos[li], unidades[i][1], unidades[i][2], bruta, ok, vencedora, vazias)
+                prontas[i] = (bruta, ok)
+
+        for i, (li, jf, jt) in enumerate(unidades):
+            if i not in prontas:
+                fechar_lote(li)
+            bruta, ok = prontas.pop(i)
+            if not ok:
+                stats["parciais"].append({"de": jf, "ate": jt, "ncms": grupos[li]})
+            for it in bruta:
+                rec = transformar_registro(it)
+                # digest de 16 bytes da chave: o conjunto não guarda os textos de cada
+                # registro, e (ao contrário de hash()) colisão não descarta linha na prática
+                k = hashlib.blake2b(json.dumps(chave_registro(rec), ensure_ascii=False).encode("utf-8"),
+                                    digest_size=16).digest()
+                if k in vistos:
+                    continue
+                vistos.add(k)
+                yield rec
+            if isinstance(bruta, Linhas):
+                bruta.close()
+
+# -------- cubo local (NCM x país x UF x mês) --------
+# --by: dimensão -> coluna do cubo
+CUBE_DIMS = {"ncm": "ncm", "country": "pais", "state": "uf", "month": "periodo"}
+CUBE_INSERT_BATCH = 1000
+
+def meses_periodo(p_from: str, p_to: str) -> List[str]:
+    return [jf for jf, _ in janelas_periodo(p_from, p_to, "mes")]
+
+def trechos_continuos(meses: List[str]) -> List[Tuple[str, str]]:
+    """Meses AAAA-MM (ordenados) -> trechos contínuos [(de, até), ...]."""
+    out = []
+    for m in meses:
+        y, mm = (int(x) for x in m.split("-"))
+        if out:
+            py, pm = (int(x) for x in out[-1][1].split("-"))
+            if py * 12 + pm + 1 == y * 12 + mm:
+                out[-1] = (out[-1][0], m)
+                continue
+        out.append((m, m))
+    return out
+
+class CubeStore:
+    """
+    Cubo local no menor grão (NCM x país x UF x mês), em
+    <cache-dir>/cubo.sqlite (em memória com --no-cache). `celulas` guarda as
+    métricas; `cobertura` diz quais (NCM, mês) já foram buscados inteiros,
+    inclusive os sem movimento. Meses fechados não expiram; abertos valem
+    por `ttl` s. Roll-ups e subperíodos saem de um GROUP BY local e a API
+    só é chamada para os (NCM, mês) sem cobertura.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.lock = threading.Lock()
+        self.ttl = CACHE_TTL_DEFAULT
+        self.buscadas = 0
+        self.locais = 0
+
+    def configure(self, cache_dir, ttl: int = CACHE_TTL_DEFAULT):
+        self.ttl = ttl
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            path = os.path.join(cache_dir, "cubo.sqlite")
+        else:
+            path = ":memory:"
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS celulas (
+                ncm TEXT NOT NULL, periodo TEXT NOT NULL, pais TEXT NOT NULL, uf TEXT NOT NULL,
+                descricao TEXT, fob REAL, frete REAL, seguro REAL, cif REAL, kg REAL,
+                PRIMARY KEY (ncm, periodo, pais, uf));
+            CREATE TABLE IF NOT EXISTS cobertura (
+                ncm TEXT NOT NULL, periodo TEXT NOT NULL, expira REAL,
+                PRIMARY KEY (ncm, periodo));
+        """)
+
+    def faltantes(self, ncms: List[str], p_from: str, p_to: str) -> Dict[str, List[str]]:
+        """NCM -> meses do período ainda sem cobertura válida."""
+        meses = meses_periodo(p_from, p_to)
+        q = ",".join("?" * len(ncms))
+        with self.lock:
+            cobertos = set(self.db.execute(
+                f"SELECT ncm, periodo FROM cobertura WHERE ncm IN ({q}) AND periodo BETWEEN ? AND ? "
+                f"AND (expira IS NULL OR expira > ?)", (*ncms, p_from, p_to, time.time())).fetchall())
+        faltam = {n: [m for m in meses if (n, m) not in cobertos] for n in ncms}
+        self.locais += len(cobertos)
+        self.buscadas += sum(len(v) for v in faltam.values())
+        return {n: v for n, v in faltam.items() if v}
+
+    def preparar(self, alvo: set):
+        """Apaga as células de (NCM, mês) que vão ser buscadas de novo."""
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM celulas WHERE ncm = ? AND periodo = ?", list(alvo))
+
+    def inserir(self, recs: List[Dict[str, Any]]):
+        linhas = []
+        for rec in recs:
+            fec = rec.get("fecNumeracao") or ""
+            periodo = f"{fec[6:10]}-{fec[3:5]}"
+            linhas.append((pad8(rec.get("partida") or ""), periodo, rec.get("paisOrig") or "", rec.get("state") or "",
+                           rec.get("descComer"), rec.get("fobUsd"), rec.get("fleteUsd"), rec.get("seguro"),
+                           rec.get("cif"), rec.get("pesoNeto")))
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO celulas VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", linhas)
+
+    def cobrir(self, celulas: set):
+        agora = time.time()
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO cobertura VALUES (?, ?, ?)",
+                [(n, m, None if ResponseCache.periodo_fechado(m) else agora + self.ttl) for n, m in celulas])
+
+    def consultar(self, ncms: List[str], p_from: str, p_to: str, por: List[str]):
+        """Registros agregados pelas dimensões `por` (as demais somadas), no formato de transformar_registro."""
+        cols = [CUBE_DIMS[d] for d in por]
+        sel = ", ".join(cols + ["MAX(descricao)", "SUM(fob)", "SUM(frete)", "SUM(seguro)", "SUM(cif)", "SUM(kg)"])
+        grupo = ", ".join(cols)
+        q = ",".join("?" * len(ncms))
+        sql = (f"SELECT {sel} FROM celulas WHERE ncm IN ({q}) AND periodo BETWEEN ? AND ? "
+               f"GROUP BY {grupo} ORDER BY {grupo}")
+        with self.lock:
+            rows = self.db.execute(sql, (*ncms, p_from, p_to))
+            for row in rows:
+                dims = dict(zip(cols, row[:len(cols)]))
+                desc, fob, frete, seguro, cif, kg = row[len(cols):]
+                periodo = dims.get("periodo")
+                yield {
+                    "country_code": "BR",
+                    "importador": "COMEXSTAT",
+                    "declaracao": "COMEXSTAT",
+                    "serie": "BR",
+                    "partida": dims.get("ncm"),
+                    "fecNumeracao": build_fec_numeracao(*periodo.split("-")) if periodo else None,
+                    "paisOrig": dims.get("pais") or None,
+                    "state": dims.get("uf") or None,
+                    "descComer": desc if "ncm" in dims else None,
+                    "fobUsd": fob,
+                    "fleteUsd": frete,
+                    "seguro": seguro,
+                    "cif": cif,
+                    "pesoNeto": kg,
+                }
+
+    def resumo(self) -> Dict[str, int]:
+        return {"celulas_locais": self.locais, "celulas_buscadas": self.buscadas}
+
+CUBE = CubeStore()
+
+def preencher_cubo(ncms: List[str], p_from: str, p_to: str, details: List[str],
+                   tamanho_lote: int, janela: str, workers: int, stats: Dict[str, Any]):
+    """
+    Busca na API só os (NCM, mês) sem cobertura no cubo, agrupando NCMs com
+    os mesmos meses faltantes e consultando por trechos contínuos de meses.
+    (NCM, mês) de consultas que falharam ficam sem cobertura (e em
+    stats["parciais"]) para a próxima execução tentar de novo.
+    """
+    stats.setdefault("parciais", [])
+    faltam = CUBE.faltantes(ncms, p_from, p_to)
+    grupos: Dict[tuple, List[str]] = {}
+    for n, meses in faltam.items():
+        grupos.setdefault(tuple(meses), []).append(n)
+    eprint(f"[CUBO] {CUBE.locais} (NCM, mês) locais, {CUBE.buscadas} a buscar")
+    for meses, grupo in grupos.items():
+        for de, ate in trechos_continuos(list(meses)):
+            alvo = {(n, m) for n in grupo for m in meses_periodo(de, ate)}
+            CUBE.preparar(alvo)
+            sub: Dict[str, Any] = {}
+            buf = []
+            for rec in iterar_registros(grupo, de, ate, details, tamanho_lote=tamanho_lote,
+                                        janela=janela, workers=workers, stats=sub):
+                fec = rec.get("fecNumeracao") or ""
+                # NCMs vizinhos (variantes HS6/HS4) ficam fora: não foram pedidos
+                if (pad8(rec.get("partida") or ""), f"{fec[6:10]}-{fec[3:5]}") in alvo:
+                    buf.append(rec)
+                if len(buf) >= CUBE_INSERT_BATCH:
+                    CUBE.inserir(buf)
+                    buf = []
+            CUBE.inserir(buf)
+            for falha in sub["parciais"]:
+                alvo -= {(pad8(n), m) for n in falha["ncms"] for m in meses_periodo(falha["de"], falha["ate"])}
+            stats["parciais"].extend(sub["parciais"])
+            CUBE.cobrir(alvo)
+
+def resumo_extracao(saida: Dict[str, Any], stats: Dict[str, Any], checkpoint):
+    """
+    Marca a saída como parcial (janelas sem resposta) e aponta o checkpoint
+    para --resume; sem janelas parciais o checkpoint é apagado.
+    """
+    if CUBE.db is not None:
+        saida["cubo"] = CUBE.resumo()
+    if checkpoint is not None:
+        if stats.get("parciais"):
+            checkpoint.close()
+            saida["checkpoint"] = checkpoint.path
+        else:
+            checkpoint.descartar()
+        if stats.get("retomadas"):
+            saida["retomadas"] = stats["retomadas"]
+    if stats.get("parciais"):
+        saida["parcial"] = True
+        saida["janelas_parciais"] = stats["parciais"]
+        saida["descricao"] += f" Resultado parcial: {len(stats['parciais'])} consulta(s) sem resposta."
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="ComexStat (importação) -> JSON")
+    ap.add_argument("params", nargs="*", help="NCM(s) separados por vírgula, período inicial e período final")
+    ap.add_argument("--debug", "-d", action="store_true")
+    ap.add_argument("--format", choices=["json", "ndjson"], default="json",
+                    help="ndjson: um registro por linha e, no fim, {descricao,total}")
+    ap.add_argument("--ncm-batch", type=int, default=NCM_BATCH_DEFAULT,
+                    help="NCMs por consulta")
+    ap.add_argument("--window", choices=["mes", "ano", "total"], default="ano",
+                    help="Janela de período de cada consulta")
+    ap.add_argument("--by", type=str, default=None,
+                    help="Agrega pelo cubo local: dimensões entre ncm,country,state,month "
+                         "(as demais são somadas); só busca na API o que falta no cubo")
+    ap.add_argument("--workers", type=int, default=WORKERS_DEFAULT,
+                    help="Consultas simultâneas")
+    ap.add_argument("--rate", type=float, default=RATE_DEFAULT,
+                    help="Limite de requisições/s somando todas as consultas (env COMEX_RATE)")
+    ap.add_argument("--cache-dir", type=str, default=CACHE_DIR_DEFAULT,
+                    help="Cache SQLite das respostas (env COMEX_CACHE_DIR)")
+    ap.add_argument("--no-cache", action="store_true", help="Não lê nem grava o cache de respostas")
+    ap.add_argument("--cache-max-bytes", type=int, default=CACHE_MAX_BYTES_DEFAULT,
+                    help="Tamanho máximo do cache (remoção LRU)")
+    ap.add_argument("--cache-ttl", type=int, default=CACHE_TTL_DEFAULT,
+                    help="Validade (s) de respostas de períodos ainda abertos; fechados não expiram")
+    ap.add_argument("--checkpoint", type=str, default=None,
+                    help="Grava checkpoint neste arquivo (apagado ao fim de uma extração sem falhas)")
+    ap.add_argument("--resume", action="store_true",
+                    help="Liga o checkpoint (padrão: <cache-dir>/checkpoints/<consulta>.ndjson) e retoma dele: "
+                         "só consulta janelas ausentes ou que falharam")
+    ap.add_argument("--hedge-delay", type=float, default=HEDGE_DELAY_DEFAULT,
+                    help="Segundos sem resposta antes de disparar a próxima variante (env COMEX_HEDGE_DELAY)")
+    ap.add_argument("--negative-ttl", type=int, default=NEGATIVE_TTL_DEFAULT,
+                    help="Por quanto tempo (s) pular uma variante que veio vazia para o NCM (env COMEX_NEGATIVE_TTL)")
+    return ap.parse_args()
+
 def main():
-    args = [a for a in sys.argv[1:] if not a.startswith("-")]
+    opts = parse_args()
+    ndjson = opts.format == "ndjson"
+    args = opts.params
     if len(args) < 3:
-        out = {"descricao":"Argumentos insuficientes","total":0,"resultados":[]}
+        out = {"descricao":"Argumentos insuficientes","total":0}
+        if not ndjson:
+            out["resultados"] = []
         print(json.dumps(out, ensure_ascii=False)); return
 
     ncm_raw = args[0]
@@ -226,28 +1257,93 @@ def main():
     ncms_raw = [s.strip() for s in ncm_raw.split(",") if s.strip()]
     p_from = normalize_period_to_yyyy_mm(p_from_raw)
     p_to   = normalize_period_to_yyyy_mm(p_to_raw)
+    por = None
+    if opts.by is not None:
+        por = [d.strip() for d in opts.by.split(",") if d.strip()]
+        invalidas = [d for d in por if d not in CUBE_DIMS]
+        if not por or invalidas:
+            print(f"--by: dimensões válidas são {','.join(CUBE_DIMS)}", file=sys.stderr)
+            sys.exit(2)
 
     if debug_enabled():
         y = ping_years()
         if y: eprint("[PING years]", y)
 
-    # 1) tenta POST
-    bruta = tentar_variantes_post(ncms_raw, p_from, p_to, details)
+    LIMITER.rate = max(opts.rate, 0.01)
+    RESPONSE_CACHE.configure(None if opts.no_cache else opts.cache_dir, opts.cache_max_bytes, opts.cache_ttl)
+    global HEDGE_DELAY
+    HEDGE_DELAY = max(opts.hedge_delay, HEDGE_DELAY_MIN)
+    VARIANT_MEMORY.configure(None if opts.no_cache else opts.cache_dir, opts.negative_ttl)
+    stats: Dict[str, Any] = {}
+    checkpoint = None
+    if por is not None:
+        # cubo: completa o que falta no menor grão e agrega localmente (o cubo
+        # já guarda o progresso, então não há checkpoint)
+        CUBE.configure(None if opts.no_cache else opts.cache_dir, opts.cache_ttl)
+        ncms_raw = list(dict.fromkeys(pad8(n) for n in ncms_raw))
+        preencher_cubo(ncms_raw, p_from, p_to, details, opts.ncm_batch, opts.window, opts.workers, stats)
+        registros = CUBE.consultar(ncms_raw, p_from, p_to, por)
+    else:
+        # variantes POST e legado GET em corrida — por lote de NCM x janela
+        # checkpoint só sob pedido (--checkpoint ou --resume)
+        ckpt_path = opts.checkpoint
+        if ckpt_path is None and opts.resume and not opts.no_cache:
+            ckpt_path = checkpoint_path(opts.cache_dir, ncms_raw, p_from, p_to, opts.window, opts.ncm_batch, details)
+        if opts.resume and ckpt_path is None:
+            eprint("[CHECKPOINT] --resume sem --checkpoint e com --no-cache: consultando tudo")
+        if ckpt_path:
+            try:
+                checkpoint = Checkpoint(ckpt_path, retomar=opts.resume)
+            except CheckpointEmUso:
+                eprint(f"[CHECKPOINT] {ckpt_path} em uso por outra execução: seguindo sem checkpoint")
+        registros = iterar_registros(ncms_raw, p_from, p_to, details,
+                                     tamanho_lote=opts.ncm_batch, janela=opts.window, workers=opts.workers,
+                                     checkpoint=checkpoint, stats=stats)
 
-    # 2) se nada, legado GET
-    if not bruta:
-        eprint("[FALLBACK] tentando API legada via GET ?filter=")
-        bruta = get_legacy(ncms_raw, p_from, p_to)
+    ncm_legivel = ",".join(ncms_raw)
+    agregado = f" Agregado por {','.join(por)}." if por else ""
 
-    resultados = [transformar_registro(it) for it in bruta] if bruta else []
+    if ndjson:
+        # cada registro transformado sai na hora; o resumo vem por último
+        total = 0
+        for rec in registros:
+            sys.stdout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            total += 1
+        descricao = f"Foram encontradas {total} linhas no ComexStat para o(s) NCM(s) {ncm_legivel} no período de {p_from} a {p_to}.{agregado}"
+        trailer = {"descricao": descricao, "total": total}
+        if RESPONSE_CACHE.db is not None:
+            trailer["cache"] = RESPONSE_CACHE.resumo()
+        resumo_extracao(trailer, stats, checkpoint)
+        print(json.dumps(trailer, ensure_ascii=False), flush=True)
+        return
 
-    total = len(resultados)
-    ncm_legivel = ",".join(ncms_raw)
-    descricao = f"Foram encontradas {total} linhas no ComexStat para o(s) NCM(s) {ncm_legivel} no período de {p_from} a {p_to}."
+    # o objeto único mantém a ordem descricao, total, resultados; como a contagem
+    # só se conhece no fim, os registros vão para um spool em disco e o stdout
+    # só é escrito depois da extração completa (uma exceção não deixa JSON truncado)
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        total = 0
+        for rec in registros:
+            spool.write((", " if total else "") + json.dumps(rec, ensure_ascii=False))
+            total += 1
+        descricao = f"Foram encontradas {total} linhas no ComexStat para o(s) NCM(s) {ncm_legivel} no período de {p_from} a {p_to}.{agregado}"
 
-    saida = {"descricao": descricao, "total": total, "resultados": resultados}
-    # Apenas imprime o JSON no stdout; não grava em arquivo nem cria diretório
-    print(json.dumps(saida, ensure_ascii=False))
+        saida = {"descricao": descricao, "total": total}
+        if RESPONSE_CACHE.db is not None:
+            saida["cache"] = RESPONSE_CACHE.resumo()
+        resumo_extracao(saida, stats, checkpoint)
+        resto = {k: v for k, v in saida.items() if k not in ("descricao", "total")}
+        # Apenas imprime o JSON no stdout; não grava em arquivo nem cria diretório
+        out = sys.stdout
+        out.write(json.dumps({"descricao": saida["descricao"], "total": total}, ensure_ascii=False)[:-1])
+        out.write(', "resultados": [')
+        spool.seek(0)
+        while True:
+            bloco = spool.read(1 << 16)
+            if not bloco:
+                break
+            out.write(bloco)
+        out.write("]" + (", " + json.dumps(resto, ensure_ascii=False)[1:] if resto else "}") + "\n")
+        out.flush()
 
 if __name__ == "__main__":
     main()
@@ -1,20 +1,30 @@
 import argparse
+import io
 import os
 import re
 import shutil
 import subprocess
 from pathlib import Path
 import json
+import time
+import hashlib
+import pickle
 import calendar
+from contextlib import contextmanager
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import pandas as pd
 import chardet
 
+# cliente HTTP compartilhado pelos robôs (src/bot/common)
+import sys as _sys
+_sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+from http_client import get_client, backoff_delay  # noqa: E402
+
 # Garantir saída em UTF-8 mesmo no Windows/PowerShell
 try:
-    import sys as _sys
     if hasattr(_sys.stdout, "reconfigure"):
         _sys.stdout.reconfigure(encoding="utf-8")
 except Exception:
@@ -22,6 +32,18 @@ except Exception:
 
 CKAN_BASE = "https://datos.gob.cl/api/3/action/package_show"
 
+# Cache persistente de downloads (sobrevive à limpeza do workdir)
+CACHE_DIR_DEFAULT = os.environ.get("CHILE_CACHE_DIR", "./data_cache/chile")
+CACHE_MAX_BYTES_DEFAULT = int(os.environ.get("CHILE_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+PACKAGE_TTL_DEFAULT = int(os.environ.get("CHILE_PACKAGE_TTL", str(6 * 3600)))
+DOWNLOAD_WORKERS_DEFAULT = 4
+
+DATA_EXTS = (".txt", ".csv", ".xlsx", ".xls")
+# Detecção de encoding/separador por amostra limitada (início + trechos espaçados)
+SNIFF_HEAD_BYTES = 256 * 1024
+SNIFF_STRIDE_SAMPLES = 4
+SNIFF_STRIDE_BYTES = 64 * 1024
+
 MONTH_NAMES = {
     1:  ["enero", "jan", "january"],
     2:  ["febrero", "feb", "february"],
@@ -57,6 +79,37 @@ COLUMN_NAMES = [
 "CTA1","SIGVAL1","VAL1","OTRO2","CTA2","SIGVAL2","VAL2","OTRO3","CTA3","SIGVAL3","VAL3","OTRO4","CTA4","SIGVAL4","VAL4"
 ]
 
+# Colunas com valores numéricos (gravadas como float64 na saída colunar);
+# códigos (ADU, ARANC-NAC, países...) e datas continuam texto.
+NUMERIC_COLUMNS = {
+    "TOTINSUM", "NUMDIAS", "VALEXFAB", "MONGASFOB", "TOT_ITEMS", "FOB", "TOT_HOJAS", "FLETE",
+    "TOT_BULTOS", "SEGURO", "TOT_PESO", "CIF", "CANT_BUL1", "CANT_BUL2", "CANT_BUL3", "CANT_BUL4",
+    "CANT_BUL5", "CANT_BUL6", "CANT_BUL7", "CANT_BUL8", "MON_OTRO", "MON_OTR1", "MON_OTR2",
+    "MON_OTR3", "MON_OTR4", "MON_OTR5", "MON_OTR6", "MON_OTR7", "MON_178", "MON_191", "VAL_601",
+    "VAL_602", "VAL_603", "VAL_604", "VAL_605", "VAL_606", "VAL_607", "TASA", "NCUOTAS",
+    "MON_699", "MON_199", "NUMITEM", "AJU-ITEM", "CANT-MERC", "MERMAS", "PRE-UNIT", "CIF-ITEM",
+    "ADVAL-ALA", "ADVAL", "VALAD", "VAL1", "VAL2", "VAL3", "VAL4",
+}
+
+# ---- serializador JSON rápido (opcional) ----
+try:
+    import orjson
+
+    def dumps_record(rec: dict) -> bytes:
+        return orjson.dumps(rec)
+except Exception:
+    def dumps_record(rec: dict) -> bytes:
+        return json.dumps(rec, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+# ---- Arrow/Parquet opcional (saída colunar) ----
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as pa_ipc
+    ARROW_OK = True
+except Exception:
+    ARROW_OK = False
+
 # ---- RAR opcional ----
 try:
     import rarfile
@@ -73,13 +126,32 @@ def eprint(msg: str, argv):
         import sys
         print(msg, file=sys.stderr)
 
-def fetch_package(year: int) -> dict:
+def fetch_package(year: int, cache_dir: Path | None = None, ttl: int = PACKAGE_TTL_DEFAULT, argv=()) -> dict:
+    """
+    Metadados CKAN do ano. Com cache_dir, reaproveita a cópia local enquanto
+    tiver menos de `ttl` segundos; se a rede falhar, usa a cópia antiga.
+    """
     slug = f"registro-de-importacion-{year}"
-    r = requests.get(CKAN_BASE, params={"id": slug}, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    if not data.get("success"):
-        raise RuntimeError(f"CKAN retornou success=false para {slug}")
+    cached = (cache_dir / "packages" / f"{year}.json") if cache_dir else None
+    if cached is not None and cached.exists() and (ttl < 0 or time.time() - cached.stat().st_mtime < ttl):
+        eprint(f"[cache] metadados CKAN {year} (local)", argv)
+        return json.loads(cached.read_text(encoding="utf-8"))
+    try:
+        r = get_client(log=lambda m: eprint(m, argv)).get(CKAN_BASE, params={"id": slug}, timeout=60)
+        r.raise_for_status()
+        data = r.json()
+        if not data.get("success"):
+            raise RuntimeError(f"CKAN retornou success=false para {slug}")
+    except Exception as e:
+        if cached is not None and cached.exists():
+            eprint(f"[cache] CKAN indisponível ({type(e).__name__}); usando metadados antigos de {year}", argv)
+            return json.loads(cached.read_text(encoding="utf-8"))
+        raise
+    if cached is not None:
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data["result"], ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, cached)
     return data["result"]
 
 def month_match(text: str, year: int, month: int) -> bool:
@@ -98,13 +170,188 @@ def select_month_resources(resources: list, year: int, month: int):
     hits.sort(key=part_idx)
     return hits
 
-def download(url: str, dst: Path, argv):
+def resource_url(res: dict) -> str:
+    return res.get("url") or res.get("download_url") or res.get("path") or ""
+
+PARTIAL_STALE_SECONDS = 600
+
+def _adopt_partial(dst: Path, part: Path):
+    """
+    Assume o parcial de um processo que morreu no meio do download (nenhuma
+    escrita há PARTIAL_STALE_SECONDS), para retomar dele em vez do zero.
+    O rename é atômico: se dois processos disputarem o mesmo órfão, só um leva.
+    """
+    now = time.time()
+    for orphan in dst.parent.glob(dst.name + ".*.partial"):
+        if orphan == part:
+            continue
+        try:
+            if now - orphan.stat().st_mtime < PARTIAL_STALE_SECONDS:
+                continue
+            os.replace(orphan, part)
+            return
+        except OSError:
+            continue
+
+def download(url: str, dst: Path, argv, expected_size: int | None = None, tries: int = 3):
+    """
+    Baixa url -> dst passando por `dst.<pid>.partial` (um parcial por
+    processo: dois processos baixando o mesmo mês não se truncam). Se o
+    parcial já existir (download interrompido), retoma com HTTP Range a partir
+    do último byte. Com `expected_size`, o tamanho final tem de bater exato.
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    part = dst.with_name(f"{dst.name}.{os.getpid()}.partial")
+    if not part.exists():
+        _adopt_partial(dst, part)
+    for i in range(tries):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        eprint(f"Baixando: {url}" + (f" (retomando em {offset} bytes)" if offset else ""), argv)
+        try:
+            # uma tentativa por volta: quem repete é este laço, retomando do parcial
+            with get_client(log=lambda m: eprint(m, argv)).get(
+                url, stream=True, timeout=300, headers=headers, tries=1, retry_statuses=()
+            ) as resp:
+                # 416 com offset: o servidor diz que não há mais bytes (o tamanho é conferido abaixo)
+                if not (offset and resp.status_code == 416):
+                    resp.raise_for_status()
+                    mode = "ab" if (offset and resp.status_code == 206) else "wb"
+                    with open(part, mode) as f:
+                        shutil.copyfileobj(resp.raw, f, 1024 * 1024)
+            got = part.stat().st_size
+            if expected_size and got != expected_size:
+                if got > expected_size:
+                    # parcial corrompido (maior que o recurso): recomeça do zero
+                    part.unlink(missing_ok=True)
+                raise IOError(f"download incompleto ({got}/{expected_size} bytes)")
+            break
+        except Exception as e:
+            eprint(f"[download try {i+1}/{tries}] {type(e).__name__}: {e}", argv)
+            if i == tries - 1:
+                raise
+            time.sleep(backoff_delay(i + 1))
+    os.replace(part, dst)
+
+def _hash_ok(path: Path, expected: str) -> bool:
+    """Confere o `hash` do CKAN quando ele parece md5/sha1/sha256 em hex."""
+    exp = (expected or "").strip().lower()
+    if ":" in exp:
+        exp = exp.split(":", 1)[1]
+    algo = {32: "md5", 40: "sha1", 64: "sha256"}.get(len(exp))
+    if not algo or any(c not in "0123456789abcdef" for c in exp):
+        return True
+    h = hashlib.new(algo)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest() == exp
+
+class DownloadCache:
+    """
+    Cache de recursos CKAN endereçado por conteúdo: a chave é o sha256 de
+    url + last_modified + size + hash do recurso, então uma republicação
+    gera chave nova e a cópia antiga simplesmente envelhece.
+    O mtime do blob é o relógio do LRU (tocado a cada acerto) e a remoção
+    acontece por total de bytes, nunca apagando os blobs em uso.
+    O orçamento (--cache-max-bytes) é o mesmo para os blobs e para os meses
+    do store em <cache>/store: um mês do store conta como uma entrada, com o
+    mtime do seu meta.json como relógio.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, argv):
+        self.root = root
+        self.blobs = root / "blobs"
+        self.max_bytes = max_bytes
+        self.argv = argv
+        self.blobs.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(res: dict) -> str:
+        ident = "|".join([
+            resource_url(res),
+            str(res.get("last_modified") or res.get("metadata_modified") or ""),
+            str(res.get("size") or ""),
+            str(res.get("hash") or ""),
+        ])
+        return hashlib.sha256(ident.encode("utf-8")).hexdigest()
+
+    def blob_path(self, res: dict) -> Path:
+        return self.blobs / self.key(res)
+
+    def get(self, res: dict) -> Path | None:
+        blob = self.blob_path(res)
+        if blob.exists():
+            os.utime(blob)
+            return blob
+        return None
+
+    def fetch(self, res: dict) -> Path:
+        blob = self.get(res)
+        if blob is not None:
+            eprint(f"[cache] hit: {Path(resource_url(res)).name}", self.argv)
+            return blob
+        blob = self.blob_path(res)
+        try:
+            size = int(res.get("size") or 0) or None
+        except (TypeError, ValueError):
+            size = None
+        download(resource_url(res), blob, self.argv, expected_size=size)
+        if not _hash_ok(blob, res.get("hash") or ""):
+            blob.unlink(missing_ok=True)
+            raise IOError(f"hash divergente para {resource_url(res)}")
+        return blob
+
+    def fetch_all(self, resources: list, workers: int = DOWNLOAD_WORKERS_DEFAULT) -> list:
+        """Baixa (em paralelo) o que faltar e devolve os blobs na ordem de `resources`."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+            blobs = list(ex.map(self.fetch, resources))
+        self.evict(keep={b.name for b in blobs})
+        return blobs
+
+    def evict(self, keep: set = frozenset()):
+        entries = []
+        for p in self.blobs.iterdir():
+            if p.is_file() and not p.name.endswith(".partial"):
+                st = p.stat()
+                entries.append((st.st_mtime, st.st_size, p))
+        store = self.root / "store"
+        if store.is_dir():
+            for d in store.iterdir():
+                # diretórios ".<mês>.<pid>.partial" são builds em andamento
+                if not d.is_dir() or d.name.startswith("."):
+                    continue
+                try:
+                    mtime = (d / "meta.json").stat().st_mtime
+                except OSError:
+                    mtime = 0.0
+                size = sum(f.stat().st_size for f in d.iterdir() if f.is_file())
+                entries.append((mtime, size, d))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if p.name in keep:
+                continue
+            try:
+                if p.is_dir():
+                    shutil.rmtree(p)
+                else:
+                    p.unlink()
+                total -= size
+                eprint(f"[cache] removido (LRU): {p.name}", self.argv)
+            except OSError:
+                pass
+
+def link_or_copy(src: Path, dst: Path):
+    """Materializa o blob no workdir com o nome original (hardlink quando possível)."""
     dst.parent.mkdir(parents=True, exist_ok=True)
-    eprint(f"Baixando: {url}", argv)
-    with requests.get(url, stream=True, timeout=300) as resp:
-        resp.raise_for_status()
-        with open(dst, "wb") as f:
-            shutil.copyfileobj(resp.raw, f)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 def extract_rar(first_part: Path, out_dir: Path, argv):
     import shutil as _shutil
@@ -145,14 +392,227 @@ def extract_rar(first_part: Path, out_dir: Path, argv):
         return
     raise RuntimeError("Instale UnRAR/7-Zip para extrair .rar.")
 
-def sniff_text(path: Path):
-    raw = path.read_bytes()
-    enc = chardet.detect(raw).get("encoding") or "latin-1"
-    sample = raw[:20000]
+# --------- extração em pipe (sem gravar o texto extraído em disco) ---------
+def pipe_tool():
+    """Extrator capaz de mandar um membro para o stdout: (nome, executável)."""
+    import shutil as _shutil
+    seven = _shutil.which("7z") or _shutil.which("7za")
+    if seven:
+        return "7z", seven
+    unrar = _shutil.which("unrar") or r"C:\Program Files\WinRAR\UnRAR.exe"
+    if Path(unrar).exists():
+        return "unrar", unrar
+    if RAR_OK:
+        return "rarfile", None
+    unar = _shutil.which("unar")
+    lsar = _shutil.which("lsar")
+    if unar and lsar:
+        return "unar", unar
+    return None, None
+
+def list_rar_members(first_part: Path, argv) -> list:
+    """Lista os membros de dados (.txt/.csv/.xlsx/.xls) do RAR sem extrair nada."""
+    tool, exe = pipe_tool()
+    rar_path = str(first_part)
+    members = []
+    if tool == "7z":
+        out = subprocess.run([exe, "l", "-slt", "-ba", rar_path], check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             text=True, encoding="utf-8", errors="replace").stdout
+        for block in re.split(r"\r?\n\r?\n", out):
+            info = dict(ln.split(" = ", 1) for ln in block.splitlines() if " = " in ln)
+            if info.get("Path") and "D" not in info.get("Attributes", ""):
+                members.append((info["Path"], int(info.get("Size") or 0)))
+    elif tool == "unrar":
+        out = subprocess.run([exe, "lb", rar_path], check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             text=True, encoding="utf-8", errors="replace").stdout
+        members = [(ln.strip(), 0) for ln in out.splitlines() if ln.strip()]
+    elif tool == "rarfile":
+        with rarfile.RarFile(rar_path) as rf:
+            members = [(i.filename, i.file_size) for i in rf.infolist() if not i.isdir()]
+    elif tool == "unar":
+        import shutil as _shutil
+        out = subprocess.run([_shutil.which("lsar"), "-j", rar_path], check=True,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        for e in json.loads(out).get("lsarContents", []):
+            if not e.get("XADIsDirectory"):
+                members.append((e.get("XADFileName", ""), int(e.get("XADFileSize") or 0)))
+    else:
+        raise RuntimeError("Nenhum extrator com saída em pipe (7z/unrar/rarfile/unar).")
+    eprint(f"Membros no RAR ({tool}): {len(members)}", argv)
+    return [RarMember(first_part, name, size, tool, exe, argv)
+            for name, size in members if name.lower().endswith(DATA_EXTS)]
+
+class RarMember:
+    """Membro de um RAR lido direto do stdout do extrator (modo pipe)."""
+
+    def __init__(self, archive: Path, member: str, size: int, tool: str, exe, argv):
+        self.archive = archive
+        self.member = member
+        self.size = size
+        self.tool = tool
+        self.exe = exe
+        self.argv = argv
+        self.name = Path(member.replace("\\", "/")).name
+        self.suffix = Path(self.name).suffix
+
+    @contextmanager
+    def open(self):
+        if self.tool == "rarfile":
+            with rarfile.RarFile(str(self.archive)) as rf, rf.open(self.member) as fh:
+                yield fh
+            return
+        cmd = {
+            "7z": [self.exe, "e", "-so", "-y", str(self.archive), self.member],
+            "unrar": [self.exe, "p", "-inul", str(self.archive), self.member],
+            "unar": [self.exe, "-q", "-o", "-", str(self.archive), self.member],
+        }[self.tool]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                bufsize=1024 * 1024)
+        killed = False
+        try:
+            yield proc.stdout
+        finally:
+            if proc.poll() is None:
+                proc.kill()  # leitura interrompida (ex.: --limit)
+                killed = True
+            proc.stdout.close()
+            rc = proc.wait()
+            if rc != 0 and not killed:
+                eprint(f"[aviso] extrator saiu com código {rc} para {self.member}", self.argv)
+
+class _Replay(io.RawIOBase):
+    """Stream binário que devolve primeiro `head` e depois o restante de `fh`."""
+
+    def __init__(self, head: bytes, fh):
+        self._head = memoryview(head)
+        self._fh = fh
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        data = self._fh.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+class _Window(io.RawIOBase):
+    """Stream binário que lê no máximo `size` bytes de `fh` (a partir da posição atual)."""
+
+    def __init__(self, fh, size: int):
+        self._fh = fh
+        self._left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._left <= 0:
+            return 0
+        data = self._fh.read(min(len(b), self._left))
+        n = len(data)
+        b[:n] = data
+        self._left -= n
+        return n
+
+class FileSlice:
+    """
+    Trecho [start, end) de um TXT/CSV local, cortado em fim de linha, para
+    o parse paralelo. Encoding e separador vêm do arquivo inteiro (detectados
+    uma vez no processo pai).
+    """
+
+    def __init__(self, path: Path, start: int, end: int, enc: str, sep: str):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.enc = enc
+        self.sep = sep
+        self.size = end - start
+        self.name = f"{path.name}[{start}:{end}]"
+        self.suffix = path.suffix
+
+    @contextmanager
+    def open(self):
+        with open(self.path, "rb") as fh:
+            fh.seek(self.start)
+            yield io.BufferedReader(_Window(fh, self.size), buffer_size=1024 * 1024)
+
+def source_size(src) -> int:
+    return src.size if isinstance(src, (RarMember, FileSlice)) else src.stat().st_size
+
+@contextmanager
+def open_source(src):
+    """Abre Path, RarMember ou FileSlice como stream binário."""
+    if isinstance(src, (RarMember, FileSlice)):
+        with src.open() as fh:
+            yield fh
+    else:
+        with open(src, "rb") as fh:
+            yield fh
+
+class SniffCache:
+    """
+    (encoding, separador) por impressão digital da amostra (sha1 + tamanho).
+    Fica em memória e, se `path` for definido, também em JSON no cache.
+    """
+
+    def __init__(self):
+        self.path: Path | None = None
+        self.mem: dict = {}
+        self._loaded = False
+
+    def configure(self, cache_dir: Path | None):
+        self.path = (cache_dir / "sniff.json") if cache_dir else None
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.path is not None and self.path.exists():
+            try:
+                self.mem.update(json.loads(self.path.read_text(encoding="utf-8")))
+            except Exception:
+                pass
+
+    def get(self, fp: str):
+        self._load()
+        hit = self.mem.get(fp)
+        return tuple(hit) if hit else None
+
+    def put(self, fp: str, enc: str, sep: str):
+        self.mem[fp] = [enc, sep]
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self.mem), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+SNIFF_CACHE = SniffCache()
+
+def _fingerprint(sample: bytes, size: int) -> str:
+    return f"{size}:{hashlib.sha1(sample).hexdigest()}"
+
+def sniff_bytes(sample: bytes, head: bytes | None = None):
+    """Encoding pelo chardet sobre `sample`; separador pelos primeiros 20 KB de `head`."""
+    enc = chardet.detect(sample).get("encoding") or "latin-1"
+    head = sample if head is None else head
     try:
-        s = sample.decode(enc, errors="replace")
+        s = head[:20000].decode(enc, errors="replace")
     except Exception:
-        enc = "latin-1"; s = sample.decode(enc, errors="replace")
+        enc = "latin-1"; s = head[:20000].decode(enc, errors="replace")
     import csv as _csv
     try:
         dialect = _csv.Sniffer().sniff(s, delimiters=";,\t|")
@@ -161,137 +621,899 @@ def sniff_text(path: Path):
         sep = ';' if s.count(';') >= max(s.count('\t'), s.count(',')) else ('\t' if s.count('\t') >= s.count(',') else ',')
     return enc, sep
 
+def _cached_sniff(sample: bytes, head: bytes, size: int):
+    fp = _fingerprint(sample, size)
+    hit = SNIFF_CACHE.get(fp)
+    if hit:
+        return hit
+    enc, sep = sniff_bytes(sample, head)
+    SNIFF_CACHE.put(fp, enc, sep)
+    return enc, sep
+
+def read_sample(path: Path) -> tuple:
+    """
+    Lê só o início do arquivo e alguns trechos espaçados ao longo dele,
+    cortados em fim de linha. Memória constante, qualquer que seja o tamanho.
+    """
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_HEAD_BYTES)
+        parts = [head]
+        if size > SNIFF_HEAD_BYTES + SNIFF_STRIDE_BYTES:
+            for i in range(1, SNIFF_STRIDE_SAMPLES + 1):
+                f.seek(SNIFF_HEAD_BYTES + (size - SNIFF_HEAD_BYTES) * i // (SNIFF_STRIDE_SAMPLES + 1))
+                blk = f.read(SNIFF_STRIDE_BYTES)
+                blk = blk[blk.find(b"\n") + 1:]
+                parts.append(blk[:blk.rfind(b"\n") + 1])
+    return head, b"".join(parts), size
+
+def sniff_text(path: Path):
+    head, sample, size = read_sample(path)
+    return _cached_sniff(sample, head, size)
+
+def sniff_stream(fh, size: int = 0):
+    """Detecta encoding/separador pelo início do stream e devolve um stream equivalente."""
+    head = fh.read(SNIFF_HEAD_BYTES)
+    enc, sep = _cached_sniff(head, head, size)
+    return enc, sep, io.BufferedReader(_Replay(head, fh), buffer_size=1024 * 1024)
+
 def find_data_files(folder: Path):
-    exts = (".txt", ".csv", ".xlsx", ".xls")
     out = []
     for root, _, files in os.walk(folder):
         for fn in files:
-            if fn.lower().endswith(exts):
+            if fn.lower().endswith(DATA_EXTS):
                 out.append(Path(root) / fn)
     return out
 
-# --------- escrita streaming da array de resultados ---------
+# --------- leitura em chunks + limpeza vetorizada ---------
+CHUNK_ROWS = 150_000
+
+def projection(columns: list | None) -> list | None:
+    """Posições (em COLUMN_NAMES) das colunas pedidas em --columns; None = todas."""
+    if not columns:
+        return None
+    return [COLUMN_NAMES.index(c) for c in columns]
+
+# planilhas viram listas Python antes do DataFrame: chunks menores que os do CSV
+XLSX_CHUNK_ROWS = 20_000
+
+def _xlsx_value(cell):
+    """Mesma conversão do leitor openpyxl do pandas, já como texto (dtype=str, na_filter=False)."""
+    v = cell.value
+    if v is None:
+        return ""
+    if cell.data_type == "e":
+        return None
+    if cell.data_type == "n":
+        i = int(v)
+        v = i if i == v else float(v)
+    return str(v)
+
+def _xlsx_frame(rows: list, usecols: list | None) -> pd.DataFrame:
+    width = max(len(r) for r in rows)
+    df = pd.DataFrame([r + [""] * (width - len(r)) for r in rows], dtype=str)
+    if usecols is not None:
+        df = df[[c for c in usecols if c < width]]
+    return df
+
+def iter_xlsx_chunks(src, usecols: list | None = None):
+    """
+    Lê a primeira aba de um .xlsx em modo read-only (linha a linha) e gera
+    DataFrames de até XLSX_CHUNK_ROWS linhas, como o read_csv em chunks.
+    Linhas vazias no fim da aba são descartadas, como no pd.read_excel.
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(src, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows, empty = [], []
+        for row in ws.rows:
+            vals = [_xlsx_value(c) for c in row]
+            while vals and vals[-1] == "":
+                vals.pop()
+            if not vals:
+                empty.append(vals)  # só entra se vier alguma linha com dados depois
+                continue
+            rows.extend(empty)
+            empty = []
+            rows.append(vals)
+            if len(rows) >= XLSX_CHUNK_ROWS:
+                yield _xlsx_frame(rows, usecols)
+                rows = []
+        if rows:
+            yield _xlsx_frame(rows, usecols)
+    finally:
+        wb.close()
+
+def iter_raw_chunks(p, argv, usecols: list | None = None):
+    """
+    DataFrames crus (dtype=str, colunas posicionais) de um Path ou RarMember.
+    Com `usecols`, só essas posições são materializadas pelo leitor.
+    """
+    ext = p.suffix.lower()
+    if ext in (".txt", ".csv"):
+        with open_source(p) as fh:
+            if isinstance(p, RarMember):
+                enc, sep, fh = sniff_stream(fh, p.size)
+            elif isinstance(p, FileSlice):
+                enc, sep = p.enc, p.sep
+            else:
+                enc, sep = sniff_text(p)
+            yield from pd.read_csv(
+                fh,
+                encoding=enc,
+                sep=sep,
+                dtype=str,
+                header=None,
+                on_bad_lines="skip",
+                low_memory=False,
+                chunksize=CHUNK_ROWS,
+                keep_default_na=False,
+                usecols=usecols,
+            )
+    elif ext == ".xlsx":
+        if isinstance(p, RarMember):
+            # o zip da planilha precisa de seek: o membro vai para um temporário em disco
+            import tempfile
+            with tempfile.TemporaryFile() as tmp:
+                with p.open() as fh:
+                    shutil.copyfileobj(fh, tmp, 1024 * 1024)
+                tmp.seek(0)
+                yield from iter_xlsx_chunks(tmp, usecols)
+        else:
+            yield from iter_xlsx_chunks(p, usecols)
+    elif ext == ".xls":
+        # formato binário antigo: sem leitor em streaming, lido inteiro (xlrd)
+        if isinstance(p, RarMember):
+            with p.open() as fh:
+                src = io.BytesIO(fh.read())
+        else:
+            src = p
+        yield pd.read_excel(
+            src,
+            header=None,
+            dtype=str,
+            na_filter=False,
+            usecols=usecols,
+        )
+    else:
+        eprint(f"[ignorado] extensão não suportada: {ext}", argv)
+
+def clean_chunk(df: pd.DataFrame, year: int, month: int, columns: list | None = None) -> pd.DataFrame:
+    """
+    Ajusta o chunk às COLUMN_NAMES (ou à projeção `columns`) e limpa coluna a
+    coluna: strip nos textos, colunas faltantes viram nulo e
+    country_code/ano_ref/mes_ref são constantes.
+    """
+    names = columns or COLUMN_NAMES
+    df = df.reindex(columns=projection(columns) or range(len(COLUMN_NAMES)))
+    df.columns = names
+    for c in names:
+        col = df[c]
+        if pd.api.types.is_string_dtype(col.dtype) and not col.isna().all():
+            df[c] = col.str.strip()
+    df["country_code"] = "CL"
+    df["ano_ref"] = year
+    df["mes_ref"] = month
+    return df
+
+def serialize_chunk(df: pd.DataFrame) -> list:
+    """
+    Serializa o chunk inteiro de uma vez: monta os registros a partir das
+    colunas (nulos já como None) e passa todos pelo serializador rápido.
+    Devolve uma linha JSON (bytes UTF-8) por registro.
+    """
+    names = list(df.columns)
+    cols = []
+    for n in names:
+        col = df[n]
+        if col.hasnans:
+            col = col.astype(object).where(col.notna(), None)
+        cols.append(col.tolist())
+    return list(map(dumps_record, [dict(zip(names, row)) for row in zip(*cols)]))
+
+# --------- escrita streaming dos resultados ---------
+class JsonArraySink:
+    """Array JSON (`[\n` ... `,\n` ... `\n]`) num arquivo binário."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.first = True
+        fh.write(b"[\n")
+
+    def write(self, df: pd.DataFrame):
+        self.write_lines(serialize_chunk(df))
+
+    def write_lines(self, lines: list):
+        if not lines:
+            return
+        if not self.first:
+            self.fh.write(b",\n")
+        self.fh.write(b",\n".join(lines))
+        self.first = False
+
+    def close(self):
+        self.fh.write(b"\n]")
+
+class NdjsonSink:
+    """Um registro por linha, enviado (flush) assim que o chunk fica pronto."""
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def write(self, df: pd.DataFrame):
+        self.write_lines(serialize_chunk(df))
+
+    def write_lines(self, lines: list):
+        if not lines:
+            return
+        self.fh.write(b"\n".join(lines) + b"\n")
+        self.fh.flush()
+
+    def close(self):
+        self.fh.flush()
+
+def arrow_schema(columns: list | None = None):
+    fields = [pa.field(c, pa.float64() if c in NUMERIC_COLUMNS else pa.string())
+              for c in (columns or COLUMN_NAMES)]
+    fields += [pa.field("country_code", pa.string()),
+               pa.field("ano_ref", pa.int16()),
+               pa.field("mes_ref", pa.int8())]
+    return pa.schema(fields)
+
+class ColumnarSink:
+    """
+    Arquivo colunar tipado por ano-mês: Parquet (zstd) ou Arrow IPC (zstd).
+    Cada chunk vira um row group / record batch; as colunas de NUMERIC_COLUMNS
+    são convertidas para float64.
+    """
+
+    def __init__(self, path: Path, kind: str, columns: list | None = None):
+        if not ARROW_OK:
+            raise RuntimeError("Instale pyarrow para usar --output parquet/arrow.")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.schema = arrow_schema(columns)
+        self.tmp = path.with_name(path.name + ".partial")
+        if kind == "parquet":
+            self.writer = pq.ParquetWriter(str(self.tmp), self.schema, compression="zstd")
+        else:
+            self.writer = pa_ipc.new_file(str(self.tmp), self.schema,
+                                          options=pa_ipc.IpcWriteOptions(compression="zstd"))
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        for c in df.columns:
+            if c in NUMERIC_COLUMNS:
+                col = df[c]
+                if pd.api.types.is_string_dtype(col.dtype):
+                    col = col.str.replace(",", ".", regex=False)
+                df[c] = pd.to_numeric(col, errors="coerce")
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp, self.path)
+
+class AggregateSink:
+    """
+    Agregação em streaming: cada chunk limpo vira somas por grupo (colunas
+    `by`) das colunas numéricas `metrics`, mais a contagem de linhas; os
+    parciais são combinados a cada AGG_COMBINE_EVERY chunks, então a
+    memória depende do número de grupos, não do número de linhas.
+    """
+
+    AGG_COMBINE_EVERY = 8
+
+    def __init__(self, by: list, metrics: list):
+        self.by = by
+        self.metrics = metrics
+        self.parts = []
+        self.acc = None
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        num = pd.DataFrame({c: df[c] for c in self.by})
+        num["linhas"] = 1
+        for m in self.metrics:
+            col = df[m]
+            if pd.api.types.is_string_dtype(col.dtype):
+                col = col.str.replace(",", ".", regex=False)
+            num[m] = pd.to_numeric(col, errors="coerce")
+        self.parts.append(num.groupby(self.by, dropna=False, sort=False)[["linhas", *self.metrics]].sum())
+        if len(self.parts) >= self.AGG_COMBINE_EVERY:
+            self._combine()
+
+    def _combine(self):
+        parts = ([self.acc] if self.acc is not None else []) + self.parts
+        self.parts = []
+        if parts:
+            self.acc = pd.concat(parts).groupby(level=list(range(len(self.by))), dropna=False, sort=False).sum()
+
+    def close(self):
+        self._combine()
+
+    def records(self) -> list:
+        """Tabela final ordenada pelas chaves: [{<by>..., linhas, <metrics>...}]."""
+        if self.acc is None:
+            return []
+        tab = self.acc.sort_index().reset_index()
+        tab["linhas"] = tab["linhas"].astype(int)
+        tab = tab.astype(object).where(tab.notna(), None)
+        return tab.to_dict("records")
+
+# --------- filtros (predicate pushdown por chunk) ---------
+FILTER_COLUMNS = {
+    "importador": "NUM_UNICO_IMPORTADOR",
+    "aranc": "ARANC-NAC",
+    "pa_orig": "PA_ORIG",
+    "numencriptado": "NUMENCRIPTADO",
+}
+
+def filter_mask(chunk: pd.DataFrame, filters: dict):
+    """
+    Máscara vetorizada sobre o chunk cru (colunas posicionais): cada coluna
+    filtrada, já com strip, precisa estar no conjunto de valores pedido.
+    """
+    mask = None
+    for col, values in filters.items():
+        m = chunk[COLUMN_NAMES.index(col)].str.strip().isin(values)
+        mask = m if mask is None else (mask & m)
+    return mask
+
 def write_array_stream(
     data_paths,
     argv,
-    tmp_array_path: Path,
+    sink,
     year: int,
     month: int,
     limit: int | None,
-    enable_limit: bool
+    enable_limit: bool,
+    columns: list | None = None,
+    filters: dict | None = None,
+    stats: dict | None = None,
+    workers: int = 1,
 ) -> int:
     """
-    Escreve a array JSON em tmp_array_path (streaming) e retorna a contagem.
+    Escreve os registros no sink (JsonArraySink/NdjsonSink/ColumnarSink) e retorna a contagem.
+    Com `columns`, só essas colunas são lidas e emitidas.
+    Com `filters` ({coluna: {valores}}), as linhas são filtradas no chunk cru,
+    antes da limpeza e da serialização; stats["linhas_lidas"] recebe o total lido.
     Se enable_limit=True e limit>0, corta após N registros.
     Injeta country_code='CL', ano_ref=<year>, mes_ref=<month> em cada item.
+    Com workers>1, arquivos (e fatias de TXT grandes) são lidos em processos
+    paralelos e juntados na mesma ordem da leitura sequencial.
     """
     use_limit = bool(enable_limit and limit is not None and limit > 0)
 
+    if workers > 1:
+        units = split_units(data_paths, workers, argv)
+        if len(units) > 1:
+            return write_parallel(units, argv, sink, year, month, limit, enable_limit,
+                                  columns, filters, stats, workers)
+
+    usecols = projection(columns)
+    if usecols is not None and filters:
+        # colunas de filtro precisam ser lidas mesmo fora da projeção
+        usecols = sorted(set(usecols) | {COLUMN_NAMES.index(c) for c in filters})
+    stats = stats if stats is not None else {}
+    stats["linhas_lidas"] = 0
     total = 0
-    first_item_written = False
-    with open(tmp_array_path, "w", encoding="utf-8") as arr:
-        arr.write("[\n")
-        for p in data_paths:
-            eprint(f"Lendo: {p.name}", argv)
-            ext = p.suffix.lower()
-            try:
-                if ext in (".txt", ".csv"):
-                    enc, sep = sniff_text(p)
-                    for chunk in pd.read_csv(
-                        p,
-                        encoding=enc,
-                        sep=sep,
-                        dtype=str,
-                        header=None,
-                        on_bad_lines="skip",
-                        low_memory=False,
-                        chunksize=150_000,
-                        keep_default_na=False,
-                    ):
-                        df = chunk
-                        if df.shape[1] < len(COLUMN_NAMES):
-                            for i in range(len(COLUMN_NAMES) - df.shape[1]):
-                                df[f"_pad_{i+1}"] = None
-                            df = df.iloc[:, :len(COLUMN_NAMES)]
-                        elif df.shape[1] > len(COLUMN_NAMES):
-                            df = df.iloc[:, :len(COLUMN_NAMES)]
-                        df.columns = COLUMN_NAMES
-                        df = df.where(pd.notnull(df), None)
-
-                        for rec in df.to_dict(orient="records"):
-                            # limpeza fina
-                            for k, v in list(rec.items()):
-                                if isinstance(v, float) and pd.isna(v):
-                                    rec[k] = None
-                                elif isinstance(v, str):
-                                    rec[k] = v.strip()
-
-                            # >>> novos campos por item
-                            rec["country_code"] = "CL"
-                            rec["ano_ref"] = year
-                            rec["mes_ref"] = month
-
-                            if first_item_written:
-                                arr.write(",\n")
-                            arr.write(json.dumps(rec, ensure_ascii=False, allow_nan=False))
-                            first_item_written = True
-                            total += 1
-
-                            if use_limit and total >= limit:
-                                arr.write("\n]")
-                                return total
-
-                elif ext in (".xlsx", ".xls"):
-                    xdf = pd.read_excel(
-                        p,
-                        engine="openpyxl",
-                        header=None,
-                        dtype=str,
-                        na_filter=False,
-                    )
-                    df = xdf
-                    if df.shape[1] < len(COLUMN_NAMES):
-                        for i in range(len(COLUMN_NAMES) - df.shape[1]):
-                            df[f"_pad_{i+1}"] = None
-                        df = df.iloc[:, :len(COLUMN_NAMES)]
-                    elif df.shape[1] > len(COLUMN_NAMES):
-                        df = df.iloc[:, :len(COLUMN_NAMES)]
-                    df.columns = COLUMN_NAMES
-                    df = df.where(pd.notnull(df), None)
-
-                    for rec in df.to_dict(orient="records"):
-                        for k, v in list(rec.items()):
-                            if isinstance(v, float) and pd.isna(v):
-                                rec[k] = None
-                            elif isinstance(v, str):
-                                rec[k] = v.strip()
-
-                        # >>> novos campos por item
-                        rec["country_code"] = "CL"
-                        rec["ano_ref"] = year
-                        rec["mes_ref"] = month
-
-                        if first_item_written:
-                            arr.write(",\n")
-                        arr.write(json.dumps(rec, ensure_ascii=False, allow_nan=False))
-                        first_item_written = True
-                        total += 1
+    for p in data_paths:
+        eprint(f"Lendo: {p.name}", argv)
+        try:
+            for chunk in iter_raw_chunks(p, argv, usecols):
+                stats["linhas_lidas"] += len(chunk)
+                if filters:
+                    chunk = chunk[filter_mask(chunk, filters)]
+                if use_limit:
+                    chunk = chunk.iloc[:limit - total]
+                if chunk.empty:
+                    continue
+                sink.write(clean_chunk(chunk, year, month, columns))
+                total += len(chunk)
+                if use_limit and total >= limit:
+                    sink.close()
+                    return total
+        except Exception as e:
+            eprint(f"[aviso] falha ao ler {p.name}: {e}", argv)
+            stats.setdefault("falhas", []).append(p.name)
+    sink.close()
+    return total
 
-                        if use_limit and total >= limit:
-                            arr.write("\n]")
-                            return total
-                else:
-                    eprint(f"[ignorado] extensão não suportada: {ext}", argv)
+# --------- parse paralelo (arquivos e fatias de TXT em processos) ---------
+PARSE_WORKERS_DEFAULT = int(os.environ.get("CHILE_PARSE_WORKERS", str(min(8, os.cpu_count() or 1))))
+# TXT/CSV locais acima disso são fatiados em fim de linha (uma fatia por worker)
+SPLIT_MIN_BYTES = 64 * 1024 * 1024
+
+def split_units(data_paths, workers: int, argv) -> list:
+    """
+    Unidades de parse na ordem da leitura sequencial: cada arquivo inteiro
+    ou, para TXT/CSV locais grandes, fatias [start, end) cortadas em fim de
+    linha. Arquivos em UTF-16/32 não são fatiados.
+    """
+    import codecs
+
+    units = []
+    for p in data_paths:
+        if isinstance(p, RarMember) or p.suffix.lower() not in (".txt", ".csv"):
+            units.append(p)
+            continue
+        size = p.stat().st_size
+        n = min(workers, size // SPLIT_MIN_BYTES)
+        if n < 2:
+            units.append(p)
+            continue
+        enc, sep = sniff_text(p)
+        try:
+            wide = codecs.lookup(enc).name.startswith(("utf-16", "utf-32"))
+        except LookupError:
+            wide = True
+        if wide:
+            units.append(p)
+            continue
+        cuts = [0]
+        with open(p, "rb") as fh:
+            for i in range(1, n):
+                fh.seek(size * i // n)
+                fh.readline()
+                if cuts[-1] < fh.tell() < size:
+                    cuts.append(fh.tell())
+        cuts.append(size)
+        units.extend(FileSlice(p, a, b, enc, sep) for a, b in zip(cuts, cuts[1:]))
+        eprint(f"[parse] {p.name}: {len(cuts) - 1} fatias", argv)
+    return units
+
+class _SpoolSink:
+    """
+    Saída de um worker do parse paralelo: linhas JSON já serializadas
+    (quando o sink final aceita write_lines) ou DataFrames em pickle.
+    """
+
+    def __init__(self, fh, lines: bool):
+        self.fh = fh
+        self.lines = lines
+
+    def write(self, df: pd.DataFrame):
+        if self.lines:
+            self.fh.write(b"".join(ln + b"\n" for ln in serialize_chunk(df)))
+        else:
+            pickle.dump(df, self.fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        pass
+
+def _parse_worker(job: dict) -> dict:
+    stats = {}
+    with open(job["spool"], "wb") as fh:
+        write_array_stream([job["unit"]], job["argv"], _SpoolSink(fh, job["lines"]),
+                           job["year"], job["month"], job["limit"], job["enable_limit"],
+                           columns=job["columns"], filters=job["filters"], stats=stats)
+    return stats
+
+def _read_spool(path: Path, lines: bool):
+    """Relê o spool de um worker em blocos: listas de linhas ou DataFrames."""
+    with open(path, "rb") as fh:
+        if lines:
+            batch = []
+            for ln in fh:
+                batch.append(ln[:-1])
+                if len(batch) >= CHUNK_ROWS:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        else:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    return
+
+def write_parallel(units: list, argv, sink, year: int, month: int, limit: int | None,
+                   enable_limit: bool, columns: list | None, filters: dict | None,
+                   stats: dict | None, workers: int) -> int:
+    """
+    Cada unidade vira um spool escrito por um processo; o processo pai
+    repassa os spools ao sink na ordem das unidades, assim que cada um fica
+    pronto. Com --limit, cada worker corta em `limit` e o pai corta o total;
+    ao atingir o limite, as unidades ainda na fila são canceladas.
+    """
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    use_limit = bool(enable_limit and limit is not None and limit > 0)
+    lines = hasattr(sink, "write_lines")
+    first = units[0]
+    base = (first.archive if isinstance(first, RarMember) else first.path if isinstance(first, FileSlice) else first).parent
+    stats = stats if stats is not None else {}
+    stats["linhas_lidas"] = 0
+    total = 0
+    with tempfile.TemporaryDirectory(prefix="_parse", dir=base) as spool_dir, \
+            ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = []
+        for i, unit in enumerate(units):
+            futures.append(ex.submit(_parse_worker, {
+                "unit": unit, "argv": list(argv), "year": year, "month": month,
+                "limit": limit, "enable_limit": enable_limit, "columns": columns, "filters": filters,
+                "lines": lines, "spool": str(Path(spool_dir) / f"{i:04d}"),
+            }))
+        for i, (unit, fut) in enumerate(zip(units, futures)):
+            try:
+                st = fut.result()
             except Exception as e:
-                eprint(f"[aviso] falha ao ler {p.name}: {e}", argv)
-        arr.write("\n]")
+                eprint(f"[aviso] falha ao ler {unit.name}: {e}", argv)
+                stats.setdefault("falhas", []).append(unit.name)
+                continue
+            eprint(f"Lendo: {unit.name}", argv)
+            stats["linhas_lidas"] += st["linhas_lidas"]
+            if st.get("falhas"):
+                stats.setdefault("falhas", []).extend(st["falhas"])
+            spool = Path(spool_dir) / f"{i:04d}"
+            for block in _read_spool(spool, lines):
+                if use_limit:
+                    block = block[:limit - total] if lines else block.iloc[:limit - total]
+                if len(block) == 0:
+                    continue
+                if lines:
+                    sink.write_lines(block)
+                else:
+                    sink.write(block)
+                total += len(block)
+                if use_limit and total >= limit:
+                    break
+            spool.unlink(missing_ok=True)
+            if use_limit and total >= limit:
+                for f in futures[i + 1:]:
+                    f.cancel()
+                break
+    sink.close()
     return total
 
-# --------------- pipeline principal (JSON final) ---------------
-def run(year: int, month: int, workdir: Path, argv, limit: int | None, enable_limit: bool):
-    pkg = fetch_package(year)
-    res = select_month_resources(pkg.get("resources", []), year, month)
+# --------- store local de meses já processados (Arrow IPC + índices) ---------
+STORE_VERSION = 1
+STORE_INDEXES = ("NUM_UNICO_IMPORTADOR", "ARANC-NAC", "NUMENCRIPTADO")
+
+class StoreSink:
+    """
+    Sink que grava o mês limpo (todas as COLUMN_NAMES, como texto) num Arrow
+    IPC sem compressão — lido depois via memory map — e monta, em memória,
+    os índices valor -> linhas das colunas de STORE_INDEXES.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.schema = pa.schema([pa.field(c, pa.string()) for c in COLUMN_NAMES])
+        self.writer = pa_ipc.new_file(str(path), self.schema)
+        self.rows = 0
+        self.indexes = {c: {} for c in STORE_INDEXES}
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        df = df[COLUMN_NAMES]
+        for c, idx in self.indexes.items():
+            for i, v in enumerate(df[c].tolist(), start=self.rows):
+                if isinstance(v, str):
+                    idx.setdefault(v, []).append(i)
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        self.rows += len(df)
+
+    def close(self):
+        self.writer.close()
+
+class MonthStore:
+    """
+    Mês já processado em <root>/<AAAA-MM>/: data.arrow (memory map),
+    idx_<coluna>.json ({valor: [linhas]}) e meta.json com as chaves dos
+    recursos CKAN de origem. Se o CKAN republicar o mês, as chaves mudam e o
+    store é refeito no próximo parse.
+    """
+
+    def __init__(self, root: Path, year: int, month: int, res: list, argv):
+        self.root = root
+        self.dir = root / f"{year}-{month:02d}"
+        self.year, self.month = year, month
+        self.keys = [DownloadCache.key(r) for r in res]
+        self.argv = argv
+        self.transient = False
+
+    def valid(self) -> bool:
+        try:
+            meta = json.loads((self.dir / "meta.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+        return meta.get("versao") == STORE_VERSION and meta.get("recursos") == self.keys
+
+    def build(self, data_paths, argv, workers: int = 1, stats: dict | None = None) -> bool:
+        """
+        Parse completo do mês (sem projeção/filtros/limite) para o store.
+        Copia linhas_lidas/falhas para `stats`. Se algum arquivo falhou na
+        leitura, o mês fica incompleto: não há meta.json nem troca do store
+        anterior — a resposta desta execução sai do diretório temporário,
+        removido depois por write(). Retorna se o store ficou válido.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{self.dir.name}.{os.getpid()}.partial"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        t0 = time.time()
+        sink = StoreSink(tmp / "data.arrow")
+        st = {}
+        total = write_array_stream(data_paths, argv, sink, self.year, self.month, None, False,
+                                   stats=st, workers=workers)
+        if stats is not None:
+            stats["linhas_lidas"] = st["linhas_lidas"]
+            if st.get("falhas"):
+                stats.setdefault("falhas", []).extend(st["falhas"])
+        for c, idx in sink.indexes.items():
+            (tmp / f"idx_{c}.json").write_text(json.dumps(idx, ensure_ascii=False), encoding="utf-8")
+        if st.get("falhas"):
+            eprint(f"[store] {self.dir.name}: leitura incompleta ({', '.join(st['falhas'])}); "
+                   "store não gravado", self.argv)
+            self.dir, self.transient = tmp, True
+            return False
+        (tmp / "meta.json").write_text(json.dumps({
+            "versao": STORE_VERSION,
+            "recursos": self.keys,
+            "linhas": total,
+            "linhas_lidas": st["linhas_lidas"],
+        }), encoding="utf-8")
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.replace(tmp, self.dir)
+        eprint(f"[store] {self.dir.name}: {total} linhas gravadas em {time.time() - t0:.1f}s", self.argv)
+        return True
+
+    def index(self, col: str) -> dict:
+        return json.loads((self.dir / f"idx_{col}.json").read_text(encoding="utf-8"))
+
+    def write(self, sink, year: int, month: int, limit: int | None, enable_limit: bool,
+              columns: list | None = None, filters: dict | None = None, stats: dict | None = None) -> int:
+        """
+        Mesmo contrato de write_array_stream, respondido a partir do store:
+        filtros em colunas indexadas viram lista de linhas (interseção), os
+        demais são aplicados com pyarrow.compute sobre o resultado.
+        """
+        import pyarrow.compute as pc
+
+        t0 = time.time()
+        if not self.transient:
+            os.utime(self.dir / "meta.json")  # relógio do LRU compartilhado com DownloadCache
+        table = pa_ipc.open_file(pa.memory_map(str(self.dir / "data.arrow"))).read_all()
+        if stats is not None and not self.transient:
+            # com build incompleto, linhas_lidas/falhas já vieram do build
+            stats["linhas_lidas"] = table.num_rows
+        rest = dict(filters or {})
+        rows = None
+        for col in [c for c in rest if c in STORE_INDEXES]:
+            idx = self.index(col)
+            hit = {i for v in rest.pop(col) for i in idx.get(v, ())}
+            rows = hit if rows is None else (rows & hit)
+        if rows is not None:
+            table = table.take(pa.array(sorted(rows), type=pa.int64()))
+        for col, values in rest.items():
+            table = table.filter(pc.is_in(table[col], value_set=pa.array(sorted(values), type=pa.string())))
+        if enable_limit and limit is not None and limit > 0:
+            table = table.slice(0, limit)
+        if columns:
+            table = table.select(columns)
+        for off in range(0, table.num_rows, CHUNK_ROWS):
+            df = table.slice(off, CHUNK_ROWS).to_pandas()
+            df["country_code"] = "CL"
+            df["ano_ref"] = year
+            df["mes_ref"] = month
+            sink.write(df)
+        sink.close()
+        eprint(f"[store] {self.dir.name}: {table.num_rows} linhas em {(time.time() - t0) * 1000:.0f} ms", self.argv)
+        n = table.num_rows
+        if self.transient:
+            del table
+            shutil.rmtree(self.dir, ignore_errors=True)
+        return n
+
+# --------- modo delta (só linhas novas/alteradas + remoções) ---------
+DELTA_KEY = ("NUMENCRIPTADO", "NUMITEM")
+
+class DeltaManifest:
+    """
+    Manifesto do último envio confirmado de um mês, em <cache>/delta/AAAA-MM.sqlite:
+    chaves dos recursos CKAN e, por linha (NUMENCRIPTADO|NUMITEM), o hash
+    do registro JSON emitido. Um --delta só deixa o estado novo como
+    pendente (identificado por um lote); ele vira o manifesto quando quem
+    consumiu o delta confirma a gravação com --delta-commit <lote>.
+    """
+
+    def __init__(self, root: Path, year: int, month: int):
+        import sqlite3
+
+        root.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(root / f"{year}-{month:02d}.sqlite"))
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS recursos (ordem INTEGER PRIMARY KEY, chave TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS linhas (chave TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS pendente (chave TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS pendente_lote (lote TEXT NOT NULL, recursos TEXT NOT NULL);
+            CREATE TEMP TABLE novas (chave TEXT PRIMARY KEY, hash BLOB NOT NULL) WITHOUT ROWID;
+            CREATE TEMP TABLE lote (i INTEGER PRIMARY KEY, chave TEXT NOT NULL, hash BLOB NOT NULL);
+        """)
+
+    def resources(self) -> list:
+        return [r[0] for r in self.db.execute("SELECT chave FROM recursos ORDER BY ordem")]
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM linhas").fetchone()[0]
+
+    def diff(self, keys: list, hashes: list) -> list:
+        """Registra o lote em `novas` e devolve [(posição, é_nova)] das linhas que mudaram."""
+        self.db.execute("DELETE FROM lote")
+        self.db.executemany("INSERT INTO lote VALUES (?, ?, ?)", zip(range(len(keys)), keys, hashes))
+        self.db.execute("INSERT OR REPLACE INTO novas SELECT chave, hash FROM lote")
+        return self.db.execute("""
+            SELECT b.i, l.hash IS NULL FROM lote b LEFT JOIN linhas l ON l.chave = b.chave
+            WHERE l.hash IS NULL OR l.hash != b.hash ORDER BY b.i
+        """).fetchall()
+
+    def removed(self):
+        return self.db.execute("SELECT chave FROM linhas WHERE chave NOT IN (SELECT chave FROM novas)")
+
+    def stage(self, resource_keys: list) -> str:
+        """Guarda o conteúdo desta execução como pendente e devolve o lote que o confirma."""
+        lote = os.urandom(8).hex()
+        with self.db:
+            self.db.execute("DELETE FROM pendente")
+            self.db.execute("INSERT INTO pendente SELECT chave, hash FROM novas")
+            self.db.execute("DELETE FROM pendente_lote")
+            self.db.execute("INSERT INTO pendente_lote VALUES (?, ?)", (lote, json.dumps(resource_keys)))
+        return lote
+
+    def commit(self, lote: str) -> bool:
+        """
+        Troca o manifesto pelo pendente do `lote` (uma transação). Devolve
+        False se o pendente for de outro lote (um --delta posterior o trocou).
+        """
+        row = self.db.execute("SELECT lote, recursos FROM pendente_lote").fetchone()
+        if not row or row[0] != lote:
+            return False
+        with self.db:
+            self.db.execute("DELETE FROM linhas")
+            self.db.execute("INSERT INTO linhas SELECT chave, hash FROM pendente")
+            self.db.execute("DELETE FROM recursos")
+            self.db.executemany("INSERT INTO recursos VALUES (?, ?)", enumerate(json.loads(row[1])))
+            self.db.execute("DELETE FROM pendente")
+            self.db.execute("DELETE FROM pendente_lote")
+        return True
+
+    def close(self):
+        self.db.close()
+
+class DeltaSink:
+    """
+    Envolve o sink final: cada chunk limpo é comparado (hash do registro
+    serializado) com o manifesto e só linhas novas/alteradas seguem, com
+    delta_op='novo'/'alterado'. No fechamento saem as remoções (delta_op=
+    'removido', só com a chave) e o estado novo fica pendente, com o lote
+    em stats["delta"]["lote"]. Se algum arquivo falhou na leitura, não há
+    remoções nem lote.
+    """
+
+    def __init__(self, sink, manifest: DeltaManifest, resource_keys: list,
+                 year: int, month: int, stats: dict, argv):
+        self.sink = sink
+        self.manifest = manifest
+        self.resource_keys = resource_keys
+        self.year, self.month = year, month
+        self.stats = stats
+        self.argv = argv
+        self.counts = {"novos": 0, "alterados": 0, "removidos": 0, "inalterados": 0}
+        self.emitted = 0
+
+    def write(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        keys = (df[DELTA_KEY[0]].fillna("") + "|" + df[DELTA_KEY[1]].fillna("")).tolist()
+        hashes = [hashlib.blake2b(ln, digest_size=16).digest() for ln in serialize_chunk(df)]
+        changed = self.manifest.diff(keys, hashes)
+        self.counts["inalterados"] += len(df) - len(changed)
+        if not changed:
+            return
+        out = df.iloc[[i for i, _ in changed]].copy()
+        out["delta_op"] = ["novo" if nova else "alterado" for _, nova in changed]
+        novos = sum(1 for _, nova in changed if nova)
+        self.counts["novos"] += novos
+        self.counts["alterados"] += len(changed) - novos
+        self.sink.write(out)
+        self.emitted += len(out)
+
+    def close(self):
+        if self.stats.get("falhas"):
+            eprint(f"[delta] leitura incompleta ({', '.join(self.stats['falhas'])}); "
+                   "remoções não emitidas e manifesto mantido", self.argv)
+            self.counts["incompleto"] = True
+        else:
+            cur = self.manifest.removed()
+            while True:
+                rows = cur.fetchmany(CHUNK_ROWS)
+                if not rows:
+                    break
+                parts = [k.split("|", 1) for (k,) in rows]
+                self.sink.write(pd.DataFrame({
+                    DELTA_KEY[0]: [p[0] for p in parts],
+                    DELTA_KEY[1]: [p[1] if len(p) > 1 else "" for p in parts],
+                    "country_code": "CL",
+                    "ano_ref": self.year,
+                    "mes_ref": self.month,
+                    "delta_op": "removido",
+                }))
+                self.counts["removidos"] += len(rows)
+                self.emitted += len(rows)
+            self.counts["lote"] = self.manifest.stage(self.resource_keys)
+        self.sink.close()
+        self.manifest.close()
+        self.stats["delta"] = self.counts
 
+def write_month(year: int, month: int, workdir: Path, argv, res: list, sink,
+                limit: int | None, enable_limit: bool, store_mode: str = "auto",
+                prepare: dict | None = None, columns: list | None = None,
+                filters: dict | None = None, stats: dict | None = None,
+                parse_workers: int = 1, delta: bool = False) -> int:
+    """
+    Escreve o mês no sink. Com o store ligado (e pyarrow instalado), um mês
+    já processado é respondido do store local sem download nem parse; um mês
+    novo é processado inteiro uma vez para o store e então respondido dele.
+    Com --limit ativo e o mês fora do store, faz o parse direto (o store só
+    é montado com o mês completo).
+    Com `delta`, o sink recebe só a diferença para o último envio confirmado
+    (DeltaSink) e o retorno é o número de registros emitidos; se os recursos
+    CKAN não mudaram desde então, nada é baixado nem lido.
+    """
+    prepare = prepare or {}
+    if delta:
+        stats = stats if stats is not None else {}
+        manifest = DeltaManifest(Path(prepare.get("cache_dir", CACHE_DIR_DEFAULT)) / "delta", year, month)
+        keys = [DownloadCache.key(r) for r in res]
+        if manifest.resources() == keys:
+            stats["linhas_lidas"] = 0
+            stats["delta"] = {"novos": 0, "alterados": 0, "removidos": 0,
+                              "inalterados": manifest.count(), "recursos_inalterados": True}
+            manifest.close()
+            sink.close()
+            return 0
+        sink = DeltaSink(sink, manifest, keys, year, month, stats, argv)
+        write_month(year, month, workdir, argv, res, sink, limit, enable_limit, store_mode,
+                    prepare, columns, filters, stats, parse_workers)
+        return sink.emitted
+
+    use_limit = bool(enable_limit and limit is not None and limit > 0)
+    opts = dict(year=year, month=month, limit=limit, enable_limit=enable_limit,
+                columns=columns, filters=filters, stats=stats)
+    store = None
+    if store_mode != "off" and ARROW_OK:
+        root = Path(prepare.get("cache_dir", CACHE_DIR_DEFAULT)) / "store"
+        store = MonthStore(root, year, month, res, argv)
+        if store_mode == "auto" and store.valid():
+            return store.write(sink, **opts)
+
+    month_dir, _, data_paths = prepare_month(year, month, workdir, argv, res, **prepare)
+    try:
+        if store is not None and not use_limit:
+            if store.build(data_paths, argv, parse_workers, stats):
+                DownloadCache(root.parent, prepare.get("cache_max_bytes", CACHE_MAX_BYTES_DEFAULT),
+                              argv).evict(keep={store.dir.name, *store.keys})
+            return store.write(sink, **opts)
+        return write_array_stream(data_paths, argv, sink, workers=parse_workers, **opts)
+    finally:
+        cleanup_month(month_dir, workdir)
+
+# --------------- pipeline principal (JSON final) ---------------
+def prepare_month(year: int, month: int, workdir: Path, argv, res: list,
+                  cache_dir: Path = Path(CACHE_DIR_DEFAULT), cache_max_bytes: int = CACHE_MAX_BYTES_DEFAULT,
+                  download_workers: int = DOWNLOAD_WORKERS_DEFAULT, extract_mode: str = "auto"):
+    """Baixa (via cache) e extrai/lista os recursos do mês: (month_dir, tmp, data_paths)."""
     month_dir = workdir / f"{year}-{month:02d}"
     tmp = month_dir / "_tmp"
     tmp.mkdir(parents=True, exist_ok=True)
@@ -299,63 +1521,156 @@ def run(year: int, month: int, workdir: Path, argv, limit: int | None, enable_li
     data_paths = []
     first_rar = None
 
-    for r in res:
-        url = r.get("url") or r.get("download_url") or r.get("path") or ""
-        if not url:
-            continue
-        dst = tmp / Path(url).name
-        download(url, dst, argv)
+    # partes baixadas em paralelo para o cache; no workdir ficam só hardlinks
+    cache = DownloadCache(cache_dir, cache_max_bytes, argv)
+    blobs = cache.fetch_all(res, workers=download_workers)
+
+    for r, blob in zip(res, blobs):
+        dst = tmp / Path(resource_url(r)).name
+        link_or_copy(blob, dst)
         if dst.suffix.lower() == ".rar":
             if first_rar is None or re.search(r'\.part0*1\.rar$', dst.name, re.I):
                 first_rar = dst
-        elif dst.suffix.lower() in (".txt", ".csv", ".xlsx", ".xls"):
+        elif dst.suffix.lower() in DATA_EXTS:
             data_paths.append(dst)
 
     if first_rar is not None:
-        extracted = tmp / "extracted"
-        extract_rar(first_rar, extracted, argv)
-        data_paths.extend(find_data_files(extracted))
+        members = None
+        if extract_mode != "disk":
+            try:
+                members = list_rar_members(first_rar, argv)
+            except Exception as e:
+                if extract_mode == "pipe":
+                    raise
+                eprint(f"[aviso] listagem do RAR falhou ({e}); extraindo em disco", argv)
+        if members is not None:
+            data_paths.extend(members)
+        else:
+            extracted = tmp / "extracted"
+            extract_rar(first_rar, extracted, argv)
+            data_paths.extend(find_data_files(extracted))
 
     if not data_paths:
-        try:
-            shutil.rmtree(month_dir, ignore_errors=True)
-            try: os.rmdir(workdir)
-            except OSError: pass
-        finally:
-            pass
+        cleanup_month(month_dir, workdir)
         raise FileNotFoundError("Nenhum arquivo .txt/.csv/.xlsx encontrado após o download.")
 
-    data_paths.sort(key=lambda p: p.stat().st_size, reverse=True)
+    data_paths.sort(key=source_size, reverse=True)
+    return month_dir, tmp, data_paths
 
-    # 1) escreve apenas a array (streaming) em arquivo temporário
-    tmp_array_path = tmp / "resultados_array.json"
-    total = write_array_stream(
-        data_paths, argv, tmp_array_path,
-        year=year, month=month,
-        limit=limit, enable_limit=enable_limit
-    )
+def cleanup_month(month_dir: Path, workdir: Path):
+    # ===== LIMPEZA TOTAL DO WORKDIR =====
+    try:
+        shutil.rmtree(month_dir, ignore_errors=True)
+    except Exception:
+        pass
+    try:
+        os.rmdir(workdir)  # remove se vazio
+    except OSError:
+        pass
 
+def month_summary(year: int, month: int, total: int, stats: dict,
+                  limit: int | None, enable_limit: bool, filters: dict | None) -> dict:
     first_day = f"01/{month:02d}/{year}"
     last_day_num = calendar.monthrange(year, month)[1]
     last_day = f"{last_day_num:02d}/{month:02d}/{year}"
-
     lim_tag = f" (limitado a {limit})" if (enable_limit and limit is not None and limit > 0) else ""
-    descricao = f"Foram encontradas {total} importações no período de {first_day} a {last_day}{lim_tag}"
-    
-    # Emite o JSON final diretamente no stdout (sem gravar arquivo)
-    with open(tmp_array_path, "r", encoding="utf-8") as arr:
-        print('{')
-        print('  "descricao": ' + json.dumps(descricao, ensure_ascii=False) + ',')
-        print('  "total": ' + str(total) + ',')
-        print('  "resultados": ', end='')
-        shutil.copyfileobj(arr, _sys.stdout)
-        print("\n}")
-        
+    out = {
+        "descricao": f"Foram encontradas {total} importações no período de {first_day} a {last_day}{lim_tag}",
+        "total": total,
+    }
+    if "delta" in stats:
+        d = stats["delta"]
+        out["descricao"] = (
+            f"Delta de {first_day} a {last_day}: {d['novos']} novas, {d['alterados']} alteradas, "
+            f"{d['removidos']} removidas ({d['inalterados']} inalteradas)"
+        )
+        out["delta"] = d
+    if filters:
+        out["descricao"] += f" (filtradas de {stats['linhas_lidas']} linhas lidas)"
+        out["linhas_lidas"] = stats["linhas_lidas"]
+        out["filtros"] = {c: sorted(v) for c, v in filters.items()}
+    return out
+
+def columnar_path(out_dir: Path, year: int, month: int, output: str) -> Path:
+    ext = "parquet" if output == "parquet" else "arrow"
+    return out_dir / f"chile_{year}-{month:02d}.{ext}"
+
+def run(year: int, month: int, workdir: Path, argv, limit: int | None, enable_limit: bool,
+        cache_dir: Path = Path(CACHE_DIR_DEFAULT), cache_max_bytes: int = CACHE_MAX_BYTES_DEFAULT,
+        package_ttl: int = PACKAGE_TTL_DEFAULT, download_workers: int = DOWNLOAD_WORKERS_DEFAULT,
+        extract_mode: str = "auto", fmt: str = "json",
+        output: str = "json", columns: list | None = None, out_dir: Path = Path("./data_out/chile"),
+        filters: dict | None = None, store_mode: str = "auto",
+        parse_workers: int = PARSE_WORKERS_DEFAULT, delta: bool = False,
+        aggregate_by: list | None = None, metrics: list | None = None):
+    SNIFF_CACHE.configure(cache_dir)
+    pkg = fetch_package(year, cache_dir, package_ttl, argv)
+    res = select_month_resources(pkg.get("resources", []), year, month)
+    res = [r for r in res if resource_url(r)]
+
+    stats = {}
+    opts = dict(limit=limit, enable_limit=enable_limit, store_mode=store_mode,
+                columns=columns, filters=filters, stats=stats, parse_workers=parse_workers, delta=delta,
+                prepare=dict(cache_dir=cache_dir, cache_max_bytes=cache_max_bytes,
+                             download_workers=download_workers, extract_mode=extract_mode))
+
+    def resumo(total: int) -> dict:
+        return month_summary(year, month, total, stats, limit, enable_limit, filters)
+
+    if aggregate_by:
+        # só a tabela agregada sai; os registros nunca são serializados
+        agg = AggregateSink(aggregate_by, metrics or [])
+        opts["columns"] = list(dict.fromkeys(aggregate_by + (metrics or [])))
+        lidas = write_month(year, month, workdir, argv, res, agg, **opts)
+        tabela = agg.records()
+        out = resumo(lidas)
+        out["descricao"] = (
+            f"Agregação de {lidas} importações em {len(tabela)} grupos por {','.join(aggregate_by)} "
+            f"no período de 01/{month:02d}/{year} a {calendar.monthrange(year, month)[1]:02d}/{month:02d}/{year}"
+        )
+        out["total"] = len(tabela)
+        out["linhas_agregadas"] = lidas
+        out["agregacao"] = {"por": aggregate_by, "metricas": metrics or []}
+        if fmt == "ndjson":
+            for rec in tabela:
+                _sys.stdout.buffer.write(dumps_record(rec) + b"\n")
+            _sys.stdout.flush()
+            print(json.dumps(out, ensure_ascii=False), flush=True)
+        else:
+            print(json.dumps({**out, "resultados": tabela}, ensure_ascii=False))
+    elif output in ("parquet", "arrow"):
+        # arquivo colunar por ano-mês; no stdout vai só o resumo com o caminho
+        out_path = columnar_path(out_dir, year, month, output)
+        total = write_month(year, month, workdir, argv, res, ColumnarSink(out_path, output, columns), **opts)
+        print(json.dumps({
+            **resumo(total),
+            "formato": output,
+            "arquivo": str(out_path.resolve()),
+            "colunas": list(arrow_schema(columns).names),
+        }, ensure_ascii=False))
+    elif fmt == "ndjson":
+        # registros vão direto para o stdout; o resumo fecha o stream
+        _sys.stdout.flush()
+        total = write_month(year, month, workdir, argv, res, NdjsonSink(_sys.stdout.buffer), **opts)
+        print(json.dumps(resumo(total), ensure_ascii=False), flush=True)
+    else:
+        # 1) escreve apenas a array (streaming) em arquivo temporário
+        workdir.mkdir(parents=True, exist_ok=True)
+        tmp_array_path = workdir / f"resultados_{year}-{month:02d}.json"
+        with open(tmp_array_path, "wb") as fh:
+            total = write_month(year, month, workdir, argv, res, JsonArraySink(fh), **opts)
+
+        # Emite o JSON final diretamente no stdout (sem gravar arquivo)
+        with open(tmp_array_path, "r", encoding="utf-8") as arr:
+            print('{')
+            for k, v in resumo(total).items():
+                print(f'  {json.dumps(k)}: ' + json.dumps(v, ensure_ascii=False) + ',')
+            print('  "resultados": ', end='')
+            shutil.copyfileobj(arr, _sys.stdout)
+            print("\n}")
+        tmp_array_path.unlink(missing_ok=True)
+
     # ===== LIMPEZA TOTAL DO WORKDIR =====
-    try:
-        shutil.rmtree(month_dir, ignore_errors=True)
-    except Exception:
-        pass
     try:
         os.rmdir(workdir)  # remove se vazio
     except OSError:
@@ -363,17 +1678,228 @@ def run(year: int, month: int, workdir: Path, argv, limit: int | None, enable_li
 
     # Não imprime resumo extra no stdout para não poluir o JSON
 
+# --------------- vários meses (--from/--to) em processos paralelos ---------------
+RANGE_WORKERS_DEFAULT = 2
+DISK_BUDGET_DEFAULT = int(os.environ.get("CHILE_DISK_BUDGET", str(20 * 1024 ** 3)))
+# Estimativa de disco por mês: tamanho dos recursos CKAN x fator
+# (RAR de texto comprime ~10x e o spool NDJSON fica do tamanho do texto)
+RANGE_DISK_FACTOR = 10
+
+def iter_months(ym_from: str, ym_to: str):
+    y, m = (int(x) for x in ym_from.split("-"))
+    y2, m2 = (int(x) for x in ym_to.split("-"))
+    while (y, m) <= (y2, m2):
+        yield y, m
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+
+def _range_worker(job: dict) -> dict:
+    """
+    Processa um mês num processo separado. Registros vão para um spool NDJSON
+    (ou direto para o arquivo colunar) que o processo pai repassa em ordem.
+    """
+    year, month, argv = job["year"], job["month"], job["argv"]
+    workdir = Path(job["workdir"])
+    SNIFF_CACHE.configure(Path(job["cache_dir"]))
+    out = {"ano": year, "mes": month}
+    try:
+        stats = {}
+        opts = dict(limit=job["limit"], enable_limit=job["enable_limit"], store_mode=job["store_mode"],
+                    columns=job["columns"], filters=job["filters"], stats=stats,
+                    parse_workers=job["parse_workers"], delta=job["delta"],
+                    prepare=dict(cache_dir=Path(job["cache_dir"]), cache_max_bytes=job["cache_max_bytes"],
+                                 download_workers=job["download_workers"], extract_mode=job["extract_mode"]))
+        if job["output"] in ("parquet", "arrow"):
+            out_path = columnar_path(Path(job["out_dir"]), year, month, job["output"])
+            sink = ColumnarSink(out_path, job["output"], job["columns"])
+            total = write_month(year, month, workdir, argv, job["res"], sink, **opts)
+            out["arquivo"] = str(out_path.resolve())
+        else:
+            with open(job["spool"], "wb") as fh:
+                total = write_month(year, month, workdir, argv, job["res"], NdjsonSink(fh), **opts)
+        out.update(month_summary(year, month, total, stats, job["limit"], job["enable_limit"], job["filters"]))
+    except Exception as e:
+        out.update({"total": 0, "erro": f"{type(e).__name__}: {e}"})
+    return out
+
+def run_range(ym_from: str, ym_to: str, workdir: Path, argv, limit: int | None, enable_limit: bool,
+              cache_dir: Path = Path(CACHE_DIR_DEFAULT), cache_max_bytes: int = CACHE_MAX_BYTES_DEFAULT,
+              package_ttl: int = PACKAGE_TTL_DEFAULT, download_workers: int = DOWNLOAD_WORKERS_DEFAULT,
+              extract_mode: str = "auto", fmt: str = "json",
+              output: str = "json", columns: list | None = None, out_dir: Path = Path("./data_out/chile"),
+              filters: dict | None = None, store_mode: str = "auto",
+              parse_workers: int = PARSE_WORKERS_DEFAULT, delta: bool = False,
+              workers: int = RANGE_WORKERS_DEFAULT,
+              disk_budget: int = DISK_BUDGET_DEFAULT):
+    """
+    Vários meses com download/extração/parse em processos paralelos.
+    Os metadados CKAN são buscados uma vez por ano; um mês só entra na fila
+    se a estimativa de disco dos meses em andamento couber em disk_budget
+    (o primeiro sempre entra). A saída sai na ordem dos meses.
+    """
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    packages = {}
+    spool_dir = workdir / "_range"
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    jobs, meses = deque(), []
+    for year, month in iter_months(ym_from, ym_to):
+        try:
+            if year not in packages:
+                packages[year] = fetch_package(year, cache_dir, package_ttl, argv)
+            res = select_month_resources(packages[year].get("resources", []), year, month)
+        except Exception as e:
+            meses.append({"ano": year, "mes": month, "total": 0, "erro": str(e)})
+            continue
+        res = [r for r in res if resource_url(r)]
+        est = sum(int(r.get("size") or 0) for r in res) * RANGE_DISK_FACTOR
+        jobs.append({
+            "year": year, "month": month, "argv": list(argv), "res": res, "est": est,
+            "workdir": str(workdir), "cache_dir": str(cache_dir), "cache_max_bytes": cache_max_bytes,
+            "download_workers": download_workers, "extract_mode": extract_mode,
+            "limit": limit, "enable_limit": enable_limit, "columns": columns, "filters": filters,
+            "output": output, "out_dir": str(out_dir), "store_mode": store_mode,
+            # os processos de parse são divididos entre os meses em andamento
+            "parse_workers": max(1, parse_workers // max(1, workers)),
+            "delta": delta,
+            "spool": str(spool_dir / f"{year}-{month:02d}.ndjson"),
+        })
+
+    use_limit = bool(enable_limit and limit is not None and limit > 0)
+    columnar = output in ("parquet", "arrow")
+    total = 0
+    first = True
+    if not columnar:
+        _sys.stdout.flush()
+        if fmt != "ndjson":
+            _sys.stdout.buffer.write(b'{\n  "resultados": [\n')
+    out = _sys.stdout.buffer
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as ex:
+        running, in_flight = {}, 0
+        order = list(jobs)
+        for job in order:
+            # admite meses (em ordem) enquanto houver orçamento de disco
+            while jobs and len(running) < max(1, workers) and (
+                    not running or in_flight + jobs[0]["est"] <= disk_budget):
+                nxt = jobs.popleft()
+                running[id(nxt)] = ex.submit(_range_worker, nxt)
+                in_flight += nxt["est"]
+            res = running.pop(id(job)).result()
+            in_flight -= job["est"]
+            meses.append(res)
+            spool = Path(job["spool"])
+            if not columnar and spool.exists():
+                with open(spool, "rb") as fh:
+                    for line in fh:
+                        if use_limit and total >= limit:
+                            break
+                        if fmt == "ndjson":
+                            out.write(line)
+                        else:
+                            out.write((b"" if first else b",\n") + line.rstrip(b"\n"))
+                        first = False
+                        total += 1
+                out.flush()
+                spool.unlink(missing_ok=True)
+            elif columnar:
+                total += res.get("total", 0)
+            eprint(f"[range] {job['year']}-{job['month']:02d}: {res.get('total', 0)} registros", argv)
+            if use_limit and total >= limit:
+                for f in running.values():
+                    f.cancel()
+                break
+
+    meses.sort(key=lambda m: (m["ano"], m["mes"]))
+    lim_tag = f" (limitado a {limit})" if use_limit else ""
+    resumo = {
+        "descricao": f"Foram encontradas {total} importações no período de {ym_from} a {ym_to}{lim_tag}",
+        "total": total,
+        "meses": meses,
+    }
+    if columnar:
+        print(json.dumps({**resumo, "formato": output}, ensure_ascii=False))
+    elif fmt == "ndjson":
+        print(json.dumps(resumo, ensure_ascii=False), flush=True)
+    else:
+        out.write(b"\n  ]")
+        for k, v in resumo.items():
+            out.write(f',\n  {json.dumps(k)}: {json.dumps(v, ensure_ascii=False)}'.encode("utf-8"))
+        out.write(b"\n}\n")
+        out.flush()
+
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    try:
+        os.rmdir(workdir)
+    except OSError:
+        pass
+
 # ---------------------- CLI -----------------------
 if __name__ == "__main__":
     import sys
     ap = argparse.ArgumentParser(
         description="Chile (CKAN) -> JSON bruto streaming, country_code=CL (limpa workdir ao final)."
     )
-    ap.add_argument("year", type=int, help="Ano (ex.: 2025)")
-    ap.add_argument("month", type=int, help="Mês 1..12 (ex.: 1)")
+    ap.add_argument("year", type=int, nargs="?", help="Ano (ex.: 2025)")
+    ap.add_argument("month", type=int, nargs="?", help="Mês 1..12 (ex.: 1)")
+    ap.add_argument("--from", dest="ym_from", type=str, default=None,
+                    help="Início do intervalo AAAA-MM (modo vários meses, com --to)")
+    ap.add_argument("--to", dest="ym_to", type=str, default=None,
+                    help="Fim do intervalo AAAA-MM (inclusivo)")
+    ap.add_argument("--workers", type=int, default=RANGE_WORKERS_DEFAULT,
+                    help="Meses processados em paralelo no modo --from/--to")
+    ap.add_argument("--parse-workers", type=int, default=PARSE_WORKERS_DEFAULT,
+                    help="Processos de parse por mês (arquivos e fatias de TXT grandes em paralelo); 1 = sequencial")
+    ap.add_argument("--disk-budget", type=int, default=DISK_BUDGET_DEFAULT,
+                    help="Orçamento de disco (bytes) para os meses em andamento no modo --from/--to")
     ap.add_argument("--workdir", type=str, default="./data_work",
                     help="Diretório de trabalho/temporários (será removido ao final)")
     ap.add_argument("--debug", "-d", action="store_true", help="Mostra logs de progresso (stderr)")
+    ap.add_argument("--cache-dir", type=str, default=CACHE_DIR_DEFAULT,
+                    help="Cache persistente de downloads e metadados CKAN (não é limpo ao final)")
+    ap.add_argument("--cache-max-bytes", type=int, default=CACHE_MAX_BYTES_DEFAULT,
+                    help="Tamanho máximo do cache de downloads + store de meses (remoção LRU)")
+    ap.add_argument("--package-ttl", type=int, default=PACKAGE_TTL_DEFAULT,
+                    help="Validade (s) dos metadados CKAN em cache; -1 = nunca expira")
+    ap.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS_DEFAULT,
+                    help="Partes baixadas em paralelo")
+    ap.add_argument("--extract-mode", choices=["auto", "pipe", "disk"], default="auto",
+                    help="pipe: lê os membros do RAR direto do stdout do extrator (sem gravar o texto); "
+                         "disk: extrai para _tmp/extracted; auto: pipe com fallback para disk")
+    ap.add_argument("--format", choices=["json", "ndjson"], default="json",
+                    help="json: objeto único; ndjson: um registro por linha e, no fim, {descricao,total}")
+    ap.add_argument("--output", choices=["json", "parquet", "arrow"], default="json",
+                    help="parquet/arrow: grava um arquivo colunar tipado por ano-mês em --out-dir "
+                         "e imprime só o resumo")
+    ap.add_argument("--out-dir", type=str, default="./data_out/chile",
+                    help="Destino dos arquivos de --output parquet/arrow")
+    ap.add_argument("--columns", type=str, default=None,
+                    help="Projeção: colunas de COLUMN_NAMES separadas por vírgula (as demais não são lidas)")
+    ap.add_argument("--importador", type=str, default=None,
+                    help="Filtra por NUM_UNICO_IMPORTADOR (valores separados por vírgula)")
+    ap.add_argument("--aranc", type=str, default=None,
+                    help="Filtra por ARANC-NAC (valores separados por vírgula)")
+    ap.add_argument("--pa-orig", type=str, default=None,
+                    help="Filtra por PA_ORIG (valores separados por vírgula)")
+    ap.add_argument("--numencriptado", type=str, default=None,
+                    help="Filtra por NUMENCRIPTADO (valores separados por vírgula)")
+    ap.add_argument("--aggregate-by", type=str, default=None,
+                    help="Agrega em vez de emitir linhas: colunas de agrupamento separadas por vírgula "
+                         "(ex.: PA_ORIG,ARANC-NAC)")
+    ap.add_argument("--metrics", type=str, default="FOB,CIF,TOT_PESO",
+                    help="Colunas numéricas somadas por grupo em --aggregate-by (além da contagem de linhas)")
+    ap.add_argument("--delta", action="store_true",
+                    help="Emite só linhas novas/alteradas (delta_op) e remoções desde o último delta confirmado "
+                         "do mês (manifesto em <cache-dir>/delta, chave NUMENCRIPTADO+NUMITEM); o resumo traz "
+                         "delta.lote para o --delta-commit")
+    ap.add_argument("--delta-commit", dest="delta_commit", type=str, default=None, metavar="LOTE",
+                    help="Confirma que o delta do lote (delta.lote de um --delta do mesmo mês) foi gravado: "
+                         "o manifesto avança e o próximo --delta parte dele")
+    ap.add_argument("--store", choices=["auto", "off", "refresh"], default="auto",
+                    help="Store local dos meses já processados em <cache-dir>/store (requer pyarrow; "
+                         "entra no mesmo --cache-max-bytes dos downloads): "
+                         "auto: responde do store ou o monta no primeiro parse; off: sempre faz o parse; "
+                         "refresh: refaz o store do mês")
 
     # 🔒 Limite OPCIONAL com proteção
     ap.add_argument("--limit", type=int, default=None,
@@ -383,14 +1909,83 @@ if __name__ == "__main__":
 
     args = ap.parse_args()
 
-    if not (1 <= args.month <= 12):
+    range_mode = bool(args.ym_from or args.ym_to)
+    if range_mode:
+        if not (args.ym_from and args.ym_to):
+            ap.error("--from e --to devem ser usados juntos")
+        for ym in (args.ym_from, args.ym_to):
+            if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", ym):
+                ap.error(f"período inválido (use AAAA-MM): {ym}")
+        if args.ym_from > args.ym_to:
+            ap.error("--from deve ser <= --to")
+    elif args.year is None or args.month is None:
+        ap.error("informe year month ou --from/--to")
+    elif not (1 <= args.month <= 12):
         ap.error("month deve ser 1..12")
 
-    run(
-        year=args.year,
-        month=args.month,
+    if args.delta_commit:
+        if range_mode or args.delta:
+            ap.error("--delta-commit é por mês (year month) e não combina com --from/--to nem --delta")
+        manifest = DeltaManifest(Path(args.cache_dir) / "delta", args.year, args.month)
+        try:
+            ok = manifest.commit(args.delta_commit)
+        finally:
+            manifest.close()
+        eprint(f"[delta] lote {args.delta_commit}: " + ("confirmado" if ok else "não é o pendente do mês"), sys.argv)
+        print(json.dumps({"ano": args.year, "mes": args.month, "lote": args.delta_commit, "confirmado": ok}))
+        sys.exit(0)
+
+    columns = [c.strip() for c in args.columns.split(",") if c.strip()] if args.columns else None
+    desconhecidas = [c for c in (columns or []) if c not in COLUMN_NAMES]
+    if desconhecidas:
+        ap.error(f"colunas desconhecidas em --columns: {','.join(desconhecidas)}")
+
+    filters = {}
+    for arg, col in FILTER_COLUMNS.items():
+        raw = getattr(args, arg)
+        if raw:
+            filters[col] = {v.strip() for v in raw.split(",") if v.strip()}
+
+    aggregate_by = metrics = None
+    if args.aggregate_by:
+        aggregate_by = [c.strip() for c in args.aggregate_by.split(",") if c.strip()]
+        metrics = [c.strip() for c in (args.metrics or "").split(",") if c.strip()]
+        desconhecidas = [c for c in aggregate_by if c not in COLUMN_NAMES]
+        if desconhecidas:
+            ap.error(f"colunas desconhecidas em --aggregate-by: {','.join(desconhecidas)}")
+        nao_numericas = [c for c in metrics if c not in NUMERIC_COLUMNS]
+        if nao_numericas:
+            ap.error(f"métricas não numéricas em --metrics: {','.join(nao_numericas)}")
+        if range_mode or columns or args.delta or args.output != "json":
+            ap.error("--aggregate-by é por mês e não combina com --from/--to, --columns, --delta "
+                     "nem --output parquet/arrow")
+
+    if args.delta and (columns or filters or args.enable_limit or args.output != "json"):
+        # o manifesto descreve o mês inteiro: recortes quebrariam as remoções
+        ap.error("--delta não combina com --columns, filtros, --enable-limit nem --output parquet/arrow")
+
+    common = dict(
         workdir=Path(args.workdir),
         argv=sys.argv,
         limit=args.limit,
-        enable_limit=args.enable_limit
+        enable_limit=args.enable_limit,
+        cache_dir=Path(args.cache_dir),
+        cache_max_bytes=args.cache_max_bytes,
+        package_ttl=args.package_ttl,
+        download_workers=args.download_workers,
+        extract_mode=args.extract_mode,
+        fmt=args.format,
+        output=args.output,
+        columns=columns,
+        out_dir=Path(args.out_dir),
+        filters=filters or None,
+        store_mode=args.store,
+        parse_workers=args.parse_workers,
+        delta=args.delta,
     )
+    if aggregate_by:
+        common.update(aggregate_by=aggregate_by, metrics=metrics)
+    if range_mode:
+        run_range(args.ym_from, args.ym_to, workers=args.workers, disk_budget=args.disk_budget, **common)
+    else:
+        run(year=args.year, month=args.month, **common)
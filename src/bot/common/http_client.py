@@ -0,0 +1,141 @@
+"""
+Cliente HTTP compartilhado pelos robôs (Brasil, Chile e Peru).
+
+Uma Session por processo, com pool de conexões keep-alive (sem refazer
+TCP+TLS a cada chamada), novas tentativas com backoff exponencial e jitter,
+respeito ao Retry-After e um limite de requisições simultâneas por host.
+
+Uso nos robôs (rodam como script, então o diretório entra no sys.path):
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+    from http_client import get_client
+    r = get_client().get(url, timeout=60)
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_SIZE = 16
+HOST_CONCURRENCY_DEFAULT = int(os.environ.get("HTTP_HOST_CONCURRENCY", "4"))
+TRIES_DEFAULT = 3
+BACKOFF_BASE = 0.5   # s; a espera da tentativa n sai de [0, base * 2^n]
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Backoff exponencial com jitter completo."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_after_seconds(resp, default: float) -> float:
+    """Retry-After em segundos (número ou data HTTP); `default` se ausente/inválido."""
+    v = (resp.headers.get("Retry-After") or "").strip()
+    if not v:
+        return default
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except Exception:
+        return default
+
+
+class HttpClient:
+    """
+    Session com pool keep-alive + novas tentativas. Repete em erro de
+    conexão/timeout e nos status de RETRY_STATUSES; com Retry-After, espera
+    o que o servidor pediu. `limiter` (objeto com acquire()/pause(s)) é
+    consultado antes de cada tentativa e recebe as pausas de Retry-After,
+    para que todas as threads esperem juntas.
+    O semáforo por host cobre o envio e a espera pelos cabeçalhos; com
+    stream=True o corpo é lido depois, fora dele.
+    """
+
+    def __init__(self, pool_size: int = POOL_SIZE, host_concurrency: int = HOST_CONCURRENCY_DEFAULT,
+                 tries: int = TRIES_DEFAULT, log=None):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.host_concurrency = max(1, host_concurrency)
+        self.tries = max(1, tries)
+        self.log = log or (lambda msg: None)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return sem
+
+    def request(self, method: str, url: str, tries: int | None = None, limiter=None,
+                retry_statuses=RETRY_STATUSES, **kw) -> requests.Response:
+        """
+        Devolve a última resposta (inclusive com status de erro, para o
+        chamador decidir); levanta a exceção de rede se todas as tentativas
+        falharem na conexão.
+        """
+        tries = max(1, tries or self.tries)
+        for attempt in range(tries):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                with self._host_slot(url):
+                    resp = self.session.request(method, url, **kw)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == tries - 1:
+                    raise
+                wait = backoff_delay(attempt)
+                self.log(f"[http] {method} {urlsplit(url).netloc}: {type(e).__name__}; "
+                         f"nova tentativa em {wait:.1f}s ({attempt + 1}/{tries})")
+                time.sleep(wait)
+                continue
+            if resp.status_code not in retry_statuses or attempt == tries - 1:
+                return resp
+            wait = retry_after_seconds(resp, backoff_delay(attempt))
+            self.log(f"[http] {method} {urlsplit(url).netloc}: status {resp.status_code}; "
+                     f"nova tentativa em {wait:.1f}s ({attempt + 1}/{tries})")
+            resp.close()
+            if limiter is not None:
+                limiter.pause(wait)
+            else:
+                time.sleep(wait)
+        return resp
+
+    def get(self, url: str, **kw) -> requests.Response:
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw) -> requests.Response:
+        return self.request("POST", url, **kw)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client(log=None) -> HttpClient:
+    """
+    Cliente único do processo. Depois de um fork (pools de processos do
+    robô do Chile) é recriado, para não compartilhar sockets com o pai.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = HttpClient(log=log)
+            _client_pid = os.getpid()
+        elif log is not None:
+            _client.log = log
+        return _client
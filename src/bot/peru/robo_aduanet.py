@@ -2,8 +2,25 @@ import os
 import sys
 import json
 import time
-from datetime import datetime
-from typing import List, Dict, Optional
+import queue
+import sqlite3
+import argparse
+import threading
+import socketserver
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import List, Dict, Optional, Iterator, Tuple
+from urllib.parse import urljoin
+
+import requests
+
+# cliente HTTP compartilhado pelos robôs (src/bot/common)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+from http_client import HttpClient, get_client  # noqa: E402
 
 # Forçar UTF-8 na saída padrão (evita problemas em Windows/PowerShell)
 try:
@@ -12,16 +29,44 @@ try:
 except Exception:
     pass
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import Select, WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+# Selenium só é necessário para o motor de navegador (fallback do motor HTTP)
+try:
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import Select, WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    SELENIUM_OK = True
+except Exception:
+    SELENIUM_OK = False
 
 URL = "http://www.aduanet.gob.pe/cl-ad-consdepa/ConsImpoIAServlet?accion=cargarConsulta&tipoConsulta=14"
 
+# Motor padrão: "auto" tenta HTTP direto e cai para o Selenium se a página fugir do esperado
+ENGINE_DEFAULT = os.environ.get("ADUANET_ENGINE", "auto")
+# chromedriver já instalado; sem ele o webdriver_manager resolve (com consulta à rede), uma vez por processo
+CHROMEDRIVER_PATH = os.environ.get("CHROMEDRIVER_PATH") or None
+# modo worker: navegadores aquecidos e quantas consultas cada um atende antes de ser trocado
+POOL_SIZE_DEFAULT = int(os.environ.get("ADUANET_POOL_SIZE", "2"))
+DRIVER_MAX_USES_DEFAULT = int(os.environ.get("ADUANET_DRIVER_MAX_USES", "50"))
+# Períodos longos: janelas de até N dias, várias ao mesmo tempo, cada uma com seu prazo de paginação
+WINDOW_DAYS_DEFAULT = int(os.environ.get("ADUANET_WINDOW_DAYS", "31"))
+WINDOW_WORKERS_DEFAULT = int(os.environ.get("ADUANET_WINDOW_WORKERS", "3"))
+WINDOW_TIMEOUT_DEFAULT = int(os.environ.get("ADUANET_WINDOW_TIMEOUT", "300"))
+# Cache de registros por documento x dia de numeração
+CACHE_DIR_DEFAULT = os.environ.get("ADUANET_CACHE_DIR", "./data_cache/peru")
+CACHE_TTL_DEFAULT = int(os.environ.get("ADUANET_CACHE_TTL", "3600"))  # dias ainda abertos
+# Declarações dos últimos dias ainda podem aparecer: um dia só é tratado como
+# fechado (não expira no cache) quando ficou N+ dias para trás.
+CLOSED_LAG_DAYS = int(os.environ.get("ADUANET_CLOSED_LAG_DAYS", "2"))
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Accept-Language": "es-PE,es;q=0.9",
+}
+
 CAMPOS = [
     "declaracao", "importador", "fecNumeracao", "agencia", "series", "fobUsd",
     "fleteUsd", "seguro", "armazen", "canal", "pesoNeto", "nroBultos", "serie",
@@ -40,6 +85,13 @@ TIPO_MAPPING = {
     "PARTIDA ARANCELARIA": "PARTIDA ARANCELARIA",
 }
 
+def debug_enabled() -> bool:
+    return any(a in ("--debug", "-d") for a in sys.argv[1:])
+
+def eprint(*args, **kw):
+    if debug_enabled():
+        print(*args, file=sys.stderr, **kw)
+
 def ymd_to_dmy(s: str) -> str:
     try:
         d = datetime.strptime(s, "%Y-%m-%d")
@@ -47,7 +99,172 @@ def ymd_to_dmy(s: str) -> str:
     except Exception:
         return s
 
-def criar_driver(headless: bool = True) -> webdriver.Chrome:
+# ---- leitura da página HTML (uma passada, sem chamadas ao WebDriver) ----
+class PaginaNaoSuportada(Exception):
+    """A página não tem a forma que o motor HTTP sabe tratar (vai para o Selenium)."""
+
+class PrazoEsgotado(Exception):
+    """A paginação passou de max_segundos com páginas ainda por ler; as já entregues valem."""
+
+class FimIncerto(Exception):
+    """O navegador parou (espera ou clique falhou) sem sinal de que os resultados acabaram."""
+
+def sem_registros(html: str) -> bool:
+    """Aviso de consulta sem resultados ("no existen registros")."""
+    txt = html.lower()
+    return "no existen" in txt and "registros" in txt
+
+def _normalizar(t: str) -> str:
+    """Aproxima o .text do Selenium: espaços colapsados e linhas vazias descartadas."""
+    if "\n" not in t:
+        return " ".join(t.split())
+    return "\n".join(l for l in (" ".join(x.split()) for x in t.split("\n")) if l)
+
+# ---- árvore mínima (formulário de consulta e páginas de resultado) ----
+# tags sem fechamento
+_VAZIAS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "wbr"}
+# tags que o navegador mostra em linha própria (viram quebra no texto)
+_QUEBRA = {"br", "p", "div", "li", "tr", "table"}
+# conteúdo que o navegador não mostra
+_OCULTAS = {"script", "style"}
+
+class _No:
+    __slots__ = ("tag", "attrs", "filhos", "pai")
+
+    def __init__(self, tag: str, attrs: Dict[str, str], pai=None):
+        self.tag, self.attrs, self.filhos, self.pai = tag, attrs, [], pai
+
+    def descendentes(self, tag: str):
+        for f in self.filhos:
+            if isinstance(f, _No):
+                if f.tag == tag:
+                    yield f
+                yield from f.descendentes(tag)
+
+    def _textos(self):
+        for f in self.filhos:
+            if isinstance(f, _No):
+                if f.tag in _OCULTAS:
+                    continue
+                quebra = f.tag in _QUEBRA
+                if quebra:
+                    yield "\n"
+                elif f.tag in ("td", "th"):
+                    yield " "
+                yield from f._textos()
+                if quebra:
+                    yield "\n"
+            else:
+                # quebra de linha no fonte é só espaço; as visíveis vêm de _QUEBRA
+                yield f.replace("\r", " ").replace("\n", " ")
+
+    def texto(self) -> str:
+        """Texto visível, como o .text do Selenium."""
+        return _normalizar("".join(self._textos()))
+
+class _ArvoreHTML(HTMLParser):
+    """
+    Árvore do HTML, tolerante a <td>/<tr>/<option> sem fechamento (fechados
+    como o navegador). Comentários ficam de fora e o conteúdo de script/style
+    não entra no texto.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.raiz = _No("#doc", {})
+        self.atual = self.raiz
+
+    def _fechar_ate(self, tags, limite):
+        # fecha implicitamente o último `tags` aberto, sem passar de `limite`
+        no = self.atual
+        while no is not self.raiz and no.tag not in limite:
+            if no.tag in tags:
+                self.atual = no.pai
+                return
+            no = no.pai
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("td", "th"):
+            self._fechar_ate(("td", "th"), ("tr", "table"))
+        elif tag == "tr":
+            self._fechar_ate(("tr",), ("table",))
+        elif tag == "option":
+            self._fechar_ate(("option",), ("select",))
+        no = _No(tag, {k: (v or "") for k, v in attrs}, self.atual)
+        self.atual.filhos.append(no)
+        if tag not in _VAZIAS:
+            self.atual = no
+
+    def handle_startendtag(self, tag, attrs):
+        self.atual.filhos.append(_No(tag, {k: (v or "") for k, v in attrs}, self.atual))
+
+    def handle_endtag(self, tag):
+        no = self.atual
+        while no is not self.raiz and no.tag != tag:
+            no = no.pai
+        if no is not self.raiz:
+            self.atual = no.pai
+
+    def handle_data(self, data):
+        self.atual.filhos.append(data)
+
+def parse_html(texto: str) -> _No:
+    p = _ArvoreHTML()
+    p.feed(texto)
+    p.close()
+    return p.raiz
+
+def escolher_tabela_html(raiz: _No) -> Optional[_No]:
+    """A tabela com mais palavras-chave da consulta; empate pelo texto mais longo."""
+    melhor, melhor_score = None, -1
+    for t in raiz.descendentes("table"):
+        txt = t.texto().lower()
+        score = sum(ch in txt for ch in ["declar", "import", "partida", "fob"]) * 10000 + len(txt)
+        if score > melhor_score:
+            melhor, melhor_score = t, score
+    return melhor
+
+def extrair_tabela_html(raiz: _No) -> List[Dict]:
+    """
+    Registros da tabela de resultados. Como no WebDriver, tr/td de uma
+    tabela aninhada também contam para a de fora.
+    """
+    registros = []
+    tabela = escolher_tabela_html(raiz)
+    if tabela is None:
+        return registros
+    n = len(CAMPOS) - 1
+    for tr in tabela.descendentes("tr"):
+        tds = list(tr.descendentes("td"))
+        if len(tds) >= n:
+            registro = {CAMPOS[i]: tds[i].texto() for i in range(n)}
+            registro["state"] = "PE"
+            registro["country_code"] = "PE"
+            registros.append(registro)
+    return registros
+
+def link_siguiente(raiz: _No, base_url: str) -> Optional[str]:
+    """URL do link 'Siguiente'; None se não houver. Link via JavaScript não é tratado."""
+    for a in raiz.descendentes("a"):
+        if "siguiente" in a.texto().lower():
+            href = a.attrs.get("href", "").strip()
+            if not href or href.startswith("#") or href.lower().startswith("javascript:"):
+                raise PaginaNaoSuportada("paginação por JavaScript")
+            return urljoin(base_url, href)
+    return None
+
+_chromedriver: Optional[str] = None
+_chromedriver_lock = threading.Lock()
+
+def caminho_chromedriver() -> str:
+    """Binário do chromedriver, resolvido uma vez por processo."""
+    global _chromedriver
+    with _chromedriver_lock:
+        if _chromedriver is None:
+            _chromedriver = CHROMEDRIVER_PATH or ChromeDriverManager().install()
+        return _chromedriver
+
+def criar_driver(headless: bool = True) -> "webdriver.Chrome":
     chrome_options = Options()
     if headless:
         chrome_options.add_argument("--headless=new")
@@ -55,102 +272,85 @@ def criar_driver(headless: bool = True) -> webdriver.Chrome:
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
-    service = Service(ChromeDriverManager().install())
+    service = Service(caminho_chromedriver())
     return webdriver.Chrome(service=service, options=chrome_options)
 
-def escolher_tabela_certa(driver: webdriver.Chrome) -> Optional[object]:
-    tabelas = driver.find_elements(By.TAG_NAME, "table")
-    melhor = None
-    melhor_score = -1
-    for t in tabelas:
-        txt = (t.text or "").lower()
-        score = sum(ch in txt for ch in ["declar", "import", "partida", "fob"])
-        comprimento = len(txt)
-        score_total = score * 10000 + comprimento
-        if score_total > melhor_score:
-            melhor = t
-            melhor_score = score_total
-    return melhor
+def extrair_tabela(driver: "webdriver.Chrome") -> List[Dict]:
+    """Registros da página atual, lidos do page_source numa passada (sem uma chamada ao WebDriver por célula)."""
+    return extrair_tabela_html(parse_html(driver.page_source or ""))
 
-def extrair_tabela(driver: webdriver.Chrome) -> List[Dict]:
-    registros = []
-    tabela = escolher_tabela_certa(driver)
-    if not tabela:
-        return registros
-    linhas = tabela.find_elements(By.TAG_NAME, "tr")
-    for tr in linhas:
-        tds = tr.find_elements(By.TAG_NAME, "td")
-        if len(tds) >= len(CAMPOS) - 1:
-            registro = {}
-            for i in range(len(CAMPOS) - 1):
-                registro[CAMPOS[i]] = (tds[i].text or "").strip()
-            registro["state"] = "PE"
-            registro["country_code"] = "PE"
-            registros.append(registro)
-    return registros
 
-def paginar_e_coletar(driver: webdriver.Chrome, max_segundos: int = 300) -> List[Dict]:
-    resultados: List[Dict] = []
+def iterar_paginas(driver: "webdriver.Chrome", max_segundos: int = 300,
+                   estado: Optional[Dict] = None) -> Iterator[List[Dict]]:
+    """
+    Gera os registros de cada página assim que ela é lida (segue 'Siguiente').
+    Só termina normalmente com o aviso de "no existen registros" ou numa
+    página sem 'Siguiente' — e então marca estado["fim"] —; espera ou
+    clique que falha levanta FimIncerto.
+    """
+    estado = estado if estado is not None else {}
     inicio = time.time()
     while True:
         if time.time() - inicio > max_segundos:
-            break
+            raise PrazoEsgotado(f"{max_segundos}s")
         try:
             WebDriverWait(driver, 25).until(
                 EC.presence_of_element_located((By.TAG_NAME, "table"))
             )
-        except Exception:
-            break
+        except Exception as e:
+            if sem_registros(driver.page_source or ""):
+                estado["fim"] = "sem_registros"
+                return
+            raise FimIncerto(f"tabela não apareceu ({type(e).__name__})") from e
         pagina = extrair_tabela(driver)
         if pagina:
-            resultados.extend(pagina)
+            yield pagina
+        elif sem_registros(driver.page_source or ""):
+            estado["fim"] = "sem_registros"
+            return
         else:
-            body_txt = (driver.page_source or "").lower()
-            if "no existen" in body_txt and "registros" in body_txt:
-                break
+            raise FimIncerto("página sem registros nem aviso de fim")
+        botoes = driver.find_elements(By.XPATH, "//a[contains(., 'Siguiente')]")
+        if not botoes or not botoes[0].is_enabled():
+            estado["fim"] = "ultima_pagina"
+            return
         try:
-            botao = driver.find_element(By.XPATH, "//a[contains(., 'Siguiente')]")
-            if botao.is_enabled():
-                botao.click()
-                WebDriverWait(driver, 10).until(EC.staleness_of(botao))
-            else:
-                break
-        except Exception:
-            break
-    return resultados
-
-def main():
-    if len(sys.argv) < 5:
-        print(json.dumps({"descricao": "Nenhum argumento fornecido", "total": 0, "resultados": []}, ensure_ascii=False))
-        return
+            botoes[0].click()
+            WebDriverWait(driver, 10).until(EC.staleness_of(botoes[0]))
+        except Exception as e:
+            raise FimIncerto(f"'Siguiente' não avançou ({type(e).__name__})") from e
 
-    DATA_INICIO_RAW = sys.argv[1]
-    DATA_FIM_RAW = sys.argv[2]
-    TIPO = sys.argv[3]
-    DOCUMENTO = sys.argv[4]
+def preencher_consulta(driver: "webdriver.Chrome", data_inicio: str, data_fim: str, tipo: str, documento: str):
+    driver.get(URL)
 
-    DATA_INICIO = ymd_to_dmy(DATA_INICIO_RAW)
-    DATA_FIM = ymd_to_dmy(DATA_FIM_RAW)
-    tipo_correto = TIPO_MAPPING.get(TIPO, TIPO)
+    WebDriverWait(driver, 30).until(
+        EC.presence_of_element_located((By.NAME, "fec_inicio"))
+    ).send_keys(data_inicio)
+    driver.find_element(By.NAME, "fec_fin").send_keys(data_fim)
+    Select(driver.find_element(By.NAME, "tipo")).select_by_visible_text(tipo)
+    driver.find_element(By.NAME, "documento").send_keys(documento)
+    driver.find_element(By.NAME, "btnConsultar").click()
 
+def iterar_paginas_selenium(data_inicio: str, data_fim: str, tipo: str, documento: str,
+                            max_segundos: int = 300, pool: "DriverPool | None" = None,
+                            estado: Optional[Dict] = None) -> Iterator[List[Dict]]:
+    """
+    Motor de navegador: Chrome headless preenche o formulário e clica em
+    'Siguiente'. Com `pool`, usa um navegador já aberto; sem, abre um só
+    para esta consulta.
+    """
+    if not SELENIUM_OK:
+        raise RuntimeError("selenium/webdriver_manager não instalados")
+    if pool is not None:
+        with pool.driver() as driver:
+            preencher_consulta(driver, data_inicio, data_fim, tipo, documento)
+            yield from iterar_paginas(driver, max_segundos, estado)
+        return
     driver = None
-    dados_totais: List[Dict] = []
     try:
         driver = criar_driver(headless=True)
-        driver.get(URL)
-
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.NAME, "fec_inicio"))
-        ).send_keys(DATA_INICIO)
-        driver.find_element(By.NAME, "fec_fin").send_keys(DATA_FIM)
-        Select(driver.find_element(By.NAME, "tipo")).select_by_visible_text(tipo_correto)
-        driver.find_element(By.NAME, "documento").send_keys(DOCUMENTO)
-        driver.find_element(By.NAME, "btnConsultar").click()
-
-        dados_totais = paginar_e_coletar(driver, max_segundos=300)
-
-    except Exception:
-        dados_totais = []
+        preencher_consulta(driver, data_inicio, data_fim, tipo, documento)
+        yield from iterar_paginas(driver, max_segundos, estado)
     finally:
         if driver:
             try:
@@ -158,19 +358,711 @@ def main():
             except Exception:
                 pass
 
-    total = len(dados_totais)
-    descricao = (
-        f"Foram encontradas {total} importações no período de {DATA_INICIO} a {DATA_FIM} "
-        f"para o CNPJ {DOCUMENTO}."
+class DriverPool:
+    """
+    Navegadores aquecidos e reaproveitados entre consultas (modo worker).
+    Cada vaga guarda um driver pronto (ou None, aberto na hora se a troca
+    anterior falhou). Depois de `max_usos` consultas ou de um erro, o driver
+    é fechado e outro é aberto numa thread à parte, fora do tempo de
+    resposta; entre consultas os cookies são limpos, para uma sessão do
+    Aduanet não vazar para a próxima.
+    """
+
+    def __init__(self, tamanho: int = POOL_SIZE_DEFAULT, max_usos: int = DRIVER_MAX_USES_DEFAULT):
+        self.max_usos = max(1, max_usos)
+        self._vagas: "queue.Queue" = queue.Queue()
+        self._usos: Dict[int, int] = {}
+        self._abertos: set = set()
+        self._lock = threading.Lock()
+        for _ in range(max(1, tamanho)):
+            try:
+                self._vagas.put(self._novo())
+            except Exception as e:
+                eprint(f"[pool] falha ao abrir navegador: {type(e).__name__}: {e}")
+                self._vagas.put(None)
+
+    def _novo(self) -> "webdriver.Chrome":
+        d = criar_driver(headless=True)
+        d.get("about:blank")
+        with self._lock:
+            self._usos[id(d)] = 0
+            self._abertos.add(d)
+        return d
+
+    def _fechar(self, d):
+        with self._lock:
+            self._usos.pop(id(d), None)
+            self._abertos.discard(d)
+        try:
+            d.quit()
+        except Exception:
+            pass
+
+    def _repor(self, velho):
+        self._fechar(velho)
+        novo = None
+        try:
+            novo = self._novo()
+        except Exception as e:
+            eprint(f"[pool] falha ao abrir navegador: {type(e).__name__}: {e}")
+        self._vagas.put(novo)
+
+    @contextmanager
+    def driver(self):
+        d = self._vagas.get()
+        if d is None:
+            try:
+                d = self._novo()
+            except Exception:
+                self._vagas.put(None)
+                raise
+        ok = False
+        try:
+            yield d
+            ok = True
+        finally:
+            with self._lock:
+                self._usos[id(d)] = usos = self._usos.get(id(d), 0) + 1
+            if ok and usos < self.max_usos:
+                try:
+                    d.delete_all_cookies()
+                    d.get("about:blank")
+                except Exception:
+                    ok = False
+            if ok and usos < self.max_usos:
+                self._vagas.put(d)
+            else:
+                eprint(f"[pool] trocando navegador ({'erro' if not ok else f'{usos} consultas'})")
+                threading.Thread(target=self._repor, args=(d,), daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            abertos = list(self._abertos)
+        for d in abertos:
+            self._fechar(d)
+
+# ---- motor HTTP (sessão requests) ----
+def montar_formulario(raiz: _No, base_url: str, campos: Dict[str, str], tipo: str) -> Tuple[str, str, List[Tuple[str, str]]]:
+    """
+    (método, url, dados) do formulário que tem `fec_inicio`, como o navegador
+    enviaria ao clicar em btnConsultar: campos ocultos e valores padrão,
+    `campos` preenchidos e `tipo` escolhido pelo texto visível da opção.
+    """
+    form = None
+    for f in raiz.descendentes("form"):
+        if any(i.attrs.get("name") == "fec_inicio" for i in f.descendentes("input")):
+            form = f
+            break
+    if form is None:
+        raise PaginaNaoSuportada("formulário de consulta não encontrado")
+    dados: List[Tuple[str, str]] = []
+    botao = None
+    for i in form.descendentes("input"):
+        nome, tp = i.attrs.get("name"), i.attrs.get("type", "text").lower()
+        if not nome:
+            continue
+        if nome == "btnConsultar":
+            botao = i
+            continue
+        if tp in ("submit", "button", "image", "reset", "file"):
+            continue
+        if tp in ("checkbox", "radio") and "checked" not in i.attrs:
+            continue
+        dados.append((nome, campos.get(nome, i.attrs.get("value", ""))))
+    achou_tipo = False
+    for sel in form.descendentes("select"):
+        nome = sel.attrs.get("name")
+        if not nome:
+            continue
+        opcoes = list(sel.descendentes("option"))
+        if nome == "tipo":
+            escolhida = next((o for o in opcoes if o.texto().strip().upper() == tipo.strip().upper()), None)
+            if escolhida is None:
+                raise PaginaNaoSuportada(f"opção '{tipo}' não encontrada no campo tipo")
+            achou_tipo = True
+        else:
+            escolhida = next((o for o in opcoes if "selected" in o.attrs), opcoes[0] if opcoes else None)
+        if escolhida is not None:
+            dados.append((nome, escolhida.attrs.get("value", escolhida.texto())))
+    for t in form.descendentes("textarea"):
+        if t.attrs.get("name"):
+            dados.append((t.attrs["name"], t.texto()))
+    if not achou_tipo or botao is None or not {"fec_fin", "documento"} <= {n for n, _ in dados}:
+        raise PaginaNaoSuportada("formulário de consulta com campos diferentes do esperado")
+    if botao.attrs.get("type", "").lower() in ("submit", "image"):
+        dados.append(("btnConsultar", botao.attrs.get("value", "")))
+    metodo = (form.attrs.get("method") or "get").upper()
+    return metodo, urljoin(base_url, form.attrs.get("action") or base_url), dados
+
+def _html(r: "requests.Response") -> str:
+    r.raise_for_status()
+    if not r.encoding or r.encoding.lower() == "iso-8859-1":
+        # sem charset no cabeçalho o requests assume latin-1; o conteúdo decide
+        r.encoding = r.apparent_encoding or r.encoding
+    return r.text
+
+def iterar_paginas_http(data_inicio: str, data_fim: str, tipo: str, documento: str,
+                        max_segundos: int = 300, cliente: Optional[HttpClient] = None,
+                        estado: Optional[Dict] = None) -> Iterator[List[Dict]]:
+    """
+    Motor HTTP: envia o mesmo formulário (fec_inicio, fec_fin, tipo,
+    documento) numa sessão com cookies e segue os links 'Siguiente',
+    extraindo a tabela da árvore do HTML. Levanta PaginaNaoSuportada quando a
+    página foge do que o navegador mostraria (sem tabela de resultados nem
+    aviso de "no existen registros", paginação por JavaScript etc.).
+    `cliente` dá uma sessão própria (consultas simultâneas não dividem cookies).
+    Terminando pelo aviso ou pela última página, marca estado["fim"].
+    """
+    estado = estado if estado is not None else {}
+    cliente = cliente or get_client(log=eprint)
+    inicio = time.time()
+    r = cliente.get(URL, timeout=30, headers=HTTP_HEADERS)
+    metodo, url, dados = montar_formulario(parse_html(_html(r)), r.url,
+                                           {"fec_inicio": data_inicio, "fec_fin": data_fim,
+                                            "documento": documento}, tipo)
+    if metodo == "POST":
+        r = cliente.post(url, data=dados, timeout=60, headers={**HTTP_HEADERS, "Referer": r.url})
+    else:
+        r = cliente.get(url, params=dados, timeout=60, headers={**HTTP_HEADERS, "Referer": r.url})
+    vistas = set()
+    while True:
+        html = _html(r)
+        doc = parse_html(html)
+        pagina = extrair_tabela_html(doc)
+        if pagina:
+            yield pagina
+        else:
+            if sem_registros(html):
+                estado["fim"] = "sem_registros"
+                return
+            raise PaginaNaoSuportada("resposta sem tabela de resultados")
+        prox = link_siguiente(doc, r.url)
+        if prox is None or prox in vistas:
+            estado["fim"] = "ultima_pagina"
+            return
+        if time.time() - inicio > max_segundos:
+            raise PrazoEsgotado(f"{max_segundos}s")
+        vistas.add(prox)
+        r = cliente.get(prox, timeout=60, headers={**HTTP_HEADERS, "Referer": r.url})
+
+def iterar_paginas_motor(motor: str, data_inicio: str, data_fim: str, tipo: str, documento: str,
+                         estado: Dict, max_segundos: int = 300, pool: Optional[DriverPool] = None,
+                         cliente: Optional[HttpClient] = None) -> Iterator[List[Dict]]:
+    """
+    Páginas pelo motor escolhido ("http", "selenium" ou "auto"). Em "auto",
+    se o motor HTTP não reconhecer uma página, o Selenium recomeça a
+    consulta e os registros já emitidos pelo HTTP são descartados pela
+    chave declaracao+serie (Deduplicador), não pela contagem: os dois
+    motores não precisam ler as linhas na mesma ordem. O motor usado fica
+    em estado["motor"] ("http", "selenium" ou "http+selenium") e, se a
+    leitura chegou ao fim de fato, o motivo em estado["fim"].
+    """
+    emitidos = Deduplicador()
+    houve = False
+    estado["fim"] = None
+    if motor in ("auto", "http"):
+        estado["motor"] = "http"
+        try:
+            for pagina in iterar_paginas_http(data_inicio, data_fim, tipo, documento, max_segundos, cliente,
+                                              estado):
+                emitidos.anotar(pagina)
+                houve = houve or bool(pagina)
+                yield pagina
+            return
+        except (PaginaNaoSuportada, requests.RequestException) as e:
+            if motor == "http" or not SELENIUM_OK:
+                raise
+            eprint(f"[http] {type(e).__name__}: {e}; usando Selenium")
+    estado["motor"] = "http+selenium" if houve else "selenium"
+    estado["fim"] = None
+    for pagina in iterar_paginas_selenium(data_inicio, data_fim, tipo, documento, max_segundos, pool=pool,
+                                          estado=estado):
+        if houve:
+            pagina = emitidos.filtrar(pagina)
+        if pagina:
+            yield pagina
+
+def descrever(total: int, data_inicio: str, data_fim: str, documento: str) -> str:
+    return (
+        f"Foram encontradas {total} importações no período de {data_inicio} a {data_fim} "
+        f"para o CNPJ {documento}."
     )
 
-    resultado_final = {
-        "descricao": descricao,
-        "total": total,
-        "resultados": dados_totais
+# ---- janelas de período (consultas longas em paralelo) ----
+def ler_data(s: str) -> Optional[date]:
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+def _dmy(d) -> str:
+    return d.strftime("%d/%m/%Y") if isinstance(d, date) else ymd_to_dmy(d)
+
+def dividir_periodo(inicio: date, fim: date, dias: int) -> List[Tuple[date, date]]:
+    """[inicio, fim] em janelas consecutivas de até `dias` dias (datas inclusivas)."""
+    janelas = []
+    passo = timedelta(days=max(1, dias))
+    while inicio <= fim:
+        ate = min(fim, inicio + passo - timedelta(days=1))
+        janelas.append((inicio, ate))
+        inicio = ate + timedelta(days=1)
+    return janelas
+
+def trechos_de_dias(dias: List[date]) -> List[Tuple[date, date]]:
+    """Dias (ordenados) -> trechos contínuos [(de, até), ...]."""
+    out = []
+    for d in dias:
+        if out and out[-1][1] + timedelta(days=1) == d:
+            out[-1] = (out[-1][0], d)
+        else:
+            out.append((d, d))
+    return out
+
+class DiaCache:
+    """
+    Registros do Aduanet por documento x tipo x dia de numeração
+    (fecNumeracao), em <cache-dir>/dias.sqlite. `dias` diz quais dias já
+    foram lidos inteiros, inclusive os sem registro; um dia lido quando já
+    estava fechado (CLOSED_LAG_DAYS+ atrás) não expira, os lidos ainda
+    abertos valem por `ttl` s a partir da leitura.
+    Só entram janelas lidas até o fim, e só se todo registro cai num dia
+    da própria janela.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.lock = threading.Lock()
+        self.ttl = CACHE_TTL_DEFAULT
+
+    def configure(self, cache_dir, ttl: int = CACHE_TTL_DEFAULT):
+        self.ttl = ttl
+        if not cache_dir:
+            self.db = None
+            return
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "dias.sqlite"), check_same_thread=False, timeout=30)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS registros (
+                documento TEXT NOT NULL, tipo TEXT NOT NULL, dia TEXT NOT NULL, ordem INTEGER NOT NULL,
+                registro TEXT NOT NULL,
+                PRIMARY KEY (documento, tipo, dia, ordem));
+            CREATE TABLE IF NOT EXISTS dias (
+                documento TEXT NOT NULL, tipo TEXT NOT NULL, dia TEXT NOT NULL, lido_em REAL NOT NULL,
+                fechado INTEGER NOT NULL, n INTEGER NOT NULL,
+                PRIMARY KEY (documento, tipo, dia));
+        """)
+
+    @staticmethod
+    def dia_fechado(d: date) -> bool:
+        return d <= date.today() - timedelta(days=CLOSED_LAG_DAYS)
+
+    def cobertos(self, documento: str, tipo: str, inicio: date, fim: date) -> set:
+        """Dias de [inicio, fim] já no cache e ainda válidos."""
+        if self.db is None:
+            return set()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT dia FROM dias WHERE documento = ? AND tipo = ? AND dia BETWEEN ? AND ? "
+                "AND (fechado = 1 OR lido_em > ?)",
+                (documento, tipo, inicio.isoformat(), fim.isoformat(), time.time() - self.ttl)).fetchall()
+        return {date.fromisoformat(r[0]) for r in rows}
+
+    def ler(self, documento: str, tipo: str, dia: date) -> List[Dict]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT registro FROM registros WHERE documento = ? AND tipo = ? AND dia = ? ORDER BY ordem",
+                (documento, tipo, dia.isoformat())).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def gravar(self, documento: str, tipo: str, inicio: date, fim: date, registros: List[Dict]) -> bool:
+        """Substitui os dias de [inicio, fim] pelos `registros` da janela; False se não deu para separar por dia."""
+        if self.db is None:
+            return False
+        por_dia: Dict[date, List[str]] = {}
+        for reg in registros:
+            d = ler_data((reg.get("fecNumeracao") or "")[:10])
+            if d is None or not inicio <= d <= fim:
+                eprint(f"[cache] {_dmy(inicio)}..{_dmy(fim)}: fecNumeracao fora da janela "
+                       f"({reg.get('fecNumeracao')!r}); janela não guardada")
+                return False
+            por_dia.setdefault(d, []).append(json.dumps(reg, ensure_ascii=False))
+        agora = time.time()
+        dias = [inicio + timedelta(days=k) for k in range((fim - inicio).days + 1)]
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM registros WHERE documento = ? AND tipo = ? AND dia BETWEEN ? AND ?",
+                            (documento, tipo, inicio.isoformat(), fim.isoformat()))
+            self.db.executemany("INSERT INTO registros VALUES (?, ?, ?, ?, ?)",
+                                [(documento, tipo, d.isoformat(), i, r)
+                                 for d, regs in por_dia.items() for i, r in enumerate(regs)])
+            self.db.executemany("INSERT OR REPLACE INTO dias VALUES (?, ?, ?, ?, ?, ?)",
+                                [(documento, tipo, d.isoformat(), agora, int(self.dia_fechado(d)),
+                                  len(por_dia.get(d, ()))) for d in dias])
+        return True
+
+DIA_CACHE = DiaCache()
+
+class Deduplicador:
+    """
+    Descarta registros já vistos (mesma declaracao+serie), inclusive vindos
+    de outra janela. Sem declaracao não há chave: o registro só é descartado
+    se um igual foi marcado com `anotar` (uma vez por marcação), caso de uma
+    releitura do mesmo trecho.
+    """
+
+    def __init__(self):
+        self.vistos = set()
+        self.sem_chave: Counter = Counter()
+
+    @staticmethod
+    def _inteiro(reg: Dict) -> str:
+        return json.dumps(reg, sort_keys=True, ensure_ascii=False)
+
+    def anotar(self, registros: List[Dict]):
+        """Marca registros já emitidos: uma releitura deles será descartada."""
+        for reg in registros:
+            chave = (reg.get("declaracao"), reg.get("serie"))
+            if chave[0]:
+                self.vistos.add(chave)
+            else:
+                self.sem_chave[self._inteiro(reg)] += 1
+
+    def filtrar(self, registros: List[Dict]) -> List[Dict]:
+        novos = []
+        for reg in registros:
+            chave = (reg.get("declaracao"), reg.get("serie"))
+            if chave[0]:
+                if chave in self.vistos:
+                    continue
+                self.vistos.add(chave)
+            elif self.sem_chave:
+                inteiro = self._inteiro(reg)
+                if self.sem_chave[inteiro] > 0:
+                    self.sem_chave[inteiro] -= 1
+                    continue
+            novos.append(reg)
+        return novos
+
+def _consultar_janela(janela, tipo: str, documento: str, motor: str, pool: Optional[DriverPool],
+                      prazo: int, entregar) -> Tuple[int, Optional[str], Optional[str]]:
+    """
+    Pagina uma janela numa sessão própria, passando cada página a
+    `entregar`. Só vai para o DIA_CACHE com sinal positivo de fim (aviso
+    de "no existen registros" ou última página sem 'Siguiente'); sem ele a
+    janela fica incompleta. Devolve (registros, motor usado, motivo se
+    ficou incompleta).
+    """
+    estado: Dict = {"motor": None, "fim": None}
+    n = 0
+    guardar = DIA_CACHE.db is not None and isinstance(janela[0], date)
+    lidos: List[Dict] = []
+    cliente = HttpClient(log=eprint) if motor != "selenium" else None
+    motivo = None
+    try:
+        for pagina in iterar_paginas_motor(motor, _dmy(janela[0]), _dmy(janela[1]), tipo, documento, estado,
+                                           max_segundos=prazo, pool=pool, cliente=cliente):
+            n += len(pagina)
+            if guardar:
+                lidos.extend(pagina)
+            entregar(pagina)
+    except PrazoEsgotado:
+        motivo = "prazo"
+    except Exception as e:
+        eprint(f"[erro] {_dmy(janela[0])}..{_dmy(janela[1])}: {type(e).__name__}: {e}")
+        motivo = f"{type(e).__name__}: {e}"
+    finally:
+        if cliente is not None:
+            cliente.session.close()
+    if motivo is None and not estado["fim"]:
+        motivo = "fim dos resultados não confirmado"
+    if guardar and motivo is None:
+        try:
+            DIA_CACHE.gravar(documento, tipo, janela[0], janela[1], lidos)
+        except sqlite3.Error as e:
+            eprint(f"[cache] {type(e).__name__}: {e}")
+    return n, estado["motor"], motivo
+
+def consultar_janelas(data_inicio_raw: str, data_fim_raw: str, tipo: str, documento: str, motor: str,
+                      pool: Optional[DriverPool], info: Dict, dias: int = WINDOW_DAYS_DEFAULT,
+                      paralelo: int = WINDOW_WORKERS_DEFAULT,
+                      prazo: int = WINDOW_TIMEOUT_DEFAULT) -> Iterator[Tuple[Tuple, List[Dict]]]:
+    """
+    Dias já no DIA_CACHE saem de lá; os que faltam, em trechos contínuos,
+    são divididos em janelas de até `dias` dias e consultados até `paralelo`
+    de cada vez, cada janela na sua sessão e com `prazo` segundos de
+    paginação. Uma janela que estoura o prazo é dividida ao meio e as
+    metades entram na fila (volume alto pede janelas menores); se já tem
+    um dia só, ou se deu erro, fica em info["parciais"]. Gera (janela,
+    página) assim que cada página é lida; páginas de uma janela dividida
+    também saem, e as metades (que releem o mesmo trecho) descartam o que
+    ela já emitiu, inclusive registros sem declaracao.
+    info recebe "janelas", "motores", "parciais" e, com cache,
+    "dias_locais" e "dias_buscados".
+    """
+    info.update({"janelas": 0, "motores": set(), "parciais": []})
+    inicio, fim = ler_data(data_inicio_raw), ler_data(data_fim_raw)
+    if inicio is None or fim is None or inicio > fim:
+        pendentes = [(data_inicio_raw, data_fim_raw)]   # não dá para dividir: uma janela só
+    else:
+        todos = [inicio + timedelta(days=k) for k in range((fim - inicio).days + 1)]
+        cobertos = DIA_CACHE.cobertos(documento, tipo, inicio, fim)
+        faltam = [d for d in todos if d not in cobertos]
+        pendentes = [j for de, ate in trechos_de_dias(faltam) for j in dividir_periodo(de, ate, dias)]
+        if DIA_CACHE.db is not None:
+            info["dias_locais"], info["dias_buscados"] = len(todos) - len(faltam), len(faltam)
+        for d in todos:
+            if d in cobertos:
+                registros = DIA_CACHE.ler(documento, tipo, d)
+                if registros:
+                    yield (d, d), registros
+    fila: "queue.Queue" = queue.Queue()
+
+    def rodar(j):
+        try:
+            fim_janela = _consultar_janela(j, tipo, documento, motor, pool, prazo,
+                                           lambda pagina: fila.put(("pagina", j, pagina)))
+        except BaseException as e:
+            fim_janela = (0, None, f"{type(e).__name__}: {e}")
+        fila.put(("fim", j) + fim_janela)
+
+    # páginas lidas por janela aberta (se ela for dividida, as metades
+    # descartam essas linhas) e o filtro das janelas vindas de uma divisão
+    lidas: Dict[Tuple, List[Dict]] = {}
+    releitura: Dict[Tuple, Deduplicador] = {}
+    with ThreadPoolExecutor(max_workers=max(1, paralelo)) as ex:
+        for j in pendentes:
+            ex.submit(rodar, j)
+        abertas = len(pendentes)
+        while abertas:
+            msg = fila.get()
+            if msg[0] == "pagina":
+                j, pagina = msg[1], msg[2]
+                lidas.setdefault(j, []).extend(pagina)
+                if j in releitura:
+                    pagina = releitura[j].filtrar(pagina)
+                if pagina:
+                    yield j, pagina
+                continue
+            _, j, n, usado, motivo = msg
+            lido, ja_emitidos = lidas.pop(j, []), releitura.pop(j, None)
+            abertas -= 1
+            info["janelas"] += 1
+            if usado:
+                info["motores"].update(usado.split("+"))
+            if motivo == "prazo" and isinstance(j[0], date) and j[1] > j[0]:
+                meio = j[0] + (j[1] - j[0]) // 2
+                eprint(f"[janela] {_dmy(j[0])}..{_dmy(j[1])}: prazo esgotado com {n} registros; dividindo em duas")
+                # tudo o que a janela leu já saiu (direto ou por uma janela
+                # anterior da mesma divisão): as metades partilham o filtro
+                ja_emitidos = ja_emitidos or Deduplicador()
+                ja_emitidos.anotar(lido)
+                for sub in ((j[0], meio), (meio + timedelta(days=1), j[1])):
+                    releitura[sub] = ja_emitidos
+                    ex.submit(rodar, sub)
+                    abertas += 1
+            elif motivo:
+                info["parciais"].append({"de": _dmy(j[0]), "ate": _dmy(j[1]), "registros": n, "motivo": motivo})
+
+def resumo_janelas(saida: Dict, info: Dict):
+    """Motor(es) usados, número de janelas e, se faltou algo, a marcação de parcial."""
+    motores = info["motores"]
+    saida["motor"] = "+".join(m for m in ("http", "selenium") if m in motores) or None
+    saida["janelas"] = info["janelas"]
+    if "dias_locais" in info:
+        saida["cache"] = {"dias_locais": info["dias_locais"], "dias_buscados": info["dias_buscados"]}
+    if info["parciais"]:
+        saida["parcial"] = True
+        saida["janelas_parciais"] = sorted(info["parciais"], key=lambda p: ler_data(p["de"]) or date.min)
+        saida["descricao"] += f" Resultado parcial: {len(info['parciais'])} janela(s) incompleta(s)."
+
+def consultar(params: List[str], motor: str, pool: Optional[DriverPool] = None,
+              dias: int = WINDOW_DAYS_DEFAULT, paralelo: int = WINDOW_WORKERS_DEFAULT,
+              prazo: int = WINDOW_TIMEOUT_DEFAULT) -> Dict:
+    """
+    Uma consulta completa (DATA_INICIO DATA_FIM TIPO DOCUMENTO) ->
+    {descricao,total,motor,janelas,[parcial,janelas_parciais],resultados},
+    com os registros em ordem cronológica das janelas.
+    """
+    data_inicio_raw, data_fim_raw, tipo, documento = params[:4]
+    info: Dict = {}
+    por_janela: Dict[Tuple, List[Dict]] = {}
+    for j, pagina in consultar_janelas(data_inicio_raw, data_fim_raw, TIPO_MAPPING.get(tipo, tipo), documento,
+                                       motor, pool, info, dias, paralelo, prazo):
+        por_janela.setdefault(j, []).extend(pagina)
+    ordem = list(por_janela)
+    if len(ordem) > 1:
+        # ordem cronológica; uma janela dividida vem antes das suas metades
+        ordem.sort(key=lambda j: (j[0], -j[1].toordinal()))
+    dedup = Deduplicador()
+    dados = [reg for j in ordem for reg in dedup.filtrar(por_janela[j])]
+    saida: Dict = {
+        "descricao": descrever(len(dados), ymd_to_dmy(data_inicio_raw), ymd_to_dmy(data_fim_raw), documento),
+        "total": len(dados),
     }
+    resumo_janelas(saida, info)
+    saida["resultados"] = dados
+    return saida
+
+# ---- modo worker (consultas NDJSON pelo stdin ou por socket local) ----
+def opcoes_consulta(args) -> Dict:
+    return {"motor": args.engine, "dias": args.window_days, "paralelo": args.window_workers,
+            "prazo": args.window_timeout}
+
+def responder(linha: str, pool: Optional[DriverPool], opcoes: Dict) -> Dict:
+    """
+    Uma linha de consulta: {"id", "data_de", "data_ate", "tipo", "documento"}
+    (ou {"id", "params": [DATA_INICIO, DATA_FIM, TIPO, DOCUMENTO]}). A
+    resposta repete o id, já que consultas simultâneas terminam fora de ordem.
+    """
+    try:
+        q = json.loads(linha)
+        if not isinstance(q, dict):
+            raise ValueError("esperado um objeto")
+    except ValueError as e:
+        return {"erro": f"consulta inválida: {e}"}
+    params = q.get("params") or [q.get("data_de"), q.get("data_ate"), q.get("tipo") or "importacao", q.get("documento")]
+    if len(params) < 4 or not all(params[:4]):
+        res: Dict = {"erro": "informe data_de, data_ate, tipo e documento"}
+    else:
+        res = consultar([str(p) for p in params[:4]], pool=pool, **opcoes)
+    return {"id": q.get("id"), **res} if "id" in q else res
+
+def atender(linhas, escrever, pool: Optional[DriverPool], opcoes: Dict, paralelo: int):
+    """Atende um fluxo de consultas (uma por linha), até `paralelo` de cada vez."""
+    def um(linha):
+        try:
+            escrever(responder(linha, pool, opcoes))
+        except Exception as e:
+            eprint(f"[worker] {type(e).__name__}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, paralelo)) as ex:
+        for linha in linhas:
+            if linha.strip():
+                ex.submit(um, linha)
+
+def servir(args, pool: Optional[DriverPool]):
+    paralelo, opcoes = args.pool_size, opcoes_consulta(args)
+    if not args.socket:
+        trava = threading.Lock()
+
+        def escrever(res):
+            with trava:
+                sys.stdout.write(json.dumps(res, ensure_ascii=False) + "\n")
+                sys.stdout.flush()
+
+        atender(sys.stdin, escrever, pool, opcoes, paralelo)
+        return
+
+    class Conexao(socketserver.StreamRequestHandler):
+        def handle(self):
+            trava = threading.Lock()
+
+            def escrever(res):
+                with trava:
+                    self.wfile.write((json.dumps(res, ensure_ascii=False) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+
+            atender((l.decode("utf-8", "replace") for l in self.rfile), escrever, pool, opcoes, paralelo)
+
+    host, _, porta = args.socket.rpartition(":")
+    if porta.isdigit():
+        servidor = socketserver.ThreadingTCPServer((host or "127.0.0.1", int(porta)), Conexao, bind_and_activate=False)
+        servidor.allow_reuse_address = True
+        servidor.server_bind()
+        servidor.server_activate()
+    else:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        servidor = socketserver.ThreadingUnixStreamServer(args.socket, Conexao)
+    servidor.daemon_threads = True
+    eprint(f"[worker] ouvindo em {args.socket}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Aduanet Peru (importação) -> JSON")
+    ap.add_argument("params", nargs="*", help="DATA_INICIO DATA_FIM TIPO DOCUMENTO")
+    ap.add_argument("--debug", "-d", action="store_true")
+    ap.add_argument("--format", choices=["json", "ndjson"], default="json",
+                    help="ndjson: um registro por linha assim que cada página é lida e, no fim, {descricao,total}")
+    ap.add_argument("--engine", choices=["auto", "http", "selenium"], default=ENGINE_DEFAULT,
+                    help="auto: HTTP direto, Selenium só se a página não for reconhecida (env ADUANET_ENGINE)")
+    ap.add_argument("--window-days", type=int, default=WINDOW_DAYS_DEFAULT,
+                    help="Divide o período em janelas de até N dias (env ADUANET_WINDOW_DAYS)")
+    ap.add_argument("--window-workers", type=int, default=WINDOW_WORKERS_DEFAULT,
+                    help="Janelas consultadas ao mesmo tempo, cada uma na sua sessão (env ADUANET_WINDOW_WORKERS)")
+    ap.add_argument("--window-timeout", type=int, default=WINDOW_TIMEOUT_DEFAULT,
+                    help="Prazo (s) de paginação por janela; ao estourar, a janela é dividida ao meio "
+                         "(env ADUANET_WINDOW_TIMEOUT)")
+    ap.add_argument("--cache-dir", type=str, default=CACHE_DIR_DEFAULT,
+                    help="Cache SQLite de registros por documento x dia (env ADUANET_CACHE_DIR)")
+    ap.add_argument("--no-cache", action="store_true", help="Não lê nem grava o cache de dias")
+    ap.add_argument("--cache-ttl", type=int, default=CACHE_TTL_DEFAULT,
+                    help="Validade (s) de dias ainda abertos; fechados não expiram (env ADUANET_CACHE_TTL)")
+    ap.add_argument("--worker", action="store_true",
+                    help="processo de longa duração: uma consulta JSON por linha no stdin, uma resposta por linha no stdout")
+    ap.add_argument("--socket", default=None,
+                    help="modo worker num socket local (HOST:PORTA ou caminho de socket Unix) em vez do stdin")
+    ap.add_argument("--pool-size", type=int, default=POOL_SIZE_DEFAULT,
+                    help="navegadores aquecidos no modo worker e consultas simultâneas (env ADUANET_POOL_SIZE)")
+    ap.add_argument("--driver-max-uses", type=int, default=DRIVER_MAX_USES_DEFAULT,
+                    help="consultas por navegador antes de trocá-lo (env ADUANET_DRIVER_MAX_USES)")
+    return ap.parse_args()
+
+def main():
+    args = parse_args()
+    try:
+        DIA_CACHE.configure(None if args.no_cache else args.cache_dir, args.cache_ttl)
+    except (OSError, sqlite3.Error) as e:
+        eprint(f"[cache] desativado: {type(e).__name__}: {e}")
+    if args.worker or args.socket:
+        pool = None
+        if args.engine != "http" and SELENIUM_OK:
+            caminho_chromedriver()
+            pool = DriverPool(args.pool_size, args.driver_max_uses)
+        elif args.engine != "http":
+            eprint("[worker] selenium não instalado; só o motor HTTP está disponível")
+        try:
+            servir(args, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+        return
+
+    ndjson = args.format == "ndjson"
+    if len(args.params) < 4:
+        vazio = {"descricao": "Nenhum argumento fornecido", "total": 0}
+        if not ndjson:
+            vazio["resultados"] = []
+        print(json.dumps(vazio, ensure_ascii=False))
+        return
+
+    if not ndjson:
+        print(json.dumps(consultar(args.params, **opcoes_consulta(args)), ensure_ascii=False))
+        return
+
+    DATA_INICIO_RAW, DATA_FIM_RAW, TIPO, DOCUMENTO = args.params[:4]
+    total = 0
+    info: Dict = {}
+    dedup = Deduplicador()
+    # cada página vai para o stdout assim que é lida (janelas simultâneas se intercalam)
+    for _, registros in consultar_janelas(DATA_INICIO_RAW, DATA_FIM_RAW, TIPO_MAPPING.get(TIPO, TIPO), DOCUMENTO,
+                                          args.engine, None, info, args.window_days, args.window_workers,
+                                          args.window_timeout):
+        for reg in dedup.filtrar(registros):
+            sys.stdout.write(json.dumps(reg, ensure_ascii=False) + "\n")
+            total += 1
+        sys.stdout.flush()
 
-    print(json.dumps(resultado_final, ensure_ascii=False))
+    trailer: Dict = {"descricao": descrever(total, ymd_to_dmy(DATA_INICIO_RAW), ymd_to_dmy(DATA_FIM_RAW), DOCUMENTO),
+                     "total": total}
+    resumo_janelas(trailer, info)
+    print(json.dumps(trailer, ensure_ascii=False), flush=True)
 
 if __name__ == "__main__":
     main()
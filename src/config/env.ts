@@ -3,6 +3,10 @@ export const PYTHON_BIN: string = process.env.PYTHON_BIN || 'python';
 export const COMEX_INSECURE: string | undefined = process.env.COMEX_INSECURE;
 export const COMEX_CA_BUNDLE: string | undefined = process.env.COMEX_CA_BUNDLE;
 export const BOT_DEBUG: string | undefined = process.env.BOT_DEBUG;
+// Worker do Aduanet (robo_aduanet.py --socket): HOST:PORTA ou caminho de socket Unix
+export const ADUANET_WORKER: string | undefined = process.env.ADUANET_WORKER;
+// Prazo (ms) da resposta do worker; estourado com a consulta já enviada, a requisição falha
+export const ADUANET_WORKER_TIMEOUT_MS: number = Number(process.env.ADUANET_WORKER_TIMEOUT_MS || 600000);
 export const SAVE_RAW_DATA: boolean = String(process.env.SAVE_RAW_DATA || '').toLowerCase() === 'true';
 export const NODE_ENV: string | undefined = process.env.NODE_ENV;
 export const AUTH_SECRET: string | undefined = process.env.AUTH_SECRET;
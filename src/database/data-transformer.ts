@@ -70,10 +70,11 @@ export class DataTransformer {
   }
 
   /**
-   * Processa dados do Brasil
+   * Processa dados do Brasil; devolve o número de registros que falharam
    */
-  async processBrasilData(rawDataArray: BrasilRawData[]): Promise<void> {
+  async processBrasilData(rawDataArray: BrasilRawData[]): Promise<number> {
     console.log(`Processando ${rawDataArray.length} registros do Brasil...`);
+    let falhas = 0;
 
     for (const rawData of rawDataArray) {
       try {
@@ -103,17 +104,20 @@ export class DataTransformer {
       } catch (error) {
         console.error('Erro ao processar registro do Brasil:', error);
         console.error('Dados:', rawData);
+        falhas++;
       }
     }
 
-    console.log('Processamento do Brasil concluído!');
+    console.log(`Processamento do Brasil concluído!${falhas ? ` (${falhas} falhas)` : ''}`);
+    return falhas;
   }
 
   /**
-   * Processa dados do Peru
+   * Processa dados do Peru; devolve o número de registros que falharam
    */
-  async processPeruData(rawDataArray: PeruRawData[]): Promise<void> {
+  async processPeruData(rawDataArray: PeruRawData[]): Promise<number> {
     console.log(`Processando ${rawDataArray.length} registros do Peru...`);
+    let falhas = 0;
 
     for (const rawData of rawDataArray) {
       try {
@@ -212,20 +216,34 @@ export class DataTransformer {
       } catch (error) {
         console.error('Erro ao processar registro do Peru:', error);
         console.error('Dados:', rawData);
+        falhas++;
       }
     }
 
-    console.log('Processamento do Peru concluído!');
+    console.log(`Processamento do Peru concluído!${falhas ? ` (${falhas} falhas)` : ''}`);
+    return falhas;
   }
 
   /**
-   * Processa dados do Chile
+   * Processa dados do Chile; devolve o número de registros que falharam.
+   * A linha é identificada pela coluna rowKey (NUMENCRIPTADO|NUMITEM, a chave do
+   * --delta do robô), tanto no upsert quanto na remoção.
    */
-  async processChileData(rawDataArray: ChileRawData[]): Promise<void> {
+  async processChileData(rawDataArray: ChileRawData[]): Promise<number> {
     console.log(`Processando ${rawDataArray.length} registros do Chile...`);
+    let falhas = 0;
 
     for (const rawData of rawDataArray) {
       try {
+        // Modo --delta do robô: linha removida na republicação do CKAN (só traz a chave)
+        if ((rawData as any).delta_op === 'removido') {
+          const countryId = await this.resolveCountry('CL');
+          const rowKey = this.chileRowKey(rawData);
+          if (!rowKey) throw new Error('remoção sem NUMENCRIPTADO');
+          await this.prisma.import.deleteMany({ where: { countryId, rowKey } });
+          continue;
+        }
+
         // Transformar dados básicos
         const importData = transformChileData(rawData);
 
@@ -255,43 +273,33 @@ export class DataTransformer {
         const originCountryId = await this.resolveOriginCountry((rawData as any).PA_ORIG);
         const acquisitionCountryId = await this.resolveOriginCountry((rawData as any).PA_ADQ);
 
-        // Upsert por declarationNumber (quando disponível) para evitar duplicação e garantir rawData
-        if (declarationNumber) {
-          const existing = await this.prisma.import.findFirst({
-            where: { declarationNumber, countryId },
+        // Upsert pela chave da linha (coluna rowKey = NUMENCRIPTADO|NUMITEM, única por país)
+        const rowKey = this.chileRowKey(rawData);
+        if (rowKey) {
+          const relations = {
+            countryId,
+            stateId,
+            productId,
+            companyId,
+            originCountryId,
+            acquisitionCountryId,
+          };
+          await this.prisma.import.upsert({
+            where: { countryId_rowKey: { countryId, rowKey } },
+            update: {
+              ...importData,
+              ...relations,
+              // sempre atualizar rawData para Chile
+              rawData: rawData,
+            } as any,
+            create: {
+              ...importData,
+              ...relations,
+              declarationNumber,
+              rowKey,
+              rawData: rawData,
+            } as any,
           });
-
-          if (existing) {
-            await this.prisma.import.update({
-              where: { id: existing.id },
-              data: {
-                ...importData,
-                // manter país
-                countryId,
-                stateId,
-                productId,
-                companyId,
-                originCountryId,
-                acquisitionCountryId,
-                // sempre atualizar rawData para Chile
-                rawData: rawData,
-              } as any,
-            });
-          } else {
-            await this.prisma.import.create({
-              data: {
-                ...importData,
-                countryId,
-                stateId,
-                declarationNumber,
-                productId,
-                companyId,
-                originCountryId,
-                acquisitionCountryId,
-                rawData: rawData,
-              } as any,
-            });
-          }
         } else {
           // Sem chave única confiável: criar registro novo
           await this.prisma.import.create({
@@ -300,7 +308,7 @@ export class DataTransformer {
               countryId,
               stateId,
               // gerar um identificador previsível para referência
-              declarationNumber: `CL-${(rawData as any).ano_ref}-${(rawData as any).mes_ref}-${Date.now()}`,
+              declarationNumber: declarationNumber || `CL-${(rawData as any).ano_ref}-${(rawData as any).mes_ref}-${Date.now()}`,
               productId,
               companyId,
               originCountryId,
@@ -313,10 +321,21 @@ export class DataTransformer {
       } catch (error) {
         console.error('Erro ao processar registro do Chile:', error);
         console.error('Dados:', rawData);
+        falhas++;
       }
     }
 
-    console.log('Processamento do Chile concluído!');
+    console.log(`Processamento do Chile concluído!${falhas ? ` (${falhas} falhas)` : ''}`);
+    return falhas;
+  }
+
+  /**
+   * Chave da linha do Chile (coluna rowKey): NUMENCRIPTADO|NUMITEM, como no --delta do robô
+   */
+  private chileRowKey(rawData: ChileRawData): string | undefined {
+    const numencriptado = (rawData as any).NUMENCRIPTADO;
+    if (!numencriptado) return undefined;
+    return `${numencriptado}|${(rawData as any).NUMITEM ?? ''}`.slice(0, 120);
   }
 
   /**
@@ -523,9 +542,10 @@ export class DataTransformer {
   }
 
   /**
-   * Processa dados de qualquer país baseado no JSON de resposta dos robôs
+   * Processa dados de qualquer país baseado no JSON de resposta dos robôs;
+   * devolve quantos registros falharam (a execução fica PARTIAL)
    */
-  async processRobotResponse(jsonResponse: any): Promise<void> {
+  async processRobotResponse(jsonResponse: any): Promise<{ total: number; falhas: number }> {
     const { descricao, total, resultados } = jsonResponse;
 
     console.log(`Processando resposta: ${descricao}`);
@@ -544,15 +564,16 @@ export class DataTransformer {
     const countryCode = firstRecord.country_code;
 
     // Processar baseado no país
+    let falhas: number;
     switch (countryCode) {
       case 'BR':
-        await this.processBrasilData(resultados as BrasilRawData[]);
+        falhas = await this.processBrasilData(resultados as BrasilRawData[]);
         break;
       case 'PE':
-        await this.processPeruData(resultados as PeruRawData[]);
+        falhas = await this.processPeruData(resultados as PeruRawData[]);
         break;
       case 'CL':
-        await this.processChileData(resultados as ChileRawData[]);
+        falhas = await this.processChileData(resultados as ChileRawData[]);
         break;
       default:
         throw new Error(`País não suportado: ${countryCode}`);
@@ -566,9 +587,12 @@ export class DataTransformer {
         parameters: { descricao },
         totalRecords: total,
         executionTime: 0, // Será calculado pela API
-        status: 'SUCCESS',
+        status: falhas ? 'PARTIAL' : 'SUCCESS',
+        errorMessage: falhas ? `${falhas} de ${resultados.length} registros não gravados` : undefined,
       }
     });
+
+    return { total: resultados.length, falhas };
   }
 
   /**
@@ -1,5 +1,5 @@
 import { FastifyInstance, FastifyPluginAsync } from 'fastify';
-import { queryChileImport } from '../services/chileService';
+import { queryChileImport, commitChileDelta } from '../services/chileService';
 import { DataTransformer } from '../database/data-transformer';
 import { PrismaClient, Prisma } from '@prisma/client';
 
@@ -7,6 +7,11 @@ interface ChileBody {
   ano: number;
   mes: number; // 1..12
   limit?: number; // opcional
+  importador?: string; // opcional: NUM_UNICO_IMPORTADOR
+  aranc?: string; // opcional: ARANC-NAC
+  paOrig?: string; // opcional: PA_ORIG
+  numencriptado?: string; // opcional: NUMENCRIPTADO
+  delta?: boolean; // opcional: só novas/alteradas/removidas desde o último delta do mês
 }
 
 const chileRoutes: FastifyPluginAsync = async (app: FastifyInstance) => {
@@ -18,15 +23,24 @@ const chileRoutes: FastifyPluginAsync = async (app: FastifyInstance) => {
           ano: { type: 'integer', minimum: 1900, maximum: 2100 },
           mes: { type: 'integer', minimum: 1, maximum: 12 },
           limit: { type: 'integer', minimum: 1 },
+          importador: { type: 'string', minLength: 1 },
+          aranc: { type: 'string', minLength: 1 },
+          paOrig: { type: 'string', minLength: 1 },
+          numencriptado: { type: 'string', minLength: 1 },
+          delta: { type: 'boolean' },
         },
         required: ['ano', 'mes'],
         additionalProperties: false,
       },
     },
   }, async (request, reply) => {
-    const { ano, mes, limit } = request.body;
+    const { ano, mes, limit, importador, aranc, paOrig, numencriptado, delta } = request.body;
+    if (delta && (limit || importador || aranc || paOrig || numencriptado)) {
+      // o delta compara o mês inteiro com o último envio
+      return reply.code(400).send({ error: 'invalid_delta', detail: 'delta não combina com limit nem filtros' });
+    }
     // Consultar o robô Python
-    const raw = await queryChileImport(ano, mes, limit);
+    const raw = await queryChileImport(ano, mes, limit, { importador, aranc, paOrig, numencriptado }, { delta });
 
     // Garantir country_code compatível com a base ('CL') e preparar para persistência
     const resultados = Array.isArray(raw?.resultados) ? raw.resultados : [];
@@ -35,21 +49,40 @@ const chileRoutes: FastifyPluginAsync = async (app: FastifyInstance) => {
       country_code: 'CL',
     }));
 
-    // Persistir em background (transformação e gravação)
-    const transformer = new DataTransformer();
-    await transformer.initializeBaseData();
-    await transformer.processRobotResponse({
-      descricao: raw?.descricao ?? `Importações do Chile ${ano}-${mes}`,
-      total: resultadosNormalizados.length,
-      resultados: resultadosNormalizados,
-    });
-    await transformer.disconnect();
+    // Persistir (transformação e gravação); um delta sem mudanças vem vazio
+    let falhas = 0;
+    if (resultadosNormalizados.length > 0) {
+      const transformer = new DataTransformer();
+      try {
+        await transformer.initializeBaseData();
+        ({ falhas } = await transformer.processRobotResponse({
+          descricao: raw?.descricao ?? `Importações do Chile ${ano}-${mes}`,
+          total: resultadosNormalizados.length,
+          resultados: resultadosNormalizados,
+        }));
+      } finally {
+        await transformer.disconnect();
+      }
+    }
+
+    // O manifesto do delta só avança depois que tudo foi gravado; com falhas,
+    // o próximo delta do mês reenvia as mesmas linhas
+    let deltaConfirmado: boolean | undefined;
+    if (delta && typeof raw?.delta?.lote === 'string') {
+      deltaConfirmado = falhas === 0 ? await commitChileDelta(ano, mes, raw.delta.lote) : false;
+      if (!deltaConfirmado) {
+        request.log.warn({ ano, mes, lote: raw.delta.lote, falhas }, 'Delta do Chile não confirmado');
+      }
+    }
 
     // Retornar o mesmo formato do robô (para compatibilidade com o cliente)
     reply.header('Content-Type', 'application/json; charset=utf-8');
     return {
       descricao: raw?.descricao ?? `Importações do Chile ${ano}-${mes}`,
       total: resultados.length,
+      ...(typeof raw?.linhas_lidas === 'number' ? { linhas_lidas: raw.linhas_lidas } : {}),
+      ...(raw?.delta ? { delta: { ...raw.delta, ...(deltaConfirmado !== undefined ? { confirmado: deltaConfirmado } : {}) } } : {}),
+      ...(falhas > 0 ? { falhas } : {}),
       resultados,
     };
   });
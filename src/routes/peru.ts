@@ -241,6 +241,9 @@ const peruRoutes: FastifyPluginAsync = async (app: FastifyInstance) => {
         descricao,
         ruc,
         total: resultadosComPais.length,
+        ...(typeof data?.motor === 'string' ? { motor: data.motor } : {}),
+        ...(data?.parcial ? { parcial: true, janelas_parciais: data.janelas_parciais } : {}),
+        ...(data?.cache ? { cache: data.cache } : {}),
         persisted: true,
       });
     } catch (err: any) {
@@ -2,7 +2,24 @@ import path from 'path';
 import { runProcess } from '../utils/runProcess';
 import { PYTHON_BIN, BOT_DEBUG } from '../config/env';
 
-export async function queryChileImport(ano: number | string, mes: number | string, limit?: number): Promise<any> {
+export interface ChileFiltros {
+  importador?: string; // NUM_UNICO_IMPORTADOR (vírgula separa vários)
+  aranc?: string;      // ARANC-NAC
+  paOrig?: string;     // PA_ORIG
+  numencriptado?: string; // NUMENCRIPTADO
+}
+
+export interface ChileOpcoes {
+  delta?: boolean; // só linhas novas/alteradas/removidas desde o último delta do mês
+}
+
+export async function queryChileImport(
+  ano: number | string,
+  mes: number | string,
+  limit?: number,
+  filtros?: ChileFiltros,
+  opcoes?: ChileOpcoes
+): Promise<any> {
   const scriptPath = path.resolve(process.cwd(), 'src', 'bot', 'chile', 'robo_chile.py');
 
   const args: string[] = [scriptPath];
@@ -14,6 +31,13 @@ export async function queryChileImport(ano: number | string, mes: number | strin
     args.push('--enable-limit', '--limit', String(Math.floor(limit)));
   }
 
+  // Filtros aplicados pelo próprio robô, antes de montar os registros
+  if (filtros?.importador) args.push('--importador', String(filtros.importador));
+  if (filtros?.aranc) args.push('--aranc', String(filtros.aranc));
+  if (filtros?.paOrig) args.push('--pa-orig', String(filtros.paOrig));
+  if (filtros?.numencriptado) args.push('--numencriptado', String(filtros.numencriptado));
+  if (opcoes?.delta) args.push('--delta');
+
   const res = await runProcess(PYTHON_BIN, args, {
     env: {
       PYTHONIOENCODING: 'utf-8',
@@ -31,4 +55,38 @@ export async function queryChileImport(ano: number | string, mes: number | strin
   } catch (e: any) {
     throw new Error(`invalid_json_from_bot: ${e.message}; raw=${trimmed.slice(0, 500)}`);
   }
-}
\ No newline at end of file
+}
+
+/**
+ * Confirma ao robô que o delta do `lote` (delta.lote de um --delta) foi gravado:
+ * só então o manifesto do mês avança. Devolve false se o lote já não é o pendente.
+ */
+export async function commitChileDelta(
+  ano: number | string,
+  mes: number | string,
+  lote: string
+): Promise<boolean> {
+  const scriptPath = path.resolve(process.cwd(), 'src', 'bot', 'chile', 'robo_chile.py');
+
+  const args: string[] = [scriptPath];
+  if (BOT_DEBUG === '1') args.push('--debug');
+  args.push(String(ano), String(mes), '--delta-commit', lote);
+
+  const res = await runProcess(PYTHON_BIN, args, {
+    env: {
+      PYTHONIOENCODING: 'utf-8',
+      PYTHONUTF8: '1',
+    },
+  });
+
+  if (res.code !== 0) {
+    throw new Error(`python_process_error: code=${res.code}; stderr=${res.stderr}`);
+  }
+
+  const trimmed = res.stdout.trim();
+  try {
+    return JSON.parse(trimmed)?.confirmado === true;
+  } catch (e: any) {
+    throw new Error(`invalid_json_from_bot: ${e.message}; raw=${trimmed.slice(0, 500)}`);
+  }
+}
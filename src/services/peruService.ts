@@ -1,8 +1,73 @@
 import path from 'path';
+import net from 'net';
 import { runProcess } from '../utils/runProcess';
-import { PYTHON_BIN, BOT_DEBUG } from '../config/env';
+import { PYTHON_BIN, BOT_DEBUG, ADUANET_WORKER, ADUANET_WORKER_TIMEOUT_MS } from '../config/env';
+
+// Consulta pelo worker (robo_aduanet.py --socket): uma linha JSON de ida, uma de volta.
+// Sem resposta em `timeoutMs` (conexão + consulta), rejeita com code ETIMEDOUT;
+// `sent` diz se a consulta chegou a ser enviada (o worker pode ainda estar nela).
+function queryAduanetWorker(address: string, query: Record<string, string>, timeoutMs: number): Promise<any> {
+  return new Promise((resolve, reject) => {
+    const m = /^(.*):(\d+)$/.exec(address);
+    const socket = m
+      ? net.createConnection({ host: m[1] || '127.0.0.1', port: Number(m[2]) })
+      : net.createConnection({ path: address });
+    let sent = false;
+    const timer = setTimeout(() => {
+      const err: any = new Error(`aduanet_worker_timeout: ${timeoutMs}ms`);
+      err.code = 'ETIMEDOUT';
+      err.sent = sent;
+      reject(err);
+      socket.destroy();
+    }, timeoutMs);
+    socket.on('close', () => clearTimeout(timer));
+    let buffer = '';
+    socket.setEncoding('utf8');
+    socket.on('connect', () => {
+      socket.write(JSON.stringify(query) + '\n');
+      sent = true;
+    });
+    socket.on('data', (chunk: string) => {
+      buffer += chunk;
+      const nl = buffer.indexOf('\n');
+      if (nl < 0) return;
+      socket.end();
+      const line = buffer.slice(0, nl);
+      try {
+        const data = JSON.parse(line);
+        if (data?.erro) {
+          reject(new Error(`aduanet_worker_error: ${data.erro}`));
+        } else {
+          resolve(data);
+        }
+      } catch (e: any) {
+        reject(new Error(`invalid_json_from_worker: ${e.message}; raw=${line.slice(0, 500)}`));
+      }
+    });
+    socket.on('error', reject);
+    socket.on('close', () => reject(new Error('aduanet_worker_closed')));
+  });
+}
 
 export async function queryAduanetPeru(dataDe: string, dataAte: string, cnpj: string): Promise<any> {
+  if (ADUANET_WORKER) {
+    try {
+      return await queryAduanetWorker(ADUANET_WORKER, {
+        data_de: String(dataDe),
+        data_ate: String(dataAte),
+        tipo: 'importacao',
+        documento: String(cnpj),
+      }, ADUANET_WORKER_TIMEOUT_MS);
+    } catch (err: any) {
+      // worker fora do ar ou sem aceitar a conexão: segue pelo processo avulso.
+      // Prazo estourado com a consulta já enviada não cai no avulso: o worker
+      // continua nela, e repeti-la em paralelo dobraria a carga no Aduanet.
+      const semWorker = err?.code === 'ECONNREFUSED' || err?.code === 'ENOENT'
+        || (err?.code === 'ETIMEDOUT' && !err.sent);
+      if (!semWorker) throw err;
+    }
+  }
+
   const scriptPath = path.resolve(process.cwd(), 'src', 'bot', 'peru', 'robo_aduanet.py');
 
   const args = [scriptPath];